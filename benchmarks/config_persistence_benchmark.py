@@ -0,0 +1,83 @@
+import argparse
+import json
+import os
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from benchmarks.common import rss_mb
+
+
+def _write_config(path: str, reminders: int, messages: int) -> None:
+    config = {
+        '_tg_key': '0:benchmark',
+        '_tg_chat_id': 1,
+        '_random_source': 'secrets',
+        '_chats': [{
+            '_chat_id': 1,
+            '_hide_text': False,
+            '_reminders': [{
+                '_name': f'profile-{reminder}',
+                '_messages': [f'profile {reminder} message {message}' for message in range(messages)],
+                '_time_range': [5, 15],
+                '_subscribers': []
+            } for reminder in range(reminders)]
+        }]
+    }
+    with open(path, 'w', encoding='utf8') as json_file:
+        json.dump(config, json_file, ensure_ascii=False, indent=4)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Full rewrite per change vs debounced incremental writer')
+    parser.add_argument('--reminders', type=int, default=10000)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--changes', type=int, default=100)
+    args = parser.parse_args()
+
+    from config import Config
+
+    with TemporaryDirectory() as directory:
+        os.chdir(directory)
+        _write_config('config.json', args.reminders, args.messages)
+        size_mb = os.path.getsize('config.json') / 1024 / 1024
+        config = Config()
+        print(f'config: {args.reminders} reminders x {args.messages} messages, '
+              f'{size_mb:.1f} MiB on disk, rss {rss_mb():.0f} MiB')
+        reminder_configs = list(config.reminders.values())
+
+        # the old behaviour: every setter serialized and rewrote the whole file
+        started = perf_counter()
+        config_dict = {
+            '_tg_key': config.tg_key,
+            '_tg_chat_id': config.tg_chat_id,
+            '_random_source': config.random_source,
+            '_chats': [chat_config.to_dict() for chat_config in config.chats.values()]
+        }
+        with open('config.json', 'w', encoding='utf8') as json_file:
+            json.dump(config_dict, json_file, ensure_ascii=False, indent=4)
+        full_rewrite = perf_counter() - started
+        print(f'full rewrite per change: {full_rewrite:.3f}s, {args.changes} changes: {full_rewrite * args.changes:.1f}s')
+
+        # first flush fills the per-reminder serialization cache
+        reminder_configs[0].time_range = (5, 15)
+        started = perf_counter()
+        config.flush()
+        print(f'first flush with a cold cache: {perf_counter() - started:.3f}s')
+        reminder_configs[0].time_range = (5, 16)
+        started = perf_counter()
+        config.flush()
+        print(f'incremental flush after one change: {perf_counter() - started:.3f}s')
+
+        started = perf_counter()
+        for index in range(args.changes):
+            reminder_configs[index % len(reminder_configs)].time_range = (5, 17 + index)
+        setters = perf_counter() - started
+        started = perf_counter()
+        config.flush()
+        print(f'{args.changes} changes in one window: setters {setters * 1000:.1f}ms, '
+              f'single flush {perf_counter() - started:.3f}s')
+        os.chdir('/')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from random import random, uniform, randint
+from threading import Condition, Lock, Thread
+from time import sleep, time
+from typing import Any, Optional
+from urllib.parse import parse_qs, urlparse
+
+
+class FaultInjection:
+    # latency is uniform in [latency, latency + jitter] seconds, rates are probabilities per request
+    latency: float
+    jitter: float
+    rate_limit_rate: float
+    retry_after: int
+    failure_rate: float
+
+    def __init__(self,
+                 latency: float = 0.0,
+                 jitter: float = 0.0,
+                 rate_limit_rate: float = 0.0,
+                 retry_after: int = 1,
+                 failure_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.failure_rate = failure_rate
+
+    def delay(self) -> None:
+        if self.latency or self.jitter:
+            sleep(self.latency + uniform(0, self.jitter))
+
+
+class _FakeServer:
+    _server: ThreadingHTTPServer
+    faults: FaultInjection
+    requests: dict[str, int]
+    _lock: Lock
+
+    def __init__(self, faults: Optional[FaultInjection] = None):
+        self.faults = faults if faults is not None else FaultInjection()
+        self.requests = dict()
+        self._lock = Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        Thread(target=self._server.serve_forever, name=type(self).__name__, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    def shutdown(self) -> None:
+        self._server.shutdown()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+    def _handle(self, path: str, parameters: dict[str, Any]) -> tuple[int, str, str]:
+        raise NotImplementedError
+
+    def _handler_class(self) -> type:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self) -> None:
+                url = urlparse(self.path)
+                self._reply(url.path, {key: values[0] for key, values in parse_qs(url.query).items()})
+
+            def do_POST(self) -> None:
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length).decode('utf8') if length else ''
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    parameters = json.loads(body) if body else dict()
+                else:
+                    parameters = {key: values[0] for key, values in parse_qs(body).items()}
+                parameters.update({key: values[0] for key, values in parse_qs(url.query).items()})
+                self._reply(url.path, parameters)
+
+            def _reply(self, path: str, parameters: dict[str, Any]) -> None:
+                status, content_type, text = server._handle(path, parameters)
+                body = text.encode('utf8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        return Handler
+
+
+class FakeTelegramServer(_FakeServer):
+    _message_ids: count
+    _update_ids: count
+    _updates: list[dict[str, Any]]
+    _updates_available: Condition
+    sent: list[tuple[float, int, str]]
+
+    def __init__(self, faults: Optional[FaultInjection] = None):
+        self._message_ids = count(1)
+        self._update_ids = count(1)
+        self._updates = list()
+        self._updates_available = Condition()
+        self.sent = list()
+        super().__init__(faults)
+
+    # value for telebot.apihelper.API_URL
+    @property
+    def api_url(self) -> str:
+        return self.url + '/bot{0}/{1}'
+
+    def text_update(self, chat_id: int, text: str) -> dict[str, Any]:
+        return {
+            'update_id': next(self._update_ids),
+            'message': self.__message(chat_id, text, {'id': chat_id, 'is_bot': False, 'first_name': 'load'})
+        }
+
+    def push_text_update(self, chat_id: int, text: str) -> None:
+        with self._updates_available:
+            self._updates.append(self.text_update(chat_id, text))
+            self._updates_available.notify_all()
+
+    def _handle(self, path: str, parameters: dict[str, Any]) -> tuple[int, str, str]:
+        method = path.rsplit('/', 1)[-1]
+        self._count(method)
+        if method == 'getUpdates':
+            return self.__ok(self.__get_updates(int(parameters.get('offset', 0)),
+                                                int(parameters.get('limit', 100)),
+                                                float(parameters.get('timeout', 0))))
+
+        self.faults.delay()
+        if random() < self.faults.rate_limit_rate:
+            return 429, 'application/json', json.dumps({
+                'ok': False,
+                'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.faults.retry_after}',
+                'parameters': {'retry_after': self.faults.retry_after}
+            })
+        if random() < self.faults.failure_rate:
+            return 500, 'application/json', json.dumps({
+                'ok': False, 'error_code': 500, 'description': 'Internal Server Error'})
+
+        if method == 'sendMessage':
+            chat_id = int(parameters['chat_id'])
+            with self._lock:
+                self.sent.append((time(), chat_id, parameters.get('text', '')))
+            return self.__ok(self.__message(chat_id, parameters.get('text', '')))
+        if method == 'getMe':
+            return self.__ok({'id': 1, 'is_bot': True, 'first_name': 'fake', 'username': 'fake_bot'})
+        return self.__ok(True)
+
+    # long polling with the Bot API offset semantics, waits are capped to keep shutdown fast
+    def __get_updates(self, offset: int, limit: int, timeout: float) -> list[dict[str, Any]]:
+        with self._updates_available:
+            if offset < 0:
+                return self._updates[offset:]
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            if not self._updates:
+                self._updates_available.wait(min(timeout, 1.0))
+            return self._updates[:limit]
+
+    def __message(self, chat_id: int, text: str, sender: Optional[dict[str, Any]] = None) -> dict[str, Any]:
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': text
+        }
+        if sender is not None:
+            message['from'] = sender
+        return message
+
+    @staticmethod
+    def __ok(result: Any) -> tuple[int, str, str]:
+        return 200, 'application/json', json.dumps({'ok': True, 'result': result})
+
+
+class FakeRandomOrgServer(_FakeServer):
+    # value for RandomOrgRandomSource.URL
+    @property
+    def integers_url(self) -> str:
+        return self.url + '/integers/'
+
+    def _handle(self, path: str, parameters: dict[str, Any]) -> tuple[int, str, str]:
+        self._count('integers')
+        self.faults.delay()
+        if random() < self.faults.failure_rate or random() < self.faults.rate_limit_rate:
+            return 503, 'text/plain', 'Error: service unavailable'
+        numbers = [str(randint(int(parameters['min']), int(parameters['max']))) for _ in range(int(parameters['num']))]
+        return 200, 'text/plain', '\n'.join(numbers) + '\n'
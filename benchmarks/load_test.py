@@ -0,0 +1,219 @@
+import argparse
+import json
+import os
+from concurrent.futures import Future
+from tempfile import TemporaryDirectory
+from threading import Lock
+from time import monotonic, sleep, time
+from typing import Any, Callable
+
+from requests import Session
+from telebot import apihelper
+
+from benchmarks.common import percentile, rss_mb
+from benchmarks.fake_servers import FakeRandomOrgServer, FakeTelegramServer, FaultInjection
+
+
+def _write_config(chats: dict[int, list[dict[str, Any]]], random_source: str) -> None:
+    config = {
+        '_tg_key': '0:load-test',
+        '_tg_chat_id': next(iter(chats)),
+        '_random_source': random_source,
+        '_chats': [{'_chat_id': chat_id, '_hide_text': False, '_reminders': reminders}
+                   for chat_id, reminders in chats.items()]
+    }
+    with open('config.json', 'w', encoding='utf8') as json_file:
+        json.dump(config, json_file, ensure_ascii=False)
+
+
+def _report(title: str, values: dict[str, Any]) -> None:
+    print(title)
+    for key, value in values.items():
+        print(f'  {key:<24} {value:.3f}' if isinstance(value, float) else f'  {key:<24} {value}')
+
+
+def run_reminders(args: argparse.Namespace, telegram_server: FakeTelegramServer) -> None:
+    # every reminder belongs to the first chat and fans out to all the others
+    chat_ids = list(range(1, args.chats + 1))
+    _write_config({
+        chat_ids[0]: [{
+            '_name': f'profile-{index}',
+            '_messages': [f'profile {index} message {message}' for message in range(args.messages)],
+            '_time_range': [args.min_time, args.max_time],
+            '_subscribers': chat_ids[1:]
+        } for index in range(args.reminders)]
+    }, args.random_source)
+
+    from config import Config
+    from random_source import create_random_source
+    from reminder import Reminder
+    from scheduler import Scheduler
+    from telegram import Telegram
+
+    Reminder.TIME_UNIT = 60 / args.time_scale
+    config = Config()
+    telegram = Telegram(config)
+    scheduler = Scheduler()
+    scheduler.daemon = True
+    random_source = create_random_source(config.random_source)
+
+    latencies: list[float] = list()
+    latencies_lock = Lock()
+
+    def send_async(message: str, **kwargs) -> Future:
+        enqueued_at = monotonic()
+        future = telegram.send_async(message, **kwargs)
+
+        def done(_: Future) -> None:
+            with latencies_lock:
+                latencies.append(monotonic() - enqueued_at)
+
+        future.add_done_callback(done)
+        return future
+
+    rss_before = rss_mb()
+    started = monotonic()
+    reminders = [Reminder(reminder_config, chat_ids[0], send_async, scheduler, random_source)
+                 for reminder_config in config.chats[chat_ids[0]].reminders.values()]
+    scheduler.start()
+    scheduler.add_many(reminders)
+    startup = monotonic() - started
+
+    sleep(args.duration)
+    queue_metrics = telegram.send_queue.metrics()
+    delivered = len(telegram_server.sent)
+    with latencies_lock:
+        snapshot = list(latencies)
+    _report(f'reminders: {args.reminders} reminders x {args.chats} chats, '
+            f'time compressed {args.time_scale:g}x, {args.duration:g}s', {
+                'startup_s': startup,
+                'delivered_messages': delivered,
+                'throughput_msg_per_s': delivered / args.duration,
+                'send_latency_p50_s': percentile(snapshot, 0.5),
+                'send_latency_p99_s': percentile(snapshot, 0.99),
+                'queue_depth': queue_metrics['depth'],
+                'coalesced': queue_metrics['coalesced'],
+                'rate_limited': queue_metrics['rate_limited'],
+                'errors': queue_metrics['errors'],
+                'api_requests': sum(telegram_server.requests.values()),
+                'rss_growth_mb': rss_mb() - rss_before
+            })
+
+
+def run_menu_storm(args: argparse.Namespace, telegram_server: FakeTelegramServer) -> None:
+    chat_ids = list(range(1, args.chats + 1))
+    _write_config({chat_id: [{
+        '_name': 'profile',
+        '_messages': ['message'],
+        '_time_range': [60, 120],
+        '_subscribers': []
+    }] for chat_id in chat_ids}, args.random_source)
+
+    from config import Config
+    from random_source import create_random_source
+    from reminder import Reminder
+    from scheduler import Scheduler
+    from telegram import BotMenuThread, Telegram, WebhookServer
+
+    config = Config()
+    telegram = Telegram(config)
+    scheduler = Scheduler()
+    random_source = create_random_source(config.random_source)
+    reminders = {chat_id: {name: Reminder(reminder_config, chat_id, telegram.send_async, scheduler, random_source)
+                           for name, reminder_config in chat_config.reminders.items()}
+                 for chat_id, chat_config in config.chats.items()}
+    push: Callable[[int, str], None] = telegram_server.push_text_update
+    webhook = None
+    if args.webhook:
+        # updates are posted straight to the embedded server instead of being long polled
+        url = f'http://127.0.0.1:{args.webhook_port}/webhook'
+        webhook = WebhookServer(telegram.bot, url, '127.0.0.1', args.webhook_port, 'load-test', args.webhook_workers)
+        session = Session()
+
+        def push(chat_id: int, text: str) -> None:
+            session.post(url, json=telegram_server.text_update(chat_id, text),
+                         headers={'X-Telegram-Bot-Api-Secret-Token': 'load-test'}).raise_for_status()
+
+    menu = BotMenuThread(telegram, reminders, webhook)
+    menu.daemon = True
+    menu.start()
+    # polling starts by skipping pending updates, the storm must come after that
+    sleep(2)
+
+    # every action of the script gets exactly one reply
+    script = ['/settings', 'Настройка профилей', 'profile', 'Назад', 'Закрыть настройки']
+    rss_before = rss_mb()
+    pushed_at: dict[int, list[float]] = {chat_id: list() for chat_id in chat_ids}
+    started = time()
+    for _ in range(args.actions // len(script) or 1):
+        for action in script:
+            for chat_id in chat_ids:
+                pushed_at[chat_id].append(time())
+                push(chat_id, action)
+
+    expected = sum(len(times) for times in pushed_at.values())
+    deadline = monotonic() + args.duration
+    while len(telegram_server.sent) < expected and monotonic() < deadline:
+        sleep(0.1)
+    elapsed = time() - started
+
+    replies: dict[int, list[float]] = {chat_id: list() for chat_id in chat_ids}
+    for sent_at, chat_id, _ in list(telegram_server.sent):
+        replies[chat_id].append(sent_at)
+    latencies = [reply - pushed
+                 for chat_id in chat_ids
+                 for pushed, reply in zip(pushed_at[chat_id], replies[chat_id])]
+    _report(f'menu storm ({"webhook" if args.webhook else "polling"}): '
+            f'{args.chats} chats x {expected // args.chats} actions', {
+        'handled_updates': len(latencies),
+        'expected_updates': expected,
+        'throughput_updates_per_s': len(latencies) / elapsed,
+        'reply_latency_p50_s': percentile(latencies, 0.5),
+        'reply_latency_p99_s': percentile(latencies, 0.99),
+        'api_requests': sum(telegram_server.requests.values()),
+        'rss_growth_mb': rss_mb() - rss_before
+    })
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Load test against local Telegram Bot API and random.org stand-ins')
+    parser.add_argument('scenario', choices=['reminders', 'menu'])
+    parser.add_argument('--reminders', type=int, default=1000)
+    parser.add_argument('--chats', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--min-time', type=int, default=5, help='minutes')
+    parser.add_argument('--max-time', type=int, default=15, help='minutes')
+    parser.add_argument('--time-scale', type=float, default=600, help='how many times faster than real time')
+    parser.add_argument('--actions', type=int, default=10, help='menu actions per chat')
+    parser.add_argument('--webhook', action='store_true', help='menu scenario: receive updates by webhook')
+    parser.add_argument('--webhook-port', type=int, default=18443)
+    parser.add_argument('--webhook-workers', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--random-source', default='secrets', choices=['secrets', 'numpy', 'random_org'])
+    parser.add_argument('--latency', type=float, default=0.0, help='fake API latency, seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='fake API latency jitter, seconds')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='share of requests answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='share of requests answered with 500')
+    args = parser.parse_args()
+
+    faults = FaultInjection(args.latency, args.jitter, args.rate_limit_rate, args.retry_after, args.failure_rate)
+    telegram_server = FakeTelegramServer(faults)
+    random_org_server = FakeRandomOrgServer(FaultInjection(args.latency, args.jitter, 0, 1, args.failure_rate))
+    apihelper.API_URL = telegram_server.api_url
+
+    from random_source import RandomOrgRandomSource
+    RandomOrgRandomSource.URL = random_org_server.integers_url
+
+    with TemporaryDirectory() as directory:
+        os.chdir(directory)
+        if args.scenario == 'reminders':
+            run_reminders(args, telegram_server)
+        else:
+            run_menu_storm(args, telegram_server)
+        # the scheduler, queues and polling threads never return
+        os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
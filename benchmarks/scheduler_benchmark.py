@@ -0,0 +1,108 @@
+import argparse
+import os
+import subprocess
+import sys
+from random import uniform
+from threading import Thread, Lock
+from time import sleep, perf_counter, process_time
+
+from benchmarks.common import rss_mb
+from scheduler import Scheduler
+
+
+class _Counter:
+    _lock: Lock
+    value: int
+
+    def __init__(self):
+        self._lock = Lock()
+        self.value = 0
+
+    def increment(self) -> None:
+        with self._lock:
+            self.value += 1
+
+
+class _StubJob:
+    _name: str
+    _counter: _Counter
+    _interval: tuple[float, float]
+
+    def __init__(self, name: str, counter: _Counter, interval: tuple[float, float]):
+        self._name = name
+        self._counter = counter
+        self._interval = interval
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def next_timeout(self) -> float:
+        return uniform(*self._interval)
+
+    def fire(self) -> None:
+        self._counter.increment()
+
+    def on_scheduled(self, deadline: float) -> None:
+        pass
+
+
+class _SleepingThread(Thread):
+    def __init__(self, job: _StubJob):
+        super().__init__(daemon=True)
+        self._job = job
+
+    def run(self) -> None:
+        while True:
+            sleep(self._job.next_timeout())
+            self._job.fire()
+
+
+def _run_mode(mode: str, profiles: int, duration: float, interval: tuple[float, float]) -> None:
+    counter = _Counter()
+    jobs = [_StubJob(f'profile-{index}', counter, interval) for index in range(profiles)]
+    rss_before = rss_mb()
+    started = perf_counter()
+    cpu_started = process_time()
+
+    if mode == 'threads':
+        for job in jobs:
+            _SleepingThread(job).start()
+    else:
+        scheduler = Scheduler()
+        scheduler.daemon = True
+        scheduler.start()
+        scheduler.add_many(jobs)
+    startup = perf_counter() - started
+
+    sleep(duration)
+    cpu = process_time() - cpu_started
+    print(f'{mode:>9}: profiles={profiles} startup={startup:.2f}s '
+          f'rss={rss_mb() - rss_before:.1f}MiB cpu={cpu:.2f}s fires={counter.value}', flush=True)
+    # skip interpreter teardown: the scheduler loop and the sleeping threads never return
+    os._exit(0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Thread-per-reminder vs single scheduler')
+    parser.add_argument('--profiles', type=int, default=10000)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--min-interval', type=float, default=1)
+    parser.add_argument('--max-interval', type=float, default=5)
+    parser.add_argument('--mode', choices=['threads', 'scheduler'])
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        _run_mode(args.mode, args.profiles, args.duration, (args.min_interval, args.max_interval))
+        return
+
+    # every mode runs in a fresh interpreter so memory numbers do not leak into each other
+    for mode in ('threads', 'scheduler'):
+        subprocess.run([sys.executable, '-m', 'benchmarks.scheduler_benchmark', '--mode', mode,
+                        '--profiles', str(args.profiles), '--duration', str(args.duration),
+                        '--min-interval', str(args.min_interval), '--max-interval', str(args.max_interval)],
+                       check=True)
+
+
+if __name__ == '__main__':
+    main()
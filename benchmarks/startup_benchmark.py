@@ -0,0 +1,67 @@
+import argparse
+import gc
+import json
+import os
+import tracemalloc
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from benchmarks.config_persistence_benchmark import _write_config
+
+
+def _measure(title: str, load) -> object:
+    gc.collect()
+    tracemalloc.start()
+    started = perf_counter()
+    result = load()
+    elapsed = perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{title:<40} {elapsed:7.3f}s  retained {current / 1024 / 1024:7.1f} MiB  peak {peak / 1024 / 1024:7.1f} MiB')
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Startup time and memory of eager vs lazy config loading')
+    parser.add_argument('--reminders', type=int, default=10000)
+    parser.add_argument('--messages', type=int, default=100)
+    args = parser.parse_args()
+
+    from config import Config, ReminderConfig
+    from random_source import SecretsRandomSource
+    from reminder import Reminder
+    from scheduler import Scheduler
+
+    with TemporaryDirectory() as directory:
+        os.chdir(directory)
+        _write_config('config.json', args.reminders, args.messages)
+        size_mb = os.path.getsize('config.json') / 1024 / 1024
+        print(f'config: {args.reminders} reminders x {args.messages} messages, {size_mb:.1f} MiB on disk')
+
+        # the old loader: the whole document is decoded and every message list is built right away
+        def load_eager() -> list[ReminderConfig]:
+            with open('config.json', 'r', encoding='utf8') as json_file:
+                loaded_data = json.load(json_file)
+            return [ReminderConfig(reminder['_name'], reminder['_messages'], tuple(reminder['_time_range']),
+                                   lambda: None, reminder['_subscribers'])
+                    for chat in loaded_data['_chats'] for reminder in chat['_reminders']]
+
+        eager = _measure('eager json.load', load_eager)
+        del eager
+        config = _measure('lazy Config()', Config)
+
+        scheduler = Scheduler()
+        random_source = SecretsRandomSource()
+        reminders = _measure('Reminder objects (counts messages)',
+                             lambda: [Reminder(reminder_config, chat_id, lambda *_, **__: None, scheduler,
+                                               random_source)
+                                      for chat_id, chat_config in config.chats.items()
+                                      for reminder_config in chat_config.reminders.values()])
+        _measure('decode every message list',
+                 lambda: sum(len(reminder.messages) for reminder in reminders))
+        # the config writer would otherwise try to save into the removed directory
+        os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1 +1,5 @@
 from .config import Config
+from .chat_config import ChatConfig
+from .reminder_config import ReminderConfig
+from .config_changes import ConfigChanges
+from .file_watcher import FileWatcher
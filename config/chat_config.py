@@ -0,0 +1,89 @@
+from typing import Callable, Any, Optional
+
+from .persistence import serialize_list, serialize_object, serialize_value
+from .reminder_config import ReminderConfig
+
+
+class ChatConfig:
+    __slots__ = ('_chat_id', '_hide_text', '_reminders', '_dump', '_variables')
+
+    _chat_id: int
+    _hide_text: bool
+    # values of {name} in the messages sent to the chat
+    _variables: dict[str, str]
+    _reminders: dict[str, ReminderConfig]
+    _dump: Callable[[], None]
+
+    def __init__(self,
+                 chat_id: int,
+                 hide_text: bool,
+                 reminders: dict[str, ReminderConfig],
+                 dump_callback: Callable[[], None],
+                 variables: Optional[dict[str, str]] = None):
+        self._chat_id = chat_id
+        self._hide_text = hide_text
+        self._reminders = reminders
+        self._dump = dump_callback
+        self._variables = variables if variables is not None else dict()
+
+    @property
+    def chat_id(self) -> int:
+        return self._chat_id
+
+    @property
+    def hide_text(self) -> bool:
+        return self._hide_text
+
+    @hide_text.setter
+    def hide_text(self, value: bool) -> None:
+        self._hide_text = value
+        self._dump()
+
+    @property
+    def variables(self) -> dict[str, str]:
+        return self._variables
+
+    # the dict is replaced, not changed in place, so sends in progress keep the values they started with
+    @variables.setter
+    def variables(self, new_variables: dict[str, str]) -> None:
+        self._variables = new_variables
+        self._dump()
+
+    @property
+    def reminders(self) -> dict[str, ReminderConfig]:
+        return self._reminders
+
+    # the reminders dict is replaced, not changed in place, so other threads can keep iterating over it
+    def add_reminder(self, reminder_config: ReminderConfig) -> None:
+        reminders = dict(self._reminders)
+        reminders[reminder_config.name] = reminder_config
+        self._reminders = reminders
+        self._dump()
+
+    def remove_reminder(self, name: str) -> None:
+        reminders = dict(self._reminders)
+        del reminders[name]
+        self._reminders = reminders
+        self._dump()
+
+    # values written in config.json as numbers are sent as text
+    @staticmethod
+    def variables_from(chat_serialized: dict[str, Any]) -> dict[str, str]:
+        return {name: str(value) for name, value in chat_serialized.get('_variables', dict()).items()}
+
+    def to_json(self, level: int) -> list[str]:
+        return serialize_object({
+            '_chat_id': serialize_value(self._chat_id, level + 1),
+            '_hide_text': serialize_value(self._hide_text, level + 1),
+            '_variables': serialize_value(self._variables, level + 1),
+            '_reminders': serialize_list([reminder_config.to_json(level + 2)
+                                          for reminder_config in self._reminders.values()], level + 1)
+        }, level)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            '_chat_id': self._chat_id,
+            '_hide_text': self._hide_text,
+            '_variables': self._variables,
+            '_reminders': list(map(lambda reminder_config: reminder_config.to_dict(), self._reminders.values()))
+        }
@@ -1,23 +1,84 @@
-import json
-from typing import Callable, Any
+import atexit
+import os
+import shutil
+from typing import Callable, Any, Optional
 
+from .chat_config import ChatConfig
+from .config_changes import REMINDER_FIELDS, ConfigChanges, FingerprintKey, fingerprint
+from .lazy_loader import decode_messages, load_document
+from .persistence import ConfigWriter, file_signature, serialize_list, serialize_object, serialize_value
 from .reminder_config import ReminderConfig
+from .schedule_store import ScheduleStore, JsonScheduleStore, SqliteScheduleStore
+from .sqlite_storage import SqliteStorage
 
 
 class Config:
     _tg_key: str
+    # default chat, used when no chat is specified
     _tg_chat_id: int
-    _tg_hide_text: bool
-    _reminders: dict[str, ReminderConfig]
+    _random_source: str
+    # 'json' keeps chats and reminders in config.json, 'sqlite' moves them into _sqlite_path
+    _storage_type: str
+    _sqlite_path: str
+    _storage: Optional[SqliteStorage]
+    # what to do with fires missed while the bot was stopped: 'skip', 'fire_once' or 'fire_all'
+    _catch_up_policy: str
+    # seconds between fires replayed by 'fire_all'
+    _catch_up_spacing: int
+    _schedule_store: ScheduleStore
+    # local /metrics endpoint port and json lines metrics log, metrics are off when both are unset
+    _metrics_port: Optional[int]
+    _metrics_log_path: Optional[str]
+    # updates are received by long polling unless a public webhook url is set
+    _webhook_url: Optional[str]
+    _webhook_host: str
+    _webhook_port: int
+    _webhook_secret: Optional[str]
+    _webhook_workers: int
+    # idle menu sessions are dropped after _session_ttl seconds, they survive restarts only when a path is set
+    _session_ttl: int
+    _sessions_path: Optional[str]
+    # config.json edits are applied without a restart, chats and reminders only with json storage
+    _hot_reload: bool
+    # seconds a graceful shutdown waits for messages still being sent
+    _shutdown_timeout: float
+    # reminders run in worker processes: local ones started by the launcher and remote ones joining the address
+    _shard_workers: int
+    _shard_address: Optional[str]
+    _shard_authkey: Optional[str]
+    # 'profile' spreads single reminders, 'chat' keeps the reminders of a chat together
+    _shard_key: str
+    _chats: dict[int, ChatConfig]
+    _writer: ConfigWriter
+    # signature and fingerprints of config.json as last read, a reload applies only what differs from them
+    _loaded_signature: tuple[int, int, int]
+    _fingerprints: dict[FingerprintKey, bytes]
 
     def __init__(self):
-        with open('config.json', 'r', encoding='utf8') as json_file:
-            loaded_data = json.load(json_file)
-            self._tg_key = loaded_data['_tg_key']
-            self._tg_chat_id = loaded_data['_tg_chat_id']
-            self._tg_hide_text = loaded_data['_tg_hide_text']
-            self._reminders = Config._load_reminder_configs(loaded_data['_reminders'], self._dump)
-            print("Config loaded from file")
+        self._writer = ConfigWriter('config.json', self._serialize)
+        atexit.register(self._writer.flush)
+        self._loaded_signature = file_signature(os.stat('config.json'))
+        # message lists stay undecoded bytes until a reminder needs them
+        loaded_data, raw_messages = load_document('config.json')
+        self.__read_settings(loaded_data)
+        chats_serialized = Config._chats_serialized(loaded_data)
+        if self._storage_type == 'sqlite':
+            self._storage = SqliteStorage(self._sqlite_path)
+            if chats_serialized is not None:
+                self.__migrate_to_sqlite(Config._decode_messages(chats_serialized, raw_messages))
+            self._chats = self._storage.load_chats()
+            self._schedule_store = SqliteScheduleStore(self._storage)
+        else:
+            self._storage = None
+            self._chats = Config._load_chat_configs(chats_serialized or list(), raw_messages, self._dump)
+            self._schedule_store = JsonScheduleStore('schedule.json')
+        # only a reload compares against them
+        self._fingerprints = fingerprint(loaded_data, self.__reloadable_chats(chats_serialized),
+                                         raw_messages) if self._hot_reload else dict()
+        atexit.register(self._schedule_store.flush)
+        if self._tg_chat_id not in self._chats:
+            self._chats[self._tg_chat_id] = self.__create_chat(self._tg_chat_id)
+        print("Config loaded from file")
 
     @property
     def tg_key(self) -> str:
@@ -39,41 +100,434 @@ class Config:
 
     @property
     def tg_hide_text(self) -> bool:
-        return self._tg_hide_text
+        return self.default_chat.hide_text
 
     @tg_hide_text.setter
     def tg_hide_text(self, value: bool) -> None:
-        self._tg_hide_text = value
+        self.default_chat.hide_text = value
+
+    @property
+    def random_source(self) -> str:
+        return self._random_source
+
+    @random_source.setter
+    def random_source(self, value: str) -> None:
+        self._random_source = value
+        self._dump()
+
+    @property
+    def catch_up_policy(self) -> str:
+        return self._catch_up_policy
+
+    @catch_up_policy.setter
+    def catch_up_policy(self, value: str) -> None:
+        self._catch_up_policy = value
+        self._dump()
+
+    @property
+    def catch_up_spacing(self) -> int:
+        return self._catch_up_spacing
+
+    @catch_up_spacing.setter
+    def catch_up_spacing(self, value: int) -> None:
+        self._catch_up_spacing = value
+        self._dump()
+
+    @property
+    def metrics_port(self) -> Optional[int]:
+        return self._metrics_port
+
+    @metrics_port.setter
+    def metrics_port(self, value: Optional[int]) -> None:
+        self._metrics_port = value
+        self._dump()
+
+    @property
+    def metrics_log_path(self) -> Optional[str]:
+        return self._metrics_log_path
+
+    @metrics_log_path.setter
+    def metrics_log_path(self, value: Optional[str]) -> None:
+        self._metrics_log_path = value
+        self._dump()
+
+    @property
+    def webhook_url(self) -> Optional[str]:
+        return self._webhook_url
+
+    @webhook_url.setter
+    def webhook_url(self, value: Optional[str]) -> None:
+        self._webhook_url = value
+        self._dump()
+
+    @property
+    def webhook_host(self) -> str:
+        return self._webhook_host
+
+    @webhook_host.setter
+    def webhook_host(self, value: str) -> None:
+        self._webhook_host = value
+        self._dump()
+
+    @property
+    def webhook_port(self) -> int:
+        return self._webhook_port
+
+    @webhook_port.setter
+    def webhook_port(self, value: int) -> None:
+        self._webhook_port = value
+        self._dump()
+
+    @property
+    def webhook_secret(self) -> Optional[str]:
+        return self._webhook_secret
+
+    @webhook_secret.setter
+    def webhook_secret(self, value: Optional[str]) -> None:
+        self._webhook_secret = value
+        self._dump()
+
+    @property
+    def webhook_workers(self) -> int:
+        return self._webhook_workers
+
+    @webhook_workers.setter
+    def webhook_workers(self, value: int) -> None:
+        self._webhook_workers = value
+        self._dump()
+
+    @property
+    def session_ttl(self) -> int:
+        return self._session_ttl
+
+    @session_ttl.setter
+    def session_ttl(self, value: int) -> None:
+        self._session_ttl = value
+        self._dump()
+
+    @property
+    def sessions_path(self) -> Optional[str]:
+        return self._sessions_path
+
+    @sessions_path.setter
+    def sessions_path(self, value: Optional[str]) -> None:
+        self._sessions_path = value
+        self._dump()
+
+    @property
+    def hot_reload(self) -> bool:
+        return self._hot_reload
+
+    @hot_reload.setter
+    def hot_reload(self, value: bool) -> None:
+        self._hot_reload = value
         self._dump()
 
+    @property
+    def shutdown_timeout(self) -> float:
+        return self._shutdown_timeout
+
+    @shutdown_timeout.setter
+    def shutdown_timeout(self, value: float) -> None:
+        self._shutdown_timeout = value
+        self._dump()
+
+    @property
+    def shard_workers(self) -> int:
+        return self._shard_workers
+
+    @shard_workers.setter
+    def shard_workers(self, value: int) -> None:
+        self._shard_workers = value
+        self._dump()
+
+    @property
+    def shard_address(self) -> Optional[str]:
+        return self._shard_address
+
+    @shard_address.setter
+    def shard_address(self, value: Optional[str]) -> None:
+        self._shard_address = value
+        self._dump()
+
+    @property
+    def shard_authkey(self) -> Optional[str]:
+        return self._shard_authkey
+
+    @shard_authkey.setter
+    def shard_authkey(self, value: Optional[str]) -> None:
+        self._shard_authkey = value
+        self._dump()
+
+    @property
+    def shard_key(self) -> str:
+        return self._shard_key
+
+    @shard_key.setter
+    def shard_key(self, value: str) -> None:
+        self._shard_key = value
+        self._dump()
+
+    @property
+    def sharding(self) -> bool:
+        return self._shard_workers > 0 or self._shard_address is not None
+
+    @property
+    def schedule_store(self) -> ScheduleStore:
+        return self._schedule_store
+
+    @property
+    def chats(self) -> dict[int, ChatConfig]:
+        return self._chats
+
+    @property
+    def default_chat(self) -> ChatConfig:
+        return self._chats[self._tg_chat_id]
+
     @property
     def reminders(self) -> dict[str, ReminderConfig]:
-        return self._reminders
+        return self.default_chat.reminders
+
+    def chat_variables(self, chat_id: int) -> dict[str, str]:
+        chat_config = self._chats.get(chat_id)
+        return chat_config.variables if chat_config is not None else dict()
+
+    def set_chat_variables(self, chat_id: int, variables: dict[str, str]) -> None:
+        self.add_chat(chat_id).variables = variables
+
+    def add_chat(self, chat_id: int) -> ChatConfig:
+        chat_config = self._chats.get(chat_id)
+        if chat_config is None:
+            chat_config = self.__create_chat(chat_id)
+            chats = dict(self._chats)
+            chats[chat_id] = chat_config
+            self._chats = chats
+            self._dump()
+        return chat_config
+
+    def __read_settings(self, loaded_data: dict[str, Any]) -> None:
+        self._tg_key = loaded_data['_tg_key']
+        self._tg_chat_id = loaded_data['_tg_chat_id']
+        self._random_source = loaded_data.get('_random_source', 'secrets')
+        self._storage_type = loaded_data.get('_storage', 'json')
+        self._sqlite_path = loaded_data.get('_sqlite_path', 'config.sqlite3')
+        self._catch_up_policy = loaded_data.get('_catch_up_policy', 'fire_once')
+        self._catch_up_spacing = loaded_data.get('_catch_up_spacing', 60)
+        self._metrics_port = loaded_data.get('_metrics_port')
+        self._metrics_log_path = loaded_data.get('_metrics_log_path')
+        self._webhook_url = loaded_data.get('_webhook_url')
+        self._webhook_host = loaded_data.get('_webhook_host', '0.0.0.0')
+        self._webhook_port = loaded_data.get('_webhook_port', 8443)
+        self._webhook_secret = loaded_data.get('_webhook_secret')
+        self._webhook_workers = loaded_data.get('_webhook_workers', 4)
+        self._session_ttl = loaded_data.get('_session_ttl', 3600)
+        self._sessions_path = loaded_data.get('_sessions_path')
+        self._hot_reload = loaded_data.get('_hot_reload', True)
+        self._shutdown_timeout = loaded_data.get('_shutdown_timeout', 10)
+        self._shard_workers = loaded_data.get('_shard_workers', 0)
+        self._shard_address = loaded_data.get('_shard_address')
+        self._shard_authkey = loaded_data.get('_shard_authkey')
+        self._shard_key = loaded_data.get('_shard_key', 'profile')
+
+    # the only chat of the single chat format is described by the top level fields
+    @staticmethod
+    def _chats_serialized(loaded_data: dict[str, Any]) -> Optional[list[dict[str, Any]]]:
+        chats_serialized: Optional[list[dict[str, Any]]] = loaded_data.get('_chats')
+        if chats_serialized is None and '_reminders' in loaded_data:
+            chats_serialized = [{
+                '_chat_id': loaded_data['_tg_chat_id'],
+                '_hide_text': loaded_data.get('_tg_hide_text', False),
+                '_reminders': loaded_data['_reminders']
+            }]
+        return chats_serialized
+
+    def __create_chat(self, chat_id: int) -> ChatConfig:
+        if self._storage is not None:
+            return self._storage.add_chat(chat_id)
+        return ChatConfig(chat_id, False, dict(), self._dump)
+
+    # chats found in config.json are moved into an empty database, the original file is kept as a backup
+    def __migrate_to_sqlite(self, chats_serialized: list[dict[str, Any]]) -> None:
+        if self._storage.is_empty:
+            self._storage.import_chats(chats_serialized)
+            print(f'Reminders migrated from config.json to {self._sqlite_path}')
+        else:
+            print(f'{self._sqlite_path} is not empty, reminders from config.json are ignored')
+        shutil.copyfile('config.json', 'config.json.bak')
+        self._dump()
+
+    # applies hand edits of config.json made since it was last read
+    # parts of the file that did not change keep their live values, so menu changes not saved yet survive
+    # returns None when there is nothing new to apply, e.g. when the file was written by us
+    def reload(self) -> Optional[ConfigChanges]:
+        try:
+            signature = file_signature(os.stat('config.json'))
+            if signature == self._loaded_signature or self._writer.wrote(signature):
+                return None
+            loaded_data, raw_messages = load_document('config.json')
+        except (OSError, ValueError) as error:
+            print(f'config.json was not reloaded: {error!r}')
+            return None
+        if '_tg_key' not in loaded_data or '_tg_chat_id' not in loaded_data:
+            print('config.json was not reloaded: _tg_key and _tg_chat_id are required')
+            return None
+        chats_serialized = Config._chats_serialized(loaded_data)
+        self._loaded_signature = signature
+        previous = self._fingerprints
+        self._fingerprints = fingerprint(loaded_data, self.__reloadable_chats(chats_serialized), raw_messages)
+        changed = {key for key, value in self._fingerprints.items() if previous.get(key) != value}
+
+        changes = ConfigChanges()
+        changes.settings = [key[0] for key in changed if len(key) == 1]
+        if changes.settings:
+            self.__read_settings(loaded_data)
+        if self._storage is None:
+            self.__reload_chats(chats_serialized or list(), raw_messages, previous, changed, changes)
+        if self._tg_chat_id not in self._chats:
+            self.add_chat(self._tg_chat_id)
+            changes.chats.add(self._tg_chat_id)
+        print(f'Config reloaded from file: {len(changes.added)} reminders added, {len(changes.removed)} removed, '
+              f'{len(changes.modified)} modified')
+        return changes
+
+    def __reload_chats(self,
+                       chats_serialized: list[dict[str, Any]],
+                       raw_messages: list[bytes],
+                       previous: dict[FingerprintKey, bytes],
+                       changed: set[FingerprintKey],
+                       changes: ConfigChanges) -> None:
+        chat_ids = set()
+        for chat in chats_serialized:
+            chat_id: int = chat.get('_chat_id')
+            chat_ids.add(chat_id)
+            chat_config = self._chats.get(chat_id)
+            if chat_config is None:
+                chat_config = self.add_chat(chat_id)
+            if ('_chats', chat_id) in changed and chat_config.hide_text != chat.get('_hide_text', False):
+                chat_config.hide_text = chat.get('_hide_text', False)
+            if ('_chats', chat_id) in changed and chat_config.variables != ChatConfig.variables_from(chat):
+                chat_config.variables = ChatConfig.variables_from(chat)
+
+            reminders_serialized = {reminder.get('_name'): reminder for reminder in chat.get('_reminders', list())}
+            for name, reminder in reminders_serialized.items():
+                fields = [field for field in REMINDER_FIELDS if ('_chats', chat_id, name, field) in changed]
+                if not fields:
+                    continue
+                loaded = Config._load_reminder_configs([reminder], raw_messages, self._dump)[name]
+                reminder_config = chat_config.reminders.get(name)
+                if reminder_config is None:
+                    chat_config.add_reminder(loaded)
+                    changes.added.append((chat_id, name))
+                    changes.chats.add(chat_id)
+                    continue
+                modified = reminder_config.update_from(loaded, fields)
+                if modified:
+                    changes.modified[(chat_id, name)] = modified
+            # only reminders that were in the file before are removed, never ones created since
+            for name in list(chat_config.reminders):
+                if name not in reminders_serialized and ('_chats', chat_id, name) in previous:
+                    chat_config.remove_reminder(name)
+                    changes.removed.append((chat_id, name))
+                    changes.chats.add(chat_id)
+
+        for chat_id in list(self._chats):
+            if chat_id not in chat_ids and ('_chats', chat_id) in previous:
+                chat_config = self._chats[chat_id]
+                changes.removed.extend((chat_id, name) for name in chat_config.reminders)
+                changes.chats.add(chat_id)
+                self.__remove_chat(chat_id)
+
+    # chats and reminders of the sqlite storage are not part of config.json
+    def __reloadable_chats(self, chats_serialized: Optional[list[dict[str, Any]]]) -> list[dict[str, Any]]:
+        if self._storage is not None or chats_serialized is None:
+            return list()
+        return chats_serialized
+
+    # chats are replaced, not changed in place, so other threads can keep iterating over them
+    def __remove_chat(self, chat_id: int) -> None:
+        chats = dict(self._chats)
+        del chats[chat_id]
+        self._chats = chats
+        self._dump()
+
+    def flush(self) -> None:
+        self._writer.flush()
 
     def _dump(self) -> None:
-        reminders_serialized: list[dict[str, Any]] = list(
-            map(lambda reminder_config: reminder_config.to_dict(), self._reminders.values()))
-
-        config_dict = {
-            '_tg_key': self._tg_key,
-            '_tg_chat_id': self._tg_chat_id,
-            '_tg_hide_text': self._tg_hide_text,
-            '_reminders': reminders_serialized
+        self._writer.mark_dirty()
+
+    def _serialize(self) -> list[str]:
+        fields = {
+            '_tg_key': serialize_value(self._tg_key, 1),
+            '_tg_chat_id': serialize_value(self._tg_chat_id, 1),
+            '_random_source': serialize_value(self._random_source, 1),
+            '_storage': serialize_value(self._storage_type, 1),
+            '_catch_up_policy': serialize_value(self._catch_up_policy, 1),
+            '_catch_up_spacing': serialize_value(self._catch_up_spacing, 1),
+            '_metrics_port': serialize_value(self._metrics_port, 1),
+            '_metrics_log_path': serialize_value(self._metrics_log_path, 1),
+            '_webhook_url': serialize_value(self._webhook_url, 1),
+            '_webhook_host': serialize_value(self._webhook_host, 1),
+            '_webhook_port': serialize_value(self._webhook_port, 1),
+            '_webhook_secret': serialize_value(self._webhook_secret, 1),
+            '_webhook_workers': serialize_value(self._webhook_workers, 1),
+            '_session_ttl': serialize_value(self._session_ttl, 1),
+            '_sessions_path': serialize_value(self._sessions_path, 1),
+            '_hot_reload': serialize_value(self._hot_reload, 1),
+            '_shutdown_timeout': serialize_value(self._shutdown_timeout, 1),
+            '_shard_workers': serialize_value(self._shard_workers, 1),
+            '_shard_address': serialize_value(self._shard_address, 1),
+            '_shard_authkey': serialize_value(self._shard_authkey, 1),
+            '_shard_key': serialize_value(self._shard_key, 1)
         }
+        if self._storage is None:
+            fields['_chats'] = serialize_list([chat_config.to_json(2) for chat_config in self._chats.values()], 1)
+        else:
+            fields['_sqlite_path'] = serialize_value(self._sqlite_path, 1)
+        return serialize_object(fields, 0)
+
+    # the database import needs plain message lists
+    @staticmethod
+    def _decode_messages(chats_serialized: list[dict[str, Any]], raw_messages: list[bytes]) -> list[dict[str, Any]]:
+        for chat in chats_serialized:
+            for reminder in chat.get('_reminders', list()):
+                if type(reminder.get('_messages')) is int:
+                    reminder['_messages'] = decode_messages(raw_messages[reminder['_messages']])
+        return chats_serialized
 
-        with open('config.json', 'w', encoding='utf8') as json_file:
-            json.dump(config_dict, json_file, ensure_ascii=False, indent=4)
-            print("Config changes saved to file")
+    @staticmethod
+    def _load_chat_configs(chats_serialized: list[dict[str, Any]],
+                           raw_messages: list[bytes],
+                           dump_callback: Callable[[], None]) -> dict[int, ChatConfig]:
+        result: dict[int, ChatConfig] = dict()
+        for chat in chats_serialized:
+            chat_id: int = chat.get('_chat_id')
+            reminders = Config._load_reminder_configs(chat.get('_reminders', list()), raw_messages, dump_callback)
+            result[chat_id] = ChatConfig(chat_id, chat.get('_hide_text', False), reminders, dump_callback,
+                                         ChatConfig.variables_from(chat))
+        return result
 
     @staticmethod
     def _load_reminder_configs(reminders_serialized: list[dict[str, Any]],
+                               raw_messages: list[bytes],
                                dump_callback: Callable[[], None]) -> dict[str, ReminderConfig]:
         result: dict[str, ReminderConfig] = dict()
         for reminder in reminders_serialized:
             config_name = reminder.get('_name')
             config_messages = reminder.get('_messages')
+            # an index into raw_messages when the list was left undecoded by the loader
+            config_raw_messages = None
+            if type(config_messages) is int:
+                config_raw_messages = raw_messages[config_messages]
+                config_messages = None
             time_range_list: list[int] = reminder.get('_time_range')
             config_time_range = (time_range_list[0], time_range_list[1])
-            result[config_name] = ReminderConfig(config_name, config_messages, config_time_range, dump_callback)
+            config_subscribers: list[int] = reminder.get('_subscribers', list())
+            result[config_name] = ReminderConfig(config_name, config_messages, config_time_range, dump_callback,
+                                                 config_subscribers,
+                                                 reminder.get('_selection', 'uniform'),
+                                                 reminder.get('_no_repeat_window', 3),
+                                                 reminder.get('_weights', list()),
+                                                 config_raw_messages)
         return result
 
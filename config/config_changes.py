@@ -0,0 +1,69 @@
+import hashlib
+import json
+from typing import Any
+
+from .schedule_store import ScheduleKey
+
+# fields of a serialized reminder that can be changed in place, the name identifies the reminder
+REMINDER_FIELDS = ('_messages', '_time_range', '_subscribers', '_selection', '_no_repeat_window', '_weights')
+
+# fingerprint keys: (setting,) for top level settings, ('_chats', chat_id) for a chat, its _hide_text and _variables,
+# ('_chats', chat_id, name) for a reminder and ('_chats', chat_id, name, field) for its fields
+FingerprintKey = tuple
+
+
+class ConfigChanges:
+    __slots__ = ('added', 'removed', 'modified', 'chats', 'settings')
+
+    def __init__(self):
+        # reminders by owner chat and name
+        self.added: list[ScheduleKey] = list()
+        self.removed: list[ScheduleKey] = list()
+        # names of the fields that changed
+        self.modified: dict[ScheduleKey, set[str]] = dict()
+        # chats whose set of reminders changed
+        self.chats: set[int] = set()
+        # top level settings, they take effect after a restart
+        self.settings: list[str] = list()
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.modified or self.chats or self.settings)
+
+
+# digests of every part of the document that can be reloaded separately
+# message lists left undecoded by the loader are hashed as they are
+def fingerprint(loaded_data: dict[str, Any],
+                chats_serialized: list[dict[str, Any]],
+                raw_messages: list[bytes]) -> dict[FingerprintKey, bytes]:
+    result: dict[FingerprintKey, bytes] = dict()
+    for key, value in loaded_data.items():
+        if key not in ('_chats', '_reminders', '_tg_hide_text'):
+            result[(key,)] = _digest(value)
+    for chat in chats_serialized:
+        chat_id = chat.get('_chat_id')
+        result[('_chats', chat_id)] = _digest([chat.get('_hide_text', False), chat.get('_variables', dict())])
+        for reminder in chat.get('_reminders', list()):
+            name = reminder.get('_name')
+            result[('_chats', chat_id, name)] = b''
+            for field in REMINDER_FIELDS:
+                value = reminder.get(field)
+                if field == '_messages' and type(value) is int:
+                    result[('_chats', chat_id, name, field)] = _digest_bytes(raw_messages[value])
+                else:
+                    result[('_chats', chat_id, name, field)] = _field_digest(value)
+    return result
+
+
+def _digest(value: Any) -> bytes:
+    return _digest_bytes(json.dumps(value, ensure_ascii=False, sort_keys=True).encode())
+
+
+# reminder fields hold no json objects, so repr is as stable as json and much faster; short values are kept as they are
+def _field_digest(value: Any) -> bytes:
+    data = repr(value).encode()
+    return data if len(data) <= 16 else _digest_bytes(data)
+
+
+# sha256 is hardware accelerated on current CPUs and faster than blake2b there
+def _digest_bytes(data: bytes) -> bytes:
+    return hashlib.sha256(data).digest()[:16]
@@ -0,0 +1,105 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+from threading import Thread
+from time import sleep
+from typing import Callable, Optional
+
+from .persistence import file_signature
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_CLOEXEC = 0o2000000
+# struct inotify_event without the trailing name
+EVENT_HEADER = struct.Struct('iIII')
+
+
+# calls back once a file settles after being changed
+# the directory is watched, not the file, as editors and atomic writes replace the file with a new one
+class FileWatcher(Thread):
+    # used when inotify is not available
+    POLL_INTERVAL: float = 2.0
+    # changes closer together than this are reported once, editors often save in several steps
+    SETTLE_DELAY: float = 0.3
+
+    _path: str
+    _callback: Callable[[], None]
+
+    def __init__(self, path: str, callback: Callable[[], None]):
+        super().__init__(name='file-watcher', daemon=True)
+        self._path = os.path.abspath(path)
+        self._callback = callback
+
+    def run(self) -> None:
+        try:
+            fd = self.__inotify_fd()
+        except (OSError, AttributeError) as error:
+            print(f'inotify is not available ({error}), checking {self._path} every {self.POLL_INTERVAL}s')
+            self.__poll()
+            return
+        self.__watch(fd)
+
+    def __inotify_fd(self) -> int:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init1(IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        directory = os.path.dirname(self._path).encode()
+        if libc.inotify_add_watch(fd, directory, IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+            error = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(error, os.strerror(error))
+        return fd
+
+    def __watch(self, fd: int) -> None:
+        name = os.path.basename(self._path).encode()
+        while True:
+            if name not in self.__read_names(fd):
+                continue
+            # wait until the file stops changing
+            while select.select([fd], [], [], self.SETTLE_DELAY)[0]:
+                self.__read_names(fd)
+            self.__notify()
+
+    @staticmethod
+    def __read_names(fd: int) -> set[bytes]:
+        data = os.read(fd, 64 * 1024)
+        names: set[bytes] = set()
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            names.add(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+        return names
+
+    def __poll(self) -> None:
+        signature = self.__signature()
+        while True:
+            sleep(self.POLL_INTERVAL)
+            current = self.__signature()
+            if current == signature:
+                continue
+            # wait until the file stops changing
+            while True:
+                sleep(self.SETTLE_DELAY)
+                signature, current = current, self.__signature()
+                if current == signature:
+                    break
+            self.__notify()
+
+    def __signature(self) -> Optional[tuple[int, int, int]]:
+        try:
+            return file_signature(os.stat(self._path))
+        except FileNotFoundError:
+            return None
+
+    def __notify(self) -> None:
+        try:
+            self._callback()
+        except Exception as error:
+            print(f'Failed to handle a change of {self._path}: {error!r}')
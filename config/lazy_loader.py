@@ -0,0 +1,37 @@
+import json
+import re
+from typing import Any
+
+# "_messages" arrays made of strings only, the common case that is kept undecoded
+_STRING = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+MESSAGES_PATTERN = re.compile(rb'"_messages"\s*:\s*(\[\s*(?:' + _STRING + rb'\s*(?:,\s*' + _STRING + rb'\s*)*)?\])')
+STRING_PATTERN = re.compile(_STRING)
+
+
+# parses the config with every "_messages" array cut out as raw utf-8 bytes
+# the arrays are replaced by their index in the returned list, so the parsed part stays small
+def load_document(path: str) -> tuple[dict[str, Any], list[bytes]]:
+    with open(path, 'rb') as json_file:
+        data = json_file.read()
+    raw_messages: list[bytes] = list()
+    pieces: list[bytes] = list()
+    position = 0
+    for match in MESSAGES_PATTERN.finditer(data):
+        start, end = match.span(1)
+        pieces.append(data[position:start])
+        pieces.append(str(len(raw_messages)).encode())
+        raw_messages.append(data[start:end])
+        position = end
+    pieces.append(data[position:])
+    return json.loads(b''.join(pieces)), raw_messages
+
+
+def count_messages(raw: bytes) -> int:
+    # without escapes every quote opens or closes a message
+    if b'\\' not in raw:
+        return raw.count(b'"') // 2
+    return sum(1 for _ in STRING_PATTERN.finditer(raw))
+
+
+def decode_messages(raw: bytes) -> list[str]:
+    return json.loads(raw)
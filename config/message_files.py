@@ -0,0 +1,88 @@
+import csv
+import hashlib
+import io
+import json
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+# formats of message list documents: one message per line, the first column of a csv file or a json lines file
+# of strings or objects with a "text" field; only csv and jsonl keep messages with line breaks
+MESSAGE_FORMATS = ('txt', 'csv', 'jsonl')
+
+
+# 64 bit digest used by the duplicate index, collisions are negligible for lists of millions of messages
+def message_hash(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), 'big', signed=True)
+
+
+def message_format(file_name: Optional[str], mime_type: Optional[str] = None) -> Optional[str]:
+    extension = file_name.rsplit('.', 1)[-1].lower() if file_name and '.' in file_name else None
+    if extension in MESSAGE_FORMATS:
+        return extension
+    if extension == 'json' or mime_type in ('application/jsonl', 'application/x-ndjson'):
+        return 'jsonl'
+    if mime_type == 'text/csv':
+        return 'csv'
+    if mime_type == 'text/plain':
+        return 'txt'
+    return None
+
+
+# reads messages one by one, so the document is never held in memory as a whole
+# empty messages and malformed lines are skipped and counted
+class MessageReader:
+    __slots__ = ('_stream', '_format', 'skipped')
+
+    def __init__(self, stream: BinaryIO, file_format: str):
+        self._stream = stream
+        self._format = file_format
+        self.skipped = 0
+
+    def __iter__(self) -> Iterator[str]:
+        # csv needs the line breaks inside quoted fields as they are
+        text = io.TextIOWrapper(self._stream, encoding='utf-8-sig', errors='replace',
+                                newline='' if self._format == 'csv' else None)
+        try:
+            if self._format == 'csv':
+                yield from self.__messages(row[0] if row else None for row in csv.reader(text))
+            elif self._format == 'jsonl':
+                yield from self.__messages(self.__json_message(line) for line in text if line.strip())
+            else:
+                yield from self.__messages(line.rstrip('\n') for line in text)
+        finally:
+            text.detach()
+
+    def __messages(self, values: Iterable[Optional[str]]) -> Iterator[str]:
+        for value in values:
+            if type(value) is str and value.strip():
+                yield value
+            else:
+                self.skipped += 1
+
+    @staticmethod
+    def __json_message(line: str) -> Optional[str]:
+        try:
+            value = json.loads(line)
+        except ValueError:
+            return None
+        return value.get('text') if type(value) is dict else value
+
+
+def write_messages(stream: BinaryIO, messages: Iterable[str], file_format: str) -> int:
+    count = 0
+    # the byte order mark lets spreadsheet editors detect utf-8
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig' if file_format == 'csv' else 'utf-8', newline='')
+    try:
+        if file_format == 'csv':
+            writer = csv.writer(text)
+            for message in messages:
+                writer.writerow((message,))
+                count += 1
+        else:
+            for message in messages:
+                text.write((json.dumps(message, ensure_ascii=False) if file_format == 'jsonl'
+                            else message.replace('\n', ' ')) + '\n')
+                count += 1
+        text.flush()
+    finally:
+        text.detach()
+    return count
@@ -0,0 +1,110 @@
+import re
+from datetime import datetime
+from typing import Callable, Mapping, Optional
+
+# {name} is replaced by the value of a variable, {{name}} gives {name} as it is
+# names without a value are kept as written, so braces in older messages are sent unchanged
+_PLACEHOLDER = re.compile(r'\{\{(\w+)\}\}|\{(\w+)\}')
+
+_WEEKDAYS = ('понедельник', 'вторник', 'среда', 'четверг', 'пятница', 'суббота', 'воскресенье')
+
+
+# what a single send knows about itself, template variables are read from it
+class TemplateContext:
+    __slots__ = ('profile', 'timestamp', 'number', 'total', 'count', 'variables')
+
+    def __init__(self, profile: str, timestamp: float, number: int, total: int, count: int,
+                 variables: Mapping[str, str]):
+        self.profile = profile
+        # unix time of the send, local time of the bot is used for dates
+        self.timestamp = timestamp
+        # position of the message in the list starting from 1 and the size of the list
+        self.number = number
+        self.total = total
+        # fires of the reminder since the bot started
+        self.count = count
+        # variables of the receiving chat
+        self.variables = variables
+
+    @property
+    def now(self) -> datetime:
+        return datetime.fromtimestamp(self.timestamp)
+
+    def value(self, name: str) -> Optional[str]:
+        builtin = BUILTIN_VARIABLES.get(name)
+        return builtin(self) if builtin is not None else self.variables.get(name)
+
+
+# chat variables can not take these names
+BUILTIN_VARIABLES: dict[str, Callable[[TemplateContext], str]] = {
+    'profile': lambda context: context.profile,
+    'date': lambda context: context.now.strftime('%d.%m.%Y'),
+    'time': lambda context: context.now.strftime('%H:%M'),
+    'weekday': lambda context: _WEEKDAYS[context.now.weekday()],
+    'number': lambda context: str(context.number),
+    'total': lambda context: str(context.total),
+    'count': lambda context: str(context.count)
+}
+
+
+def is_variable_name(name: str) -> bool:
+    return _PLACEHOLDER.fullmatch(f'{{{name}}}') is not None and name not in BUILTIN_VARIABLES
+
+
+# a message parsed once into literal text and variables
+# renders are cached by the values of the variables the message uses, so a message with a date is formatted
+# once a day per chat and a message without variables is never formatted
+class MessageTemplate:
+    __slots__ = ('_parts', '_names', '_renders')
+
+    # cached renders are dropped all at once when there are more
+    RENDER_CACHE_SIZE: int = 16
+
+    # literal text at even positions and variable names at odd ones
+    _parts: tuple[str, ...]
+    # variables in order of first use
+    _names: tuple[str, ...]
+    _renders: dict[tuple[Optional[str], ...], str]
+
+    def __init__(self, text: str):
+        parts: list[str] = list()
+        literal: list[str] = list()
+        position = 0
+        for match in _PLACEHOLDER.finditer(text):
+            literal.append(text[position:match.start()])
+            escaped, name = match.groups()
+            if escaped is not None:
+                literal.append(f'{{{escaped}}}')
+            else:
+                parts.append(''.join(literal))
+                parts.append(name)
+                literal = list()
+            position = match.end()
+        literal.append(text[position:])
+        parts.append(''.join(literal))
+        self._parts = tuple(parts)
+        self._names = tuple(dict.fromkeys(parts[1::2]))
+        self._renders = dict()
+
+    @property
+    def names(self) -> tuple[str, ...]:
+        return self._names
+
+    # the context may be left out for messages without variables
+    def render(self, context: Optional[TemplateContext]) -> str:
+        if not self._names:
+            return self._parts[0]
+        values = tuple(context.value(name) for name in self._names)
+        rendered = self._renders.get(values)
+        if rendered is None:
+            by_name = dict(zip(self._names, values))
+            rendered = ''.join(part if index % 2 == 0 else self.__value(part, by_name[part])
+                               for index, part in enumerate(self._parts))
+            if len(self._renders) >= self.RENDER_CACHE_SIZE:
+                self._renders.clear()
+            self._renders[values] = rendered
+        return rendered
+
+    @staticmethod
+    def __value(name: str, value: Optional[str]) -> str:
+        return value if value is not None else f'{{{name}}}'
@@ -0,0 +1,136 @@
+import json
+import os
+from tempfile import NamedTemporaryFile
+from threading import Lock, Timer
+from time import perf_counter
+from typing import Any, Callable, Iterable, Optional
+
+from metrics import metrics
+
+INDENT = '    '
+
+
+# helpers producing the same layout as json.dump(indent=4) as lists of text chunks built from
+# already serialized parts, so unchanged parts of the config are reused and never copied between writes
+
+def serialize_value(value: Any, level: int) -> list[str]:
+    return [json.dumps(value, ensure_ascii=False, indent=len(INDENT)).replace('\n', '\n' + INDENT * level)]
+
+
+def serialize_list(items: list[list[str]], level: int) -> list[str]:
+    if not items:
+        return ['[]']
+    inner = INDENT * (level + 1)
+    chunks = ['[\n']
+    for index, item in enumerate(items):
+        chunks.append(',\n' + inner if index > 0 else inner)
+        chunks.extend(item)
+    chunks.append('\n' + INDENT * level + ']')
+    return chunks
+
+
+def serialize_object(fields: dict[str, list[str]], level: int) -> list[str]:
+    inner = INDENT * (level + 1)
+    chunks = ['{\n']
+    for index, (key, value) in enumerate(fields.items()):
+        separator = ',\n' if index > 0 else ''
+        chunks.append(f'{separator}{inner}{json.dumps(key)}: ')
+        chunks.extend(value)
+    chunks.append('\n' + INDENT * level + '}')
+    return chunks
+
+
+# identifies one version of a file: an atomic replace always brings a new inode
+def file_signature(stat: os.stat_result) -> tuple[int, int, int]:
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+# returns the signature of the written file
+def atomic_write(path: str, chunks: Iterable[str]) -> tuple[int, int, int]:
+    directory = os.path.dirname(os.path.abspath(path))
+    with NamedTemporaryFile('w', encoding='utf8', dir=directory, prefix='.config-', suffix='.tmp',
+                            delete=False) as temp_file:
+        try:
+            temp_file.writelines(chunks)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+            signature = file_signature(os.fstat(temp_file.fileno()))
+        except BaseException:
+            os.unlink(temp_file.name)
+            raise
+    os.replace(temp_file.name, path)
+    # make the rename itself durable
+    directory_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(directory_fd)
+    finally:
+        os.close(directory_fd)
+    return signature
+
+
+class DebouncedWriter:
+    _write: Callable[[], None]
+    _delay: float
+    _dirty: bool
+    _timer: Optional[Timer]
+    _lock: Lock
+    _flush_lock: Lock
+
+    def __init__(self, write: Callable[[], None], delay: float = 1.0):
+        self._write = write
+        self._delay = delay
+        self._dirty = False
+        self._timer = None
+        self._lock = Lock()
+        self._flush_lock = Lock()
+
+    @property
+    def dirty(self) -> bool:
+        return self._dirty
+
+    # changes made within the delay window are written together
+    def mark_dirty(self) -> None:
+        with self._lock:
+            self._dirty = True
+            if self._timer is None:
+                self._timer = Timer(self._delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+            try:
+                self._write()
+            except Exception:
+                self.mark_dirty()
+                raise
+
+
+class ConfigWriter(DebouncedWriter):
+    _path: str
+    _serialize: Callable[[], Iterable[str]]
+    # signature of the last version written, lets file watchers ignore our own writes
+    _written: Optional[tuple[int, int, int]]
+
+    def __init__(self, path: str, serialize: Callable[[], Iterable[str]], delay: float = 1.0):
+        super().__init__(self.__write, delay)
+        self._path = path
+        self._serialize = serialize
+        self._written = None
+
+    def wrote(self, signature: tuple[int, int, int]) -> bool:
+        return signature == self._written
+
+    def __write(self) -> None:
+        started = perf_counter()
+        self._written = atomic_write(self._path, self._serialize())
+        elapsed = perf_counter() - started
+        metrics.observe('config_flush_seconds', elapsed, {'path': self._path})
+        print(f'Changes saved to {self._path} in {elapsed:.3f}s')
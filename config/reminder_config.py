@@ -1,21 +1,78 @@
-from typing import Callable, Any
+from collections import OrderedDict
+from typing import Callable, Any, Iterable, Iterator, Optional
+
+from .lazy_loader import count_messages, decode_messages
+from .message_files import message_hash
+from .message_template import MessageTemplate
+from .persistence import serialize_object, serialize_value
 
 
 class ReminderConfig:
+    __slots__ = ('_name', '_messages', '_raw_messages', '_message_count', '_time_range', '_subscribers', '_selection',
+                 '_no_repeat_window', '_weights', '_dump', '_serialized', '_revision', '_message_hashes',
+                 '_messages_revision', '_templates', '_templates_revision')
+
+    # compiled messages kept per profile, the least recently sent one is dropped when there are more
+    TEMPLATE_CACHE_SIZE: int = 4096
+
     _name: str
-    _messages: list[str]
+    # decoded from _raw_messages on first use when the config was loaded lazily
+    _messages: Optional[list[str]]
+    _raw_messages: Optional[bytes]
+    # known without decoding the messages
+    _message_count: Optional[int]
+    # digests of the messages, built by the first bulk edit and dropped when the list is replaced
+    _message_hashes: Optional[set[int]]
     _time_range: tuple[int, int]
+    # other chats that receive every message of this reminder
+    _subscribers: list[int]
+    # how the next message is picked: 'uniform', 'shuffle_bag', 'no_repeat' or 'weighted'
+    _selection: str
+    # how many last messages 'no_repeat' keeps from repeating
+    _no_repeat_window: int
+    # weights of 'weighted' by message position, missing weights are 1
+    _weights: list[float]
     _dump: Callable[[None], None]
+    # cached serialized form with its nesting level, reset on every change
+    _serialized: Optional[tuple[int, str]]
+    # grows on every change, lets derived data such as menu texts tell whether it is stale
+    _revision: int
+    # grows only when the messages change, other settings keep the compiled messages
+    _messages_revision: int
+    # messages compiled on first send by position, least recently used first, dropped when the messages change
+    _templates: OrderedDict[int, MessageTemplate]
+    _templates_revision: int
 
     def __init__(self,
                  name: str,
-                 messages: list[str],
+                 messages: Optional[list[str]],
                  time_range: tuple[int, int],
-                 dump_callback: Callable[[], None]):
+                 dump_callback: Callable[[], None],
+                 subscribers: Optional[list[int]] = None,
+                 selection: str = 'uniform',
+                 no_repeat_window: int = 3,
+                 weights: Optional[list[float]] = None,
+                 raw_messages: Optional[bytes] = None):
         self._name = name
         self._messages = messages
+        self._raw_messages = raw_messages
+        self._message_count = None
+        self._message_hashes = None
         self._time_range = time_range
+        self._subscribers = subscribers if subscribers is not None else list()
+        self._selection = selection
+        self._no_repeat_window = no_repeat_window
+        self._weights = weights if weights is not None else list()
         self._dump = dump_callback
+        self._serialized = None
+        self._revision = 0
+        self._messages_revision = 0
+        self._templates = OrderedDict()
+        self._templates_revision = 0
+
+    @property
+    def revision(self) -> int:
+        return self._revision
 
     @property
     def name(self) -> str:
@@ -24,16 +81,107 @@ class ReminderConfig:
     @name.setter
     def name(self, new_name: str) -> None:
         self._name = new_name
-        self._dump()
+        self._changed()
 
     @property
     def messages(self) -> list[str]:
+        if self._messages is None:
+            self._messages = decode_messages(self._raw_messages)
+            self._raw_messages = None
         return self._messages
 
     @messages.setter
     def messages(self, new_messages: list[str]) -> None:
         self._messages = new_messages
-        self._dump()
+        self._raw_messages = None
+        self._message_hashes = None
+        self._messages_changed()
+
+    @property
+    def message_count(self) -> int:
+        if self._messages is not None:
+            return len(self._messages)
+        if self._message_count is None:
+            self._message_count = count_messages(self._raw_messages)
+        return self._message_count
+
+    def message_at(self, index: int) -> str:
+        return self.messages[index]
+
+    def iter_messages(self) -> Iterator[str]:
+        return iter(self.messages)
+
+    def template_at(self, index: int) -> MessageTemplate:
+        if self._templates_revision != self._messages_revision:
+            self._templates = OrderedDict()
+            self._templates_revision = self._messages_revision
+        templates = self._templates
+        template = templates.get(index)
+        if template is not None:
+            templates.move_to_end(index)
+        else:
+            template = MessageTemplate(self.message_at(index))
+            templates[index] = template
+            if len(templates) > self.TEMPLATE_CACHE_SIZE:
+                templates.popitem(last=False)
+        return template
+
+    # bulk edits, e.g. from an uploaded document; each returns how many messages it added or removed
+    # removals that would leave the list empty raise ValueError
+
+    # messages already in the list and repeats within the added ones are skipped
+    def append_messages(self, messages: Iterable[str]) -> int:
+        hashes = self.__hashes()
+        current = self.messages
+        count = len(current)
+        try:
+            for message in messages:
+                digest = message_hash(message)
+                if digest not in hashes:
+                    hashes.add(digest)
+                    current.append(message)
+        except Exception:
+            # a document that can not be read to the end is not imported at all
+            del current[count:]
+            self._message_hashes = None
+            raise
+        added = len(current) - count
+        if added:
+            self._messages_changed()
+        return added
+
+    def remove_messages(self, messages: Iterable[str]) -> int:
+        removed = {message_hash(message) for message in messages}
+        return self.__keep(lambda digest, kept: digest not in removed)
+
+    # the first of equal messages stays in its place
+    def deduplicate_messages(self) -> int:
+        return self.__keep(lambda digest, kept: digest not in kept)
+
+    def __hashes(self) -> set[int]:
+        if self._message_hashes is None:
+            self._message_hashes = {message_hash(message) for message in self.messages}
+        return self._message_hashes
+
+    # keep gets the digest of a message and the digests of the messages kept before it
+    # the list is replaced, not changed in place, so messages drawn before are read from the old one
+    def __keep(self, keep: Callable[[int, set[int]], bool]) -> int:
+        current = self.messages
+        kept: list[str] = list()
+        hashes: set[int] = set()
+        for message in current:
+            digest = message_hash(message)
+            if keep(digest, hashes):
+                kept.append(message)
+                hashes.add(digest)
+        if not kept:
+            raise ValueError(f'Profile {self._name} would have no messages left')
+        removed = len(current) - len(kept)
+        if removed:
+            self._messages = kept
+            self._messages_changed()
+        self._message_hashes = hashes
+        return removed
 
     @property
     def time_range(self) -> tuple[int, int]:
@@ -42,11 +190,95 @@ class ReminderConfig:
     @time_range.setter
     def time_range(self, new_range: tuple[int, int]) -> None:
         self._time_range = new_range
+        self._changed()
+
+    @property
+    def subscribers(self) -> list[int]:
+        return self._subscribers
+
+    @subscribers.setter
+    def subscribers(self, new_subscribers: list[int]) -> None:
+        self._subscribers = new_subscribers
+        self._changed()
+
+    @property
+    def selection(self) -> str:
+        return self._selection
+
+    @selection.setter
+    def selection(self, new_selection: str) -> None:
+        self._selection = new_selection
+        self._changed()
+
+    @property
+    def no_repeat_window(self) -> int:
+        return self._no_repeat_window
+
+    @no_repeat_window.setter
+    def no_repeat_window(self, new_window: int) -> None:
+        self._no_repeat_window = new_window
+        self._changed()
+
+    @property
+    def weights(self) -> list[float]:
+        return self._weights
+
+    @weights.setter
+    def weights(self, new_weights: list[float]) -> None:
+        self._weights = new_weights
+        self._changed()
+
+    # copies the given serialized fields, e.g. '_time_range', from another config
+    # returns the ones whose value actually changed
+    def update_from(self, other: 'ReminderConfig', fields: Iterable[str]) -> set[str]:
+        changed: set[str] = set()
+        for field in fields:
+            attribute = field.lstrip('_')
+            value = getattr(other, attribute)
+            if getattr(self, attribute) != value:
+                setattr(self, attribute, value)
+                changed.add(field)
+        return changed
+
+    # delivery history is only kept by storages that support it
+    def record_delivery(self, chat_id: int, message_index: int) -> None:
+        pass
+
+    def _messages_changed(self) -> None:
+        self._messages_revision += 1
+        self._changed()
+
+    def _changed(self) -> None:
+        self._revision += 1
+        self._serialized = None
         self._dump()
 
+    def to_json(self, level: int) -> list[str]:
+        if self._messages is None:
+            # a list that was never decoded is written back as it was read, so it is not held a second time
+            return self.__serialize([self._raw_messages.decode('utf-8')], level)
+        if self._serialized is None or self._serialized[0] != level:
+            self._serialized = (level, ''.join(self.__serialize(serialize_value(self._messages, level + 1), level)))
+        return [self._serialized[1]]
+
+    def __serialize(self, messages: list[str], level: int) -> list[str]:
+        return serialize_object({
+            '_name': serialize_value(self._name, level + 1),
+            '_messages': messages,
+            '_time_range': serialize_value(self._time_range, level + 1),
+            '_subscribers': serialize_value(self._subscribers, level + 1),
+            '_selection': serialize_value(self._selection, level + 1),
+            '_no_repeat_window': serialize_value(self._no_repeat_window, level + 1),
+            '_weights': serialize_value(self._weights, level + 1)
+        }, level)
+
     def to_dict(self) -> dict[str, Any]:
         return {
             '_name': self._name,
-            '_messages': self._messages,
-            '_time_range': self._time_range
+            '_messages': self.messages,
+            '_time_range': self._time_range,
+            '_subscribers': self._subscribers,
+            '_selection': self._selection,
+            '_no_repeat_window': self._no_repeat_window,
+            '_weights': self._weights
         }
@@ -0,0 +1,132 @@
+import json
+import os
+from abc import ABC, abstractmethod
+from threading import Lock
+from typing import Optional
+
+from .persistence import ConfigWriter, DebouncedWriter, serialize_value
+from .sqlite_storage import SqliteStorage
+
+# reminders are identified by owner chat and profile name
+ScheduleKey = tuple[int, str]
+
+
+class ScheduleState:
+    __slots__ = ('due', 'message_index')
+
+    # due is a unix timestamp, message_index is the message already drawn for that fire
+    def __init__(self, due: float, message_index: Optional[int]):
+        self.due = due
+        self.message_index = message_index
+
+
+class ScheduleStore(ABC):
+    _states: dict[ScheduleKey, ScheduleState]
+    _lock: Lock
+    _writer: DebouncedWriter
+
+    def __init__(self):
+        self._lock = Lock()
+        self._states = dict()
+
+    @abstractmethod
+    def load_all(self) -> dict[ScheduleKey, ScheduleState]:
+        ...
+
+    # cheap enough for the scheduler loop: the state is written later together with other changes
+    def save(self, key: ScheduleKey, state: ScheduleState) -> None:
+        with self._lock:
+            self._states[key] = state
+        self._writer.mark_dirty()
+
+    def remove(self, key: ScheduleKey) -> None:
+        with self._lock:
+            self._states.pop(key, None)
+        self._writer.mark_dirty()
+
+    def flush(self) -> None:
+        self._writer.flush()
+
+
+class JsonScheduleStore(ScheduleStore):
+    _path: str
+
+    def __init__(self, path: str):
+        super().__init__()
+        self._path = path
+        self._writer = ConfigWriter(path, self.__serialize, delay=5.0)
+
+    def load_all(self) -> dict[ScheduleKey, ScheduleState]:
+        if not os.path.exists(self._path):
+            return dict()
+        with open(self._path, 'r', encoding='utf8') as json_file:
+            loaded_data: dict[str, list] = json.load(json_file)
+        states: dict[ScheduleKey, ScheduleState] = dict()
+        for key, (due, message_index) in loaded_data.items():
+            chat_id, name = key.split(':', 1)
+            states[(int(chat_id), name)] = ScheduleState(due, message_index)
+        with self._lock:
+            self._states = dict(states)
+        return states
+
+    def __serialize(self) -> list[str]:
+        with self._lock:
+            serialized = {f'{chat_id}:{name}': [state.due, state.message_index]
+                          for (chat_id, name), state in self._states.items()}
+        return serialize_value(serialized, 0)
+
+
+class SqliteScheduleStore(ScheduleStore):
+    _storage: SqliteStorage
+    _removed: set[ScheduleKey]
+
+    def __init__(self, storage: SqliteStorage):
+        super().__init__()
+        self._storage = storage
+        self._removed = set()
+        self._storage.execute('CREATE TABLE IF NOT EXISTS schedule ('
+                              'chat_id INTEGER NOT NULL, '
+                              'name TEXT NOT NULL, '
+                              'due REAL NOT NULL, '
+                              'message_index INTEGER, '
+                              'PRIMARY KEY (chat_id, name))')
+        self._writer = DebouncedWriter(self.__write, delay=5.0)
+
+    def load_all(self) -> dict[ScheduleKey, ScheduleState]:
+        rows = self._storage.execute('SELECT chat_id, name, due, message_index FROM schedule')
+        return {(chat_id, name): ScheduleState(due, message_index) for chat_id, name, due, message_index in rows}
+
+    def save(self, key: ScheduleKey, state: ScheduleState) -> None:
+        with self._lock:
+            self._removed.discard(key)
+        super().save(key, state)
+
+    def remove(self, key: ScheduleKey) -> None:
+        with self._lock:
+            self._removed.add(key)
+        super().remove(key)
+
+    # only states changed since the last write are stored
+    def __write(self) -> None:
+        with self._lock:
+            changed = [(chat_id, name, state.due, state.message_index)
+                       for (chat_id, name), state in self._states.items()]
+            removed = list(self._removed)
+            states = self._states
+            self._states = dict()
+            self._removed = set()
+        try:
+            self._storage.write_many([
+                ('INSERT OR REPLACE INTO schedule (chat_id, name, due, message_index) VALUES (?, ?, ?, ?)', changed),
+                ('DELETE FROM schedule WHERE chat_id = ? AND name = ?', removed)
+            ])
+        except Exception:
+            # the writer retries, so the failed changes wait for it unless newer ones came in meanwhile
+            with self._lock:
+                for key, state in states.items():
+                    if key not in self._states and key not in self._removed:
+                        self._states[key] = state
+                for key in removed:
+                    if key not in self._states:
+                        self._removed.add(key)
+            raise
@@ -0,0 +1,392 @@
+import json
+import sqlite3
+from contextlib import contextmanager
+from threading import RLock
+from time import time
+from typing import Any, Iterable, Iterator, Optional
+
+from .chat_config import ChatConfig
+from .message_files import message_hash
+from .reminder_config import ReminderConfig
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS chats (
+    chat_id INTEGER PRIMARY KEY,
+    hide_text INTEGER NOT NULL DEFAULT 0,
+    variables TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS profiles (
+    id INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL REFERENCES chats (chat_id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    min_time INTEGER NOT NULL,
+    max_time INTEGER NOT NULL,
+    subscribers TEXT NOT NULL DEFAULT '[]',
+    selection TEXT NOT NULL DEFAULT 'uniform',
+    no_repeat_window INTEGER NOT NULL DEFAULT 3,
+    weights TEXT NOT NULL DEFAULT '[]',
+    UNIQUE (chat_id, name)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    profile_id INTEGER NOT NULL REFERENCES profiles (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    hash INTEGER,
+    PRIMARY KEY (profile_id, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS deliveries (
+    id INTEGER PRIMARY KEY,
+    profile_id INTEGER NOT NULL REFERENCES profiles (id) ON DELETE CASCADE,
+    chat_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    sent_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deliveries_by_profile ON deliveries (profile_id, sent_at);
+'''
+
+# columns added after the first release, created in older databases on open
+CHAT_COLUMNS = {
+    'variables': "TEXT NOT NULL DEFAULT '{}'"
+}
+PROFILE_COLUMNS = {
+    'selection': "TEXT NOT NULL DEFAULT 'uniform'",
+    'no_repeat_window': 'INTEGER NOT NULL DEFAULT 3',
+    'weights': "TEXT NOT NULL DEFAULT '[]'"
+}
+
+# bulk edits of a message list stage the document here and apply it with one statement
+# without an index: filling it is the slow part and sqlite indexes the lookups on the fly
+STAGED_SCHEMA = '''
+CREATE TEMP TABLE IF NOT EXISTS staged (
+    seq INTEGER PRIMARY KEY,
+    hash INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+'''
+
+# the first occurrence of every staged message missing from the profile goes to the end of the list
+APPEND_STAGED = '''
+INSERT INTO messages (profile_id, position, text, hash)
+SELECT :profile_id, :count + ROW_NUMBER() OVER (ORDER BY first) - 1, text, hash
+FROM (SELECT MIN(seq) AS first, text, hash FROM temp.staged
+      WHERE hash NOT IN (SELECT hash FROM messages WHERE profile_id = :profile_id)
+      GROUP BY hash)
+'''
+
+# positions are negated first, so the new ones never collide with the old ones on the primary key
+RENUMBER = (
+    'UPDATE messages SET position = -1 - position WHERE profile_id = :profile_id',
+    '''UPDATE messages SET position = numbered.position
+       FROM (SELECT position AS old_position, ROW_NUMBER() OVER (ORDER BY position DESC) - 1 AS position
+             FROM messages WHERE profile_id = :profile_id) AS numbered
+       WHERE messages.profile_id = :profile_id AND messages.position = numbered.old_position'''
+)
+
+
+class SqliteStorage:
+    _connection: sqlite3.Connection
+    # one connection is shared by the menu, the scheduler workers and the config writer
+    _lock: RLock
+
+    def __init__(self, path: str):
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = RLock()
+        with self._lock:
+            self._connection.execute('PRAGMA journal_mode = WAL')
+            self._connection.execute('PRAGMA synchronous = NORMAL')
+            self._connection.execute('PRAGMA foreign_keys = ON')
+            self._connection.executescript(SCHEMA)
+            for table, columns in (('chats', CHAT_COLUMNS), ('profiles', PROFILE_COLUMNS)):
+                existing = {row[1] for row in self._connection.execute(f'PRAGMA table_info({table})')}
+                for column, definition in columns.items():
+                    if column not in existing:
+                        self._connection.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+            # messages of older databases get their digests once
+            self._connection.create_function('message_hash', 1, message_hash, deterministic=True)
+            if 'hash' not in {row[1] for row in self._connection.execute('PRAGMA table_info(messages)')}:
+                self._connection.execute('ALTER TABLE messages ADD COLUMN hash INTEGER')
+                self._connection.execute('UPDATE messages SET hash = message_hash(text)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS messages_by_hash ON messages (profile_id, hash)')
+            self._connection.executescript(STAGED_SCHEMA)
+
+    def execute(self, query: str, parameters: Iterable[Any] = ()) -> list[tuple]:
+        with self._lock:
+            return self._connection.execute(query, tuple(parameters)).fetchall()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self._connection.execute('BEGIN')
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+            self._connection.execute('COMMIT')
+
+    def write_many(self, statements: Iterable[tuple[str, Iterable[Iterable[Any]]]]) -> None:
+        with self.transaction() as connection:
+            for query, rows in statements:
+                connection.executemany(query, rows)
+
+    def replace_messages(self, profile_id: int, messages: Iterable[str]) -> int:
+        with self.transaction() as connection:
+            connection.execute('DELETE FROM messages WHERE profile_id = ?', (profile_id,))
+            return self.insert_messages(profile_id, messages)
+
+    def insert_messages(self, profile_id: int, messages: Iterable[str], first_position: int = 0) -> int:
+        with self._lock:
+            cursor = self._connection.executemany(
+                'INSERT INTO messages (profile_id, position, text, hash) VALUES (?, ?, ?, ?)',
+                ((profile_id, position, text, message_hash(text))
+                 for position, text in enumerate(messages, first_position)))
+            return cursor.rowcount
+
+    # bulk edits; the messages are streamed into the staging table, so only the database holds them all
+    # each returns how many messages were added or removed
+
+    def append_messages(self, profile_id: int, messages: Iterable[str]) -> int:
+        with self.transaction() as connection:
+            self.__stage(messages)
+            count, = connection.execute('SELECT COUNT(*) FROM messages WHERE profile_id = ?', (profile_id,)).fetchone()
+            added = connection.execute(APPEND_STAGED, {'profile_id': profile_id, 'count': count}).rowcount
+            connection.execute('DELETE FROM temp.staged')
+            return added
+
+    def remove_messages(self, profile_id: int, messages: Iterable[str]) -> int:
+        with self.transaction() as connection:
+            self.__stage(messages)
+            left, = connection.execute(
+                'SELECT COUNT(*) FROM messages WHERE profile_id = ? AND hash NOT IN (SELECT hash FROM temp.staged)',
+                (profile_id,)).fetchone()
+            if not left:
+                raise ValueError(f'Profile {profile_id} would have no messages left')
+            removed = connection.execute(
+                'DELETE FROM messages WHERE profile_id = ? AND hash IN (SELECT hash FROM temp.staged)',
+                (profile_id,)).rowcount
+            connection.execute('DELETE FROM temp.staged')
+            if removed:
+                self.__renumber(profile_id)
+            return removed
+
+    # the first of equal messages stays in its place
+    def deduplicate_messages(self, profile_id: int) -> int:
+        with self.transaction() as connection:
+            removed = connection.execute(
+                'DELETE FROM messages WHERE profile_id = :profile_id AND position NOT IN '
+                '(SELECT MIN(position) FROM messages WHERE profile_id = :profile_id GROUP BY hash)',
+                {'profile_id': profile_id}).rowcount
+            if removed:
+                self.__renumber(profile_id)
+            return removed
+
+    # read in pages, so an export does not hold the lock, or the whole list, for long
+    def iter_messages(self, profile_id: int, page_size: int = 1000) -> Iterator[str]:
+        position = 0
+        while True:
+            rows = self.execute('SELECT position, text FROM messages WHERE profile_id = ? AND position >= ? '
+                                'ORDER BY position LIMIT ?', (profile_id, position, page_size))
+            for position, text in rows:
+                yield text
+            if len(rows) < page_size:
+                return
+            position += 1
+
+    def __stage(self, messages: Iterable[str]) -> None:
+        self._connection.executemany('INSERT INTO temp.staged (hash, text) VALUES (?, ?)',
+                                     ((message_hash(text), text) for text in messages))
+
+    def __renumber(self, profile_id: int) -> None:
+        for query in RENUMBER:
+            self._connection.execute(query, {'profile_id': profile_id})
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.execute('SELECT 1 FROM chats LIMIT 1')
+
+    # one time import of the chats section of config.json
+    def import_chats(self, chats_serialized: list[dict[str, Any]]) -> None:
+        with self.transaction() as connection:
+            for chat in chats_serialized:
+                connection.execute('INSERT INTO chats (chat_id, hide_text, variables) VALUES (?, ?, ?)',
+                                   (chat['_chat_id'], int(chat.get('_hide_text', False)),
+                                    json.dumps(ChatConfig.variables_from(chat), ensure_ascii=False)))
+                for reminder in chat.get('_reminders', list()):
+                    min_time, max_time = reminder['_time_range']
+                    cursor = connection.execute(
+                        'INSERT INTO profiles (chat_id, name, min_time, max_time, subscribers, selection, '
+                        'no_repeat_window, weights) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (chat['_chat_id'], reminder['_name'], min_time, max_time,
+                         json.dumps(reminder.get('_subscribers', list())),
+                         reminder.get('_selection', 'uniform'), reminder.get('_no_repeat_window', 3),
+                         json.dumps(reminder.get('_weights', list()))))
+                    self.insert_messages(cursor.lastrowid, reminder['_messages'])
+
+    def load_chats(self) -> dict[int, ChatConfig]:
+        message_counts = dict(self.execute('SELECT profile_id, COUNT(*) FROM messages GROUP BY profile_id'))
+        reminders: dict[int, dict[str, ReminderConfig]] = dict()
+        for profile_id, chat_id, name, min_time, max_time, subscribers, selection, no_repeat_window, weights in \
+                self.execute('SELECT id, chat_id, name, min_time, max_time, subscribers, selection, no_repeat_window, '
+                             'weights FROM profiles ORDER BY id'):
+            reminders.setdefault(chat_id, dict())[name] = SqliteReminderConfig(
+                self, profile_id, name, (min_time, max_time), json.loads(subscribers),
+                message_counts.get(profile_id, 0), selection, no_repeat_window, json.loads(weights))
+        return {chat_id: SqliteChatConfig(self, chat_id, bool(hide_text), reminders.get(chat_id, dict()),
+                                          json.loads(variables))
+                for chat_id, hide_text, variables in self.execute('SELECT chat_id, hide_text, variables FROM chats')}
+
+    def add_chat(self, chat_id: int) -> 'SqliteChatConfig':
+        self.execute('INSERT OR IGNORE INTO chats (chat_id) VALUES (?)', (chat_id,))
+        return SqliteChatConfig(self, chat_id, False, dict())
+
+
+def _no_dump() -> None:
+    pass
+
+
+class SqliteChatConfig(ChatConfig):
+    __slots__ = ('_storage',)
+
+    _storage: SqliteStorage
+
+    def __init__(self,
+                 storage: SqliteStorage,
+                 chat_id: int,
+                 hide_text: bool,
+                 reminders: dict[str, ReminderConfig],
+                 variables: Optional[dict[str, str]] = None):
+        super().__init__(chat_id, hide_text, reminders, _no_dump, variables)
+        self._storage = storage
+
+    @ChatConfig.hide_text.setter
+    def hide_text(self, value: bool) -> None:
+        self._hide_text = value
+        self._storage.execute('UPDATE chats SET hide_text = ? WHERE chat_id = ?', (int(value), self._chat_id))
+
+    @ChatConfig.variables.setter
+    def variables(self, new_variables: dict[str, str]) -> None:
+        self._variables = new_variables
+        self._storage.execute('UPDATE chats SET variables = ? WHERE chat_id = ?',
+                              (json.dumps(new_variables, ensure_ascii=False), self._chat_id))
+
+
+# keeps only the profile row in memory, messages are read by position on demand
+class SqliteReminderConfig(ReminderConfig):
+    __slots__ = ('_storage', '_profile_id')
+
+    _storage: SqliteStorage
+    _profile_id: int
+
+    def __init__(self,
+                 storage: SqliteStorage,
+                 profile_id: int,
+                 name: str,
+                 time_range: tuple[int, int],
+                 subscribers: list[int],
+                 message_count: int,
+                 selection: str = 'uniform',
+                 no_repeat_window: int = 3,
+                 weights: Optional[list[float]] = None):
+        super().__init__(name, None, time_range, _no_dump, subscribers, selection, no_repeat_window, weights)
+        self._storage = storage
+        self._profile_id = profile_id
+        self._message_count = message_count
+
+    @property
+    def profile_id(self) -> int:
+        return self._profile_id
+
+    @ReminderConfig.name.setter
+    def name(self, new_name: str) -> None:
+        self._name = new_name
+        self._revision += 1
+        self._storage.execute('UPDATE profiles SET name = ? WHERE id = ?', (new_name, self._profile_id))
+
+    @property
+    def messages(self) -> list[str]:
+        return [text for text, in self._storage.execute(
+            'SELECT text FROM messages WHERE profile_id = ? ORDER BY position', (self._profile_id,))]
+
+    @messages.setter
+    def messages(self, new_messages: list[str]) -> None:
+        self._message_count = self._storage.replace_messages(self._profile_id, new_messages)
+        self._messages_revision += 1
+        self._revision += 1
+
+    @property
+    def message_count(self) -> int:
+        return self._message_count
+
+    def message_at(self, index: int) -> str:
+        rows = self._storage.execute('SELECT text FROM messages WHERE profile_id = ? AND position = ?',
+                                     (self._profile_id, index))
+        if not rows:
+            raise IndexError(f'Profile {self._name} has no message {index}')
+        return rows[0][0]
+
+    def iter_messages(self) -> Iterator[str]:
+        return self._storage.iter_messages(self._profile_id)
+
+    def append_messages(self, messages: Iterable[str]) -> int:
+        return self.__counted(self._storage.append_messages(self._profile_id, messages))
+
+    def remove_messages(self, messages: Iterable[str]) -> int:
+        return self.__counted(-self._storage.remove_messages(self._profile_id, messages))
+
+    def deduplicate_messages(self) -> int:
+        return self.__counted(-self._storage.deduplicate_messages(self._profile_id))
+
+    # takes the change of the message count, returns how many messages were added or removed
+    def __counted(self, change: int) -> int:
+        if change:
+            self._message_count += change
+            self._messages_revision += 1
+            self._revision += 1
+        return abs(change)
+
+    @ReminderConfig.time_range.setter
+    def time_range(self, new_range: tuple[int, int]) -> None:
+        self._time_range = new_range
+        self._revision += 1
+        self._storage.execute('UPDATE profiles SET min_time = ?, max_time = ? WHERE id = ?',
+                              (new_range[0], new_range[1], self._profile_id))
+
+    @ReminderConfig.subscribers.setter
+    def subscribers(self, new_subscribers: list[int]) -> None:
+        self._subscribers = new_subscribers
+        self._revision += 1
+        self._storage.execute('UPDATE profiles SET subscribers = ? WHERE id = ?',
+                              (json.dumps(new_subscribers), self._profile_id))
+
+    @ReminderConfig.selection.setter
+    def selection(self, new_selection: str) -> None:
+        self._selection = new_selection
+        self._revision += 1
+        self._storage.execute('UPDATE profiles SET selection = ? WHERE id = ?', (new_selection, self._profile_id))
+
+    @ReminderConfig.no_repeat_window.setter
+    def no_repeat_window(self, new_window: int) -> None:
+        self._no_repeat_window = new_window
+        self._revision += 1
+        self._storage.execute('UPDATE profiles SET no_repeat_window = ? WHERE id = ?', (new_window, self._profile_id))
+
+    @ReminderConfig.weights.setter
+    def weights(self, new_weights: list[float]) -> None:
+        self._weights = new_weights
+        self._revision += 1
+        self._storage.execute('UPDATE profiles SET weights = ? WHERE id = ?',
+                              (json.dumps(new_weights), self._profile_id))
+
+    def record_delivery(self, chat_id: int, message_index: int) -> None:
+        self._storage.execute('INSERT INTO deliveries (profile_id, chat_id, position, sent_at) VALUES (?, ?, ?, ?)',
+                              (self._profile_id, chat_id, message_index, time()))
+
+    def last_deliveries(self, limit: int) -> list[tuple[int, int, float]]:
+        return self._storage.execute(
+            'SELECT chat_id, position, sent_at FROM deliveries WHERE profile_id = ? ORDER BY sent_at DESC LIMIT ?',
+            (self._profile_id, limit))
+
+    def to_dict(self) -> dict[str, Any]:
+        result = super().to_dict()
+        result['_messages'] = self.messages
+        return result
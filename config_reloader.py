@@ -0,0 +1,64 @@
+from typing import Callable, Optional
+
+from config import Config, ReminderConfig
+from reminder import Reminder
+from telegram import BotMenuThread
+
+
+# applies config.json edits to the running reminders: added ones are started, removed ones stopped and
+# modified ones keep their place in the schedule, only the changed parts are drawn again
+class ConfigReloader:
+    _config: Config
+    # the same dict the menu works with, by chat id and reminder name
+    _reminders: dict[int, dict[str, Reminder]]
+    # builds a reminder of the given chat the same way the launcher does
+    _create_reminder: Callable[[ReminderConfig, int], Reminder]
+    _menu: Optional[BotMenuThread]
+
+    def __init__(self,
+                 config: Config,
+                 reminders: dict[int, dict[str, Reminder]],
+                 create_reminder: Callable[[ReminderConfig, int], Reminder],
+                 menu: Optional[BotMenuThread] = None):
+        self._config = config
+        self._reminders = reminders
+        self._create_reminder = create_reminder
+        self._menu = menu
+
+    def reload(self) -> None:
+        changes = self._config.reload()
+        if not changes:
+            return
+        # the chat dicts are replaced, not changed in place, so the menu can keep iterating over them
+        updated: dict[int, dict[str, Reminder]] = dict()
+        for chat_id, name in changes.removed:
+            chat_reminders = updated.setdefault(chat_id, dict(self._reminders.get(chat_id, dict())))
+            reminder = chat_reminders.pop(name, None)
+            if reminder is not None:
+                reminder.stop()
+                print(f'Reminder \'{name}\' of chat {chat_id} removed')
+            # a reminder added later under the same name starts a new schedule
+            self._config.schedule_store.remove((chat_id, name))
+        for chat_id, name in changes.added:
+            chat_reminders = updated.setdefault(chat_id, dict(self._reminders.get(chat_id, dict())))
+            reminder = self._create_reminder(self._config.chats[chat_id].reminders[name], chat_id)
+            chat_reminders[name] = reminder
+            reminder.start()
+            print(f'Reminder \'{name}\' of chat {chat_id} added')
+        for chat_id, chat_reminders in updated.items():
+            if chat_id in self._config.chats:
+                self._reminders[chat_id] = chat_reminders
+            else:
+                self._reminders.pop(chat_id, None)
+        for chat_id in self._config.chats:
+            self._reminders.setdefault(chat_id, dict())
+
+        for (chat_id, name), fields in changes.modified.items():
+            reminder = self._reminders.get(chat_id, dict()).get(name)
+            if reminder is not None:
+                reminder.config_changed(fields)
+        if self._menu is not None:
+            for chat_id in changes.chats:
+                self._menu.invalidate_chat(chat_id)
+        if changes.settings:
+            print(f'Changed settings {", ".join(sorted(changes.settings))} take effect after a restart')
@@ -1,17 +1,82 @@
+import signal
+from threading import Event
+from time import monotonic
+from typing import Union
+
 from reminder import Reminder
-from telegram import BotMenuThread, Telegram
-from config import Config
+from random_source import create_random_source
+from scheduler import Scheduler
+from telegram import BotMenuThread, SessionStore, Telegram, WebhookServer
+from config import Config, FileWatcher, ReminderConfig
+from config_reloader import ConfigReloader
+from metrics import metrics
+from sharding import RemoteReminder, ShardCoordinator
 
 
 config = Config()
-telegram = Telegram()
+if config.metrics_port is not None or config.metrics_log_path is not None:
+    metrics.enable(config.metrics_port, log_path=config.metrics_log_path)
+telegram = Telegram(config)
+scheduler = Scheduler()
+random_source = create_random_source(config.random_source)
+# with sharding the reminders run in worker processes and this one keeps the config, the menu and the sending
+coordinator = ShardCoordinator(config, telegram.send_async) if config.sharding else None
+
+
+def create_reminder(reminder_config: ReminderConfig, chat_id: int) -> Union[Reminder, RemoteReminder]:
+    if coordinator is not None:
+        return RemoteReminder(reminder_config, chat_id, coordinator)
+    return Reminder(reminder_config, chat_id, telegram.send_async, scheduler, random_source, config.schedule_store,
+                    chat_variables=config.chat_variables)
+
 
-reminders: dict[str, Reminder] = dict()
-for reminder_name, reminder_config in config.reminders.items():
-    reminders[reminder_name] = Reminder(reminder_config, telegram.send)
+reminders: dict[int, dict[str, Union[Reminder, RemoteReminder]]] = dict()
+for chat_id, chat_config in config.chats.items():
+    chat_reminders: dict[str, Union[Reminder, RemoteReminder]] = dict()
+    for reminder_name, reminder_config in chat_config.reminders.items():
+        chat_reminders[reminder_name] = create_reminder(reminder_config, chat_id)
+    reminders[chat_id] = chat_reminders
 
-telegram_menu = BotMenuThread(telegram, reminders)
+webhook = None
+if config.webhook_url is not None:
+    webhook = WebhookServer(telegram.bot, config.webhook_url, config.webhook_host, config.webhook_port,
+                            config.webhook_secret, config.webhook_workers)
+sessions = SessionStore(config.session_ttl, config.sessions_path)
+telegram_menu = BotMenuThread(telegram, reminders, webhook, sessions)
 telegram_menu.start()
 
-for thread in reminders.values():
-    thread.start()
+# the whole saved schedule is read at once
+schedule_states = config.schedule_store.load_all()
+if coordinator is not None:
+    coordinator.start()
+else:
+    scheduler.start()
+for chat_id, chat_reminders in reminders.items():
+    for reminder_name, reminder in chat_reminders.items():
+        reminder.restore(schedule_states.get((chat_id, reminder_name)), config.catch_up_policy,
+                         config.catch_up_spacing)
+
+if config.hot_reload:
+    FileWatcher('config.json', ConfigReloader(config, reminders, create_reminder, telegram_menu).reload).start()
+
+stop_requested = Event()
+for signal_number in (signal.SIGINT, signal.SIGTERM):
+    signal.signal(signal_number, lambda *_: stop_requested.set())
+# the timeout keeps the main thread waking up to run signal handlers
+while not stop_requested.wait(1):
+    pass
+
+# graceful shutdown: no new updates and fires, then the messages already queued are sent within the timeout
+print('Shutting down')
+shutdown_started = monotonic()
+telegram_menu.stop()
+if coordinator is not None:
+    finished = coordinator.shutdown(config.shutdown_timeout)
+else:
+    finished = scheduler.shutdown(config.shutdown_timeout)
+if not finished:
+    print('Some reminders did not finish sending in time')
+left = telegram.send_queue.drain(max(0.0, config.shutdown_timeout - (monotonic() - shutdown_started)))
+if left:
+    print(f'{left} messages were not sent before shutdown')
+# config and schedule are saved by their atexit handlers
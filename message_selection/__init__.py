@@ -0,0 +1,21 @@
+from config.reminder_config import ReminderConfig
+from random_source import RandomSource
+from .message_selector import MessageSelector
+from .uniform_selector import UniformSelector
+from .shuffle_bag_selector import ShuffleBagSelector
+from .no_repeat_selector import NoRepeatSelector
+from .alias_selector import AliasSelector
+
+SELECTIONS = ('uniform', 'shuffle_bag', 'no_repeat', 'weighted')
+
+
+def create_message_selector(config: ReminderConfig, random_source: RandomSource) -> MessageSelector:
+    if config.selection == 'uniform':
+        return UniformSelector(random_source, config.message_count)
+    if config.selection == 'shuffle_bag':
+        return ShuffleBagSelector(random_source, config.message_count)
+    if config.selection == 'no_repeat':
+        return NoRepeatSelector(random_source, config.message_count, config.no_repeat_window)
+    if config.selection == 'weighted':
+        return AliasSelector(random_source, config.message_count, config.weights)
+    raise ValueError(f'Unknown message selection: {config.selection}')
@@ -0,0 +1,61 @@
+from array import array
+
+from random_source import RandomSource
+from .message_selector import MessageSelector
+
+# resolution of the uniform number compared against a column probability
+RESOLUTION = 1 << 20
+
+
+# weighted draws with Vose's alias method: one column pick and one coin flip per draw
+class AliasSelector(MessageSelector):
+    # weights of messages without an explicit weight are 1
+    _weights: array
+    _probabilities: array
+    _aliases: array
+
+    def __init__(self, random_source: RandomSource, message_count: int, weights: list[float]):
+        super().__init__(random_source, message_count)
+        self._weights = array('d', weights[:message_count])
+        self._weights.extend([1.0] * (message_count - len(self._weights)))
+        self.__build()
+
+    def set_weights(self, weights: list[float]) -> None:
+        with self._lock:
+            self._weights = array('d', weights[:self._message_count])
+            self._weights.extend([1.0] * (self._message_count - len(self._weights)))
+            self.__build()
+
+    def _draw(self) -> int:
+        column = self._random_source.randint(0, self._message_count - 1)
+        if self._random_source.randint(0, RESOLUTION - 1) < self._probabilities[column] * RESOLUTION:
+            return column
+        return self._aliases[column]
+
+    # the table is rebuilt in O(n), only the weights array is updated in place
+    def _resize(self, message_count: int) -> None:
+        if message_count > len(self._weights):
+            self._weights.extend([1.0] * (message_count - len(self._weights)))
+        else:
+            del self._weights[message_count:]
+        self.__build()
+
+    def __build(self) -> None:
+        count = len(self._weights)
+        total = sum(self._weights)
+        self._probabilities = array('d', [1.0]) * count
+        self._aliases = array('I', range(count))
+        if count == 0 or total <= 0:
+            return
+        scaled = [weight * count / total for weight in self._weights]
+        small = [index for index, value in enumerate(scaled) if value < 1]
+        large = [index for index, value in enumerate(scaled) if value >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self._probabilities[less] = scaled[less]
+            self._aliases[less] = more
+            scaled[more] -= 1 - scaled[less]
+            (small if scaled[more] < 1 else large).append(more)
+        # leftovers are 1 up to rounding errors
+        for index in small + large:
+            self._probabilities[index] = 1.0
@@ -0,0 +1,46 @@
+from abc import ABC, abstractmethod
+from threading import Lock
+
+from random_source import RandomSource
+
+
+class MessageSelector(ABC):
+    _random_source: RandomSource
+    _message_count: int
+    # the scheduler draws while the menu edits the messages
+    _lock: Lock
+
+    def __init__(self, random_source: RandomSource, message_count: int):
+        self._random_source = random_source
+        self._message_count = message_count
+        self._lock = Lock()
+
+    @property
+    def message_count(self) -> int:
+        return self._message_count
+
+    # index of the next message to send
+    def draw(self) -> int:
+        with self._lock:
+            return self._draw() if self._message_count > 1 else 0
+
+    def draws(self, count: int) -> list[int]:
+        with self._lock:
+            if self._message_count <= 1:
+                return [0] * count
+            return [self._draw() for _ in range(count)]
+
+    # messages were added to or removed from the end of the list, indices below the new count keep their meaning
+    # after any other edit the indices the selector remembers point to other messages, it must be created again
+    def resize(self, message_count: int) -> None:
+        with self._lock:
+            self._resize(message_count)
+            self._message_count = message_count
+
+    @abstractmethod
+    def _draw(self) -> int:
+        ...
+
+    @abstractmethod
+    def _resize(self, message_count: int) -> None:
+        ...
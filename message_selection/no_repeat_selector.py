@@ -0,0 +1,43 @@
+from array import array
+from collections import deque
+
+from random_source import RandomSource
+from .message_selector import MessageSelector
+
+
+# none of the last window messages is drawn again
+class NoRepeatSelector(MessageSelector):
+    _window: int
+    # indices that may be drawn, in no particular order
+    _available: array
+    # recently drawn indices, oldest first, they return to _available when they leave the window
+    _recent: deque
+
+    def __init__(self, random_source: RandomSource, message_count: int, window: int):
+        super().__init__(random_source, message_count)
+        self._window = window
+        self._available = array('I', range(message_count))
+        self._recent = deque()
+
+    # the chosen index is swapped with the last available one and popped
+    def _draw(self) -> int:
+        available = self._available
+        chosen = self._random_source.randint(0, len(available) - 1)
+        index = available[chosen]
+        available[chosen] = available[-1]
+        available.pop()
+        self._recent.append(index)
+        # at least one message always stays available
+        if len(self._recent) > min(self._window, self._message_count - 1):
+            available.append(self._recent.popleft())
+        return index
+
+    def _resize(self, message_count: int) -> None:
+        if message_count > self._message_count:
+            self._available.extend(range(self._message_count, message_count))
+        else:
+            self._available = array('I', (index for index in self._available if index < message_count))
+            self._recent = deque(index for index in self._recent if index < message_count)
+        # a shrunk list may leave more recent messages than the window allows
+        while self._recent and len(self._recent) > min(self._window, message_count - 1):
+            self._available.append(self._recent.popleft())
@@ -0,0 +1,44 @@
+from array import array
+
+from random_source import RandomSource
+from .message_selector import MessageSelector
+
+
+# every message is sent once per round, rounds are shuffled one swap per draw
+class ShuffleBagSelector(MessageSelector):
+    # indices before _position were drawn in the current round
+    _bag: array
+    _position: int
+    _last: int
+
+    def __init__(self, random_source: RandomSource, message_count: int):
+        super().__init__(random_source, message_count)
+        self._bag = array('I', range(message_count))
+        self._position = 0
+        self._last = -1
+
+    # Fisher-Yates step: the drawn index is swapped to the front of the undrawn part
+    def _draw(self) -> int:
+        if self._position >= len(self._bag):
+            self._position = 0
+        remaining = len(self._bag) - self._position
+        chosen = self._position + self._random_source.randint(0, remaining - 1)
+        # a new round must not start with the message that ended the previous one
+        if self._bag[chosen] == self._last and remaining > 1:
+            chosen = self._position + (chosen - self._position + 1 + self._random_source.randint(0, remaining - 2)) \
+                % remaining
+        bag = self._bag
+        bag[self._position], bag[chosen] = bag[chosen], bag[self._position]
+        self._last = bag[self._position]
+        self._position += 1
+        return self._last
+
+    # new messages join the current round, removed ones are dropped from it
+    def _resize(self, message_count: int) -> None:
+        if message_count > self._message_count:
+            self._bag.extend(range(self._message_count, message_count))
+            return
+        drawn = [index for index in self._bag[:self._position] if index < message_count]
+        undrawn = [index for index in self._bag[self._position:] if index < message_count]
+        self._bag = array('I', drawn + undrawn)
+        self._position = len(drawn)
@@ -0,0 +1,15 @@
+from .message_selector import MessageSelector
+
+
+# independent draws, the same message may come twice in a row
+class UniformSelector(MessageSelector):
+    def draws(self, count: int) -> list[int]:
+        if self._message_count <= 1:
+            return [0] * count
+        return self._random_source.randints(0, self._message_count - 1, count)
+
+    def _draw(self) -> int:
+        return self._random_source.randint(0, self._message_count - 1)
+
+    def _resize(self, message_count: int) -> None:
+        pass
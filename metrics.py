@@ -0,0 +1,156 @@
+import json
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import time
+from typing import Callable, Optional, TextIO
+
+Labels = tuple[tuple[str, str], ...]
+
+# upper bounds in seconds, the +Inf bucket is implied
+BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _labels(labels: Optional[dict[str, str]]) -> Labels:
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{str(value)}"' for key, value in pairs) + '}'
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'count', 'sum')
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.buckets[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+# process wide registry; every recording call returns right away until enable() is called
+class Metrics:
+    _enabled: bool
+    _lock: Lock
+    _counters: dict[str, dict[Labels, float]]
+    _histograms: dict[str, dict[Labels, _Histogram]]
+    _gauges: dict[str, Callable[[], float]]
+    _log_sink: Optional[TextIO]
+    _server: Optional[ThreadingHTTPServer]
+
+    def __init__(self):
+        self._enabled = False
+        self._lock = Lock()
+        self._counters = dict()
+        self._histograms = dict()
+        self._gauges = dict()
+        self._log_sink = None
+        self._server = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    def enable(self, port: Optional[int] = None, host: str = '127.0.0.1', log_path: Optional[str] = None) -> None:
+        self._enabled = True
+        if log_path is not None:
+            self._log_sink = open(log_path, 'a', encoding='utf8', buffering=1)
+        if port is not None:
+            self._server = ThreadingHTTPServer((host, port), self.__handler_class())
+            Thread(target=self._server.serve_forever, name='metrics-http', daemon=True).start()
+            print(f'Metrics are served on http://{host}:{self._server.server_port}/metrics')
+
+    # recording
+
+    def inc(self, name: str, labels: Optional[dict[str, str]] = None, value: float = 1) -> None:
+        if not self._enabled:
+            return
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, dict())
+            series[key] = series.get(key, 0) + value
+        self.__log(name, key, value)
+
+    def observe(self, name: str, value: float, labels: Optional[dict[str, str]] = None) -> None:
+        if not self._enabled:
+            return
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, dict())
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = _Histogram()
+                series[key] = histogram
+            histogram.observe(value)
+        self.__log(name, key, value)
+
+    # gauges are read only when metrics are scraped
+    def register_gauge(self, name: str, callback: Callable[[], float]) -> None:
+        self._gauges[name] = callback
+
+    # exposition
+
+    def render(self) -> str:
+        lines: list[str] = list()
+        with self._lock:
+            for name, series in self._counters.items():
+                lines.append(f'# TYPE {name} counter')
+                for labels, value in series.items():
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+            for name, series in self._histograms.items():
+                lines.append(f'# TYPE {name} histogram')
+                for labels, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS + (float('inf'),), histogram.buckets):
+                        cumulative += count
+                        bound_label = '+Inf' if bound == float('inf') else str(bound)
+                        lines.append(f'{name}_bucket{_format_labels(labels, (("le", bound_label),))} {cumulative}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {histogram.sum}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+        for name, callback in list(self._gauges.items()):
+            try:
+                value = callback()
+            except Exception as error:
+                print(f'Failed to read gauge {name}: {error!r}')
+                continue
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def __log(self, name: str, labels: Labels, value: float) -> None:
+        if self._log_sink is None:
+            return
+        record = json.dumps({'ts': time(), 'metric': name, 'labels': dict(labels), 'value': value})
+        with self._lock:
+            self._log_sink.write(record + '\n')
+
+    def __handler_class(self) -> type:
+        registry = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        return MetricsRequestHandler
+
+
+metrics = Metrics()
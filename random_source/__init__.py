@@ -0,0 +1,14 @@
+from .random_source import RandomSource
+from .secrets_source import SecretsRandomSource
+from .numpy_source import NumpyRandomSource
+from .random_org_source import RandomOrgRandomSource, shared_random_org_source
+
+
+def create_random_source(name: str) -> RandomSource:
+    if name == 'secrets':
+        return SecretsRandomSource()
+    if name == 'numpy':
+        return NumpyRandomSource()
+    if name == 'random_org':
+        return shared_random_org_source(SecretsRandomSource())
+    raise ValueError(f'Unknown random source: {name}')
@@ -0,0 +1,40 @@
+from secrets import randbits
+from threading import Lock
+
+from .random_source import RandomSource
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class NumpyRandomSource(RandomSource):
+    _generator: 'numpy.random.Generator'
+    _buffers: dict[tuple[int, int], list[int]]
+    _batch_size: int
+    _lock: Lock
+
+    def __init__(self, batch_size: int = 1024):
+        if numpy is None:
+            raise ImportError('NumpyRandomSource requires numpy, install it with "pip install numpy"')
+        # PCG64 is not a CSPRNG, so it is at least seeded from the OS entropy pool
+        self._generator = numpy.random.default_rng(randbits(128))
+        self._buffers = dict()
+        self._batch_size = batch_size
+        self._lock = Lock()
+
+    def randint(self, min_value: int, max_value: int) -> int:
+        with self._lock:
+            buffer = self._buffers.get((min_value, max_value))
+            if not buffer:
+                buffer = self._generate(min_value, max_value, self._batch_size)
+                self._buffers[(min_value, max_value)] = buffer
+            return buffer.pop()
+
+    def randints(self, min_value: int, max_value: int, count: int) -> list[int]:
+        with self._lock:
+            return self._generate(min_value, max_value, count)
+
+    def _generate(self, min_value: int, max_value: int, count: int) -> list[int]:
+        return self._generator.integers(min_value, max_value, size=count, endpoint=True).tolist()
@@ -0,0 +1,158 @@
+from array import array
+from threading import Event, Lock, Thread
+from time import perf_counter, sleep
+from typing import Optional
+
+from requests import RequestException, Session
+from requests.adapters import HTTPAdapter
+
+from metrics import metrics
+from .random_source import RandomSource
+
+
+_session: Optional[Session] = None
+_session_lock = Lock()
+
+
+# one keep-alive connection pool for every random.org request in the process
+def shared_session() -> Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = Session()
+            _session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        return _session
+
+
+class RandomOrgRandomSource(RandomSource):
+    URL: str = 'https://www.random.org/integers/'
+    # raw numbers are fetched uniformly from [0, RAW_RANGE) and mapped onto each requested range
+    RAW_RANGE: int = 10 ** 9
+    # random.org limit of numbers per request
+    MAX_BATCH: int = 10000
+
+    _fallback: RandomSource
+    _capacity: int
+    _low_watermark: int
+    _timeout: float
+    _retries: int
+    _cache: array
+    _lock: Lock
+    _refill_needed: Event
+    _fetcher: Thread
+
+    def __init__(self,
+                 fallback: RandomSource,
+                 cache_bytes: int = 64 * 1024,
+                 low_watermark: float = 0.25,
+                 timeout: float = 10,
+                 retries: int = 3):
+        self._fallback = fallback
+        self._cache = array('I')
+        self._capacity = max(1, cache_bytes // self._cache.itemsize)
+        self._low_watermark = int(self._capacity * low_watermark)
+        self._timeout = timeout
+        self._retries = retries
+        self._lock = Lock()
+        self._refill_needed = Event()
+        self._refill_needed.set()
+        self._fetcher = Thread(target=self._fetch_loop, name='random-org-prefetch', daemon=True)
+        self._fetcher.start()
+
+    def randint(self, min_value: int, max_value: int) -> int:
+        with self._lock:
+            value = self._draw(max_value - min_value + 1)
+        # never wait for the network: an exhausted cache is served from the local source
+        if value is None:
+            return self._fallback.randint(min_value, max_value)
+        return min_value + value
+
+    def randints(self, min_value: int, max_value: int, count: int) -> list[int]:
+        size = max_value - min_value + 1
+        result: list[int] = list()
+        with self._lock:
+            for _ in range(count):
+                value = self._draw(size)
+                if value is None:
+                    break
+                result.append(min_value + value)
+        if len(result) < count:
+            result.extend(self._fallback.randints(min_value, max_value, count - len(result)))
+        return result
+
+    # unbiased mapping of the shared raw stream onto [0, size), must be called under the lock
+    def _draw(self, size: int) -> Optional[int]:
+        if size > self.RAW_RANGE:
+            return None
+        limit = self.RAW_RANGE - self.RAW_RANGE % size
+        value: Optional[int] = None
+        while self._cache:
+            raw = self._cache.pop()
+            if raw < limit:
+                value = raw % size
+                break
+        if len(self._cache) < self._low_watermark:
+            self._refill_needed.set()
+        return value
+
+    def _fetch_loop(self) -> None:
+        while True:
+            self._refill_needed.wait()
+            with self._lock:
+                missing = self._capacity - len(self._cache)
+            while missing > 0:
+                numbers = self._fetch_with_retries(min(missing, self.MAX_BATCH))
+                if not numbers:
+                    break
+                with self._lock:
+                    self._cache.extend(numbers[:self._capacity - len(self._cache)])
+                    missing = self._capacity - len(self._cache)
+            with self._lock:
+                if len(self._cache) >= self._low_watermark:
+                    self._refill_needed.clear()
+            if self._refill_needed.is_set():
+                # the cache is still below the watermark after failed requests
+                sleep(self._timeout)
+
+    def _fetch_with_retries(self, count: int) -> list[int]:
+        for attempt in range(self._retries):
+            started = perf_counter()
+            try:
+                numbers = self._fetch(count)
+                metrics.observe('random_org_fetch_seconds', perf_counter() - started)
+                metrics.inc('random_org_fetch_total', {'result': 'ok'})
+                return numbers
+            except (RequestException, ValueError) as error:
+                metrics.inc('random_org_fetch_total', {'result': 'error'})
+                print(f'random.org request failed ({attempt + 1}/{self._retries}): {error!r}')
+                sleep(2 ** attempt)
+        return list()
+
+    def _fetch(self, count: int) -> list[int]:
+        response = shared_session().get(self.URL,
+                                        params={
+                                            'num': count,
+                                            'min': 0,
+                                            'max': self.RAW_RANGE - 1,
+                                            'col': 1,
+                                            'base': 10,
+                                            'format': 'plain',
+                                            'rnd': 'new'
+                                        },
+                                        timeout=self._timeout)
+        response.raise_for_status()
+        result = filter(lambda item: len(item) > 0, response.text.split('\n'))
+        result = map(lambda item: int(item), result)
+        return list(result)
+
+
+_shared_source: Optional[RandomOrgRandomSource] = None
+_shared_source_lock = Lock()
+
+
+def shared_random_org_source(fallback: RandomSource) -> RandomOrgRandomSource:
+    global _shared_source
+    with _shared_source_lock:
+        if _shared_source is None:
+            _shared_source = RandomOrgRandomSource(fallback)
+        return _shared_source
@@ -0,0 +1,11 @@
+from abc import ABC, abstractmethod
+
+
+class RandomSource(ABC):
+    # uniform integer from the inclusive range [min_value, max_value]
+    @abstractmethod
+    def randint(self, min_value: int, max_value: int) -> int:
+        ...
+
+    def randints(self, min_value: int, max_value: int, count: int) -> list[int]:
+        return [self.randint(min_value, max_value) for _ in range(count)]
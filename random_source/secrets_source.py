@@ -0,0 +1,8 @@
+from secrets import randbelow
+
+from .random_source import RandomSource
+
+
+class SecretsRandomSource(RandomSource):
+    def randint(self, min_value: int, max_value: int) -> int:
+        return min_value + randbelow(max_value - min_value + 1)
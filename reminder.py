@@ -1,90 +1,307 @@
+from concurrent.futures import Future
 from datetime import timedelta
-from threading import Thread
-from time import sleep
-from typing import Generator, Tuple, Callable
-
-from requests import get
-from telebot.types import Message
+from time import time
+from itertools import accumulate
+from typing import Tuple, Callable, Iterable, Iterator, Mapping, Optional
 
+from config.message_template import TemplateContext
 from config.reminder_config import ReminderConfig
+from config.schedule_store import ScheduleStore, ScheduleState
+from message_selection import MessageSelector, create_message_selector
+from random_source import RandomSource
+from schedule_plan import SchedulePlan
+from scheduler import Scheduler
+
+
+# one tick is delivered to every recipient, the send queue does the per chat throttling
+# the message is rendered for each chat with its own variables
+def deliver_message(config: ReminderConfig,
+                    recipients: list[int],
+                    message_index: int,
+                    fire_count: int,
+                    timestamp: float,
+                    send: Callable[..., Future],
+                    chat_variables: Callable[[int], Mapping[str, str]]) -> None:
+    template = config.template_at(message_index)
+    # messages without variables skip the context
+    context = TemplateContext(config.name, timestamp, message_index + 1, config.message_count, fire_count,
+                              dict()) if template.names else None
+    for chat_id in recipients:
+        if context is not None:
+            context.variables = chat_variables(chat_id)
+        send(template.render(context), chat_id=chat_id)
+        config.record_delivery(chat_id, message_index)
+
 
+class Reminder:
+    # upper bound of missed fires replayed by the 'fire_all' catch up policy
+    MAX_CATCH_UP_FIRES: int = 100
+    # seconds in one unit of wait_time_range, lowered by benchmarks to compress time
+    TIME_UNIT: float = 60
 
-class Reminder(Thread):
     _config: ReminderConfig
-    # function to send message. args: message, hide_text, keyboard_markup
-    _send_message_callback: Callable[[str], Message]
-    _wait_time_generator: Generator[int, None, None]
-    _message_index_generator: Generator[int, None, None]
+    # chat that owns the reminder, subscribers from the config receive the same messages
+    _chat_id: int
+    _scheduler: Scheduler
+    _random_source: RandomSource
+    # function to send message. args: message, hide_text, keyboard_markup, chat_id
+    _send_message_callback: Callable[..., Future]
+    _selector: MessageSelector
+    # fire times and messages drawn ahead in batches
+    _plan: SchedulePlan
+    _schedule_store: Optional[ScheduleStore]
+    # message drawn together with the next timeout, so it survives restarts with the schedule
+    _next_message_index: Optional[int]
+    _catch_up_fires_left: int
+    _catch_up_spacing: float
+    # paused reminders stay out of the scheduler until resumed, the pause is not kept across restarts
+    _paused: bool
+    # grows on pause and resume, part of the revision
+    _state_changes: int
+    # current unix time, a virtual clock in simulations
+    _clock: Callable[[], float]
+    # template variables of a chat by chat id
+    _chat_variables: Callable[[int], Mapping[str, str]]
+    # fires since start, the {count} of message templates
+    _fire_count: int
 
     def __init__(self,
                  config: ReminderConfig,
-                 send_message_callback: Callable[[str], Message]):
-        super().__init__()
+                 chat_id: int,
+                 send_message_callback: Callable[..., Future],
+                 scheduler: Scheduler,
+                 random_source: RandomSource,
+                 schedule_store: Optional[ScheduleStore] = None,
+                 clock: Callable[[], float] = time,
+                 chat_variables: Optional[Callable[[int], Mapping[str, str]]] = None):
         self._config = config
+        self._chat_id = chat_id
         self._send_message_callback = send_message_callback
+        self._scheduler = scheduler
+        self._random_source = random_source
+        self._schedule_store = schedule_store
+        self._next_message_index = None
+        self._catch_up_fires_left = 0
+        self._catch_up_spacing = 0
+        self._paused = False
+        self._state_changes = 0
+        self._clock = clock
+        self._chat_variables = chat_variables if chat_variables is not None else lambda chat_id: dict()
+        self._fire_count = 0
+        self._selector = create_message_selector(config, random_source)
+        self._plan = SchedulePlan(random_source, config.time_range, self._selector, self.TIME_UNIT)
 
-        # Using setters to init random generators
-        self.messages = config.messages
-        self.wait_time_range = config.time_range
+    def start(self) -> None:
+        self._scheduler.add(self)
 
-    def run(self) -> None:
-        while True:
-            self._await_for_timeout()
-            self._send_message()
+    def stop(self) -> None:
+        self._scheduler.remove(self)
 
-    def _send_message(self):
-        message_index = next(self._message_index_generator)
-        self._send_message_callback(self.messages[message_index])
+    # control, applied to the wait in progress
+
+    # the wait in progress is drawn again from its start, e.g. with a new time range
+    def reschedule(self) -> None:
+        self._scheduler.reschedule(self, self.__replan)
+
+    def pause(self) -> None:
+        if self._paused:
+            return
+        self._paused = True
+        self._state_changes += 1
+        self._scheduler.pause(self)
+        print(f'Reminder \'{self.name}\' paused')
+
+    # the message planned before the pause comes after a new wait counted from now
+    def resume(self) -> None:
+        if not self._paused:
+            return
+        self._paused = False
+        self._state_changes += 1
+        self._scheduler.resume(self, self.__replan_from_now)
+        print(f'Reminder \'{self.name}\' resumed')
+
+    # the planned message is sent right away and the next wait is counted from now
+    def trigger_now(self) -> None:
+        self._scheduler.trigger(self, lambda: self._plan.move_base(self._clock()))
+
+    # continues the schedule saved before a restart, applying the catch up policy to missed fires
+    def restore(self, state: Optional[ScheduleState], catch_up_policy: str, catch_up_spacing: float) -> None:
+        if state is None:
+            self.start()
+            return
+        if state.message_index is not None and state.message_index < self._config.message_count:
+            self._next_message_index = state.message_index
+
+        now = self._clock()
+        if state.due > now:
+            self._scheduler.add(self, state.due)
+        elif catch_up_policy == 'fire_once':
+            self._scheduler.add(self, now)
+        elif catch_up_policy == 'fire_all':
+            self._catch_up_fires_left = self.__count_missed_fires(state.due, now) - 1
+            self._catch_up_spacing = catch_up_spacing
+            print(f'{self.name}: replaying {self._catch_up_fires_left + 1} missed messages')
+            self._scheduler.add(self, now)
+        else:
+            self.start()
+
+    # scheduler callbacks
 
-    def _await_for_timeout(self) -> None:
-        interval = next(self._wait_time_generator) * 60
+    def next_timeout(self) -> float:
+        now = self._clock()
+        if self._catch_up_fires_left > 0:
+            self._catch_up_fires_left -= 1
+            interval = self._catch_up_spacing
+            self._next_message_index = self.__random_message_index()
+        else:
+            fire_time, self._next_message_index = self._plan.pop(now)
+            interval = fire_time - now
         next_send_message = f'{self.name}: next after {timedelta(seconds=interval)}'
         print(next_send_message)
-        sleep(interval)
-
-    def __random_generator(self, min_value: int, max_value: int, batch_size: int = 50) -> Generator[int, None, None]:
-        while True:
-            numbers = self.__get_randoms_batch(min_value, max_value, batch_size)
-            for number in numbers:
-                yield number
-
-    @staticmethod
-    def __zeros_generator() -> Generator[int, None, None]:
-        while True:
-            yield 0
-
-    @staticmethod
-    def __get_randoms_batch(min_number: int, max_number: int, numbers_count: int = 1) -> list:
-        response = get(f'https://www.random.org/integers/?'
-                       f'num={numbers_count}&'
-                       f'min={min_number}&'
-                       f'max={max_number}&'
-                       f'col=1&'
-                       f'base=10&'
-                       f'format=plain&'
-                       f'rnd=new')
-        result = filter(lambda item: len(item) > 0, response.text.split('\n'))
-        result = map(lambda item: int(item), result)
-        return list(result)
+        return interval
+
+    def fire(self) -> None:
+        self._send_message()
+        # a fire while paused comes from a trigger, the message it sent must not come again on resume
+        if self._paused:
+            self._plan.forget_last()
+
+    def on_scheduled(self, deadline: float) -> None:
+        if self._schedule_store is not None:
+            self._schedule_store.save((self._chat_id, self.name), ScheduleState(deadline, self._next_message_index))
+
+    def _send_message(self):
+        message_index = self._next_message_index
+        if message_index is None or message_index >= self._config.message_count:
+            message_index = self.__random_message_index()
+        self._next_message_index = None
+        self._fire_count += 1
+        self._deliver(message_index)
+
+    # shard workers hand the fire over to the coordinator instead
+    def _deliver(self, message_index: int) -> None:
+        deliver_message(self._config, self.recipients, message_index, self._fire_count, self._clock(),
+                        self._send_message_callback, self._chat_variables)
+
+    # upcoming fires until the given unix time as (fire time, message index) pairs
+    def schedule(self, until: float) -> list[tuple[float, int]]:
+        return self._plan.entries(self._clock(), until)
+
+    def __replan(self) -> float:
+        self._plan.rewind(self._clock())
+        return self.next_timeout()
+
+    def __replan_from_now(self) -> float:
+        now = self._clock()
+        self._plan.rewind(now, now)
+        return self.next_timeout()
+
+    def __random_message_index(self) -> int:
+        return self._selector.draw()
+
+    def __count_missed_fires(self, due: float, now: float) -> int:
+        waits = self._random_source.randints(*self._config.time_range, self.MAX_CATCH_UP_FIRES - 1)
+        fire_times = accumulate((wait * self.TIME_UNIT for wait in waits), initial=due)
+        return sum(1 for fire_time in fire_times if fire_time <= now)
+
+    # brings the selector and the planned schedule in line with config fields changed elsewhere, e.g. on reload
+    def config_changed(self, fields: set[str]) -> None:
+        # a list from the file may differ anywhere, not only at the end
+        if fields & {'_messages', '_selection', '_no_repeat_window', '_weights'}:
+            self._selector = create_message_selector(self._config, self._random_source)
+            self._plan.set_selector(self._selector)
+        if '_messages' in fields:
+            self._next_message_index = None
+        if '_time_range' in fields:
+            self._plan.set_time_range(self._config.time_range)
+            self.reschedule()
+        print(f'Reminder \'{self.name}\' updated from config: {", ".join(sorted(fields))}')
 
     @property
     def name(self) -> str:
         return self._config.name
 
+    # changes whenever the reminder config changes or the reminder is paused or resumed
+    @property
+    def revision(self) -> int:
+        return self._config.revision + self._state_changes
+
+    @property
+    def paused(self) -> bool:
+        return self._paused
+
+    @property
+    def chat_id(self) -> int:
+        return self._chat_id
+
+    @property
+    def recipients(self) -> list[int]:
+        return [self._chat_id] + [chat_id for chat_id in self._config.subscribers if chat_id != self._chat_id]
+
     @property
     def messages(self) -> list[str]:
         return self._config.messages
 
+    def message_at(self, index: int) -> str:
+        return self._config.message_at(index)
+
     @messages.setter
     def messages(self, new_messages: list[str]) -> None:
         if not self._config.messages == new_messages:
             self._config.messages = new_messages
+            self.__messages_changed(False)
+        print(f'Reminder \'{self.name}\' messages updated: {new_messages}')
+
+    @property
+    def message_count(self) -> int:
+        return self._config.message_count
 
-        if len(new_messages) > 1:
-            self._message_index_generator = self.__random_generator(0, len(new_messages) - 1)
+    def iter_messages(self) -> Iterator[str]:
+        return self._config.iter_messages()
+
+    # bulk edits of the message list, e.g. from an uploaded document; each returns how many messages it affected
+    # remove_messages raises ValueError instead of leaving the list empty
+
+    def append_messages(self, messages: Iterable[str]) -> int:
+        return self.__messages_edited(self._config.append_messages(messages), 'added', True)
+
+    def remove_messages(self, messages: Iterable[str]) -> int:
+        return self.__messages_edited(self._config.remove_messages(messages), 'removed', False)
+
+    def deduplicate_messages(self) -> int:
+        return self.__messages_edited(self._config.deduplicate_messages(), 'duplicate messages removed', False)
+
+    def __messages_edited(self, count: int, action: str, appended: bool) -> int:
+        if count:
+            self.__messages_changed(appended)
+            print(f'Reminder \'{self.name}\': {count} {action}, {self._config.message_count} messages in the list')
+        return count
+
+    # removals and replacements shift the indices the selector remembers, so it starts over
+    def __messages_changed(self, appended: bool) -> None:
+        if appended:
+            self._selector.resize(self._config.message_count)
         else:
-            self._message_index_generator = self.__zeros_generator()
-        print(f'Reminder \'{self.name}\' messages updated: {new_messages}')
+            self._selector = create_message_selector(self._config, self._random_source)
+        self._plan.set_selector(self._selector)
+        self._next_message_index = None
+
+    @property
+    def selection(self) -> str:
+        return self._config.selection
+
+    # switching the strategy starts it from scratch
+    @selection.setter
+    def selection(self, new_selection: str) -> None:
+        if not self._config.selection == new_selection:
+            self._config.selection = new_selection
+        self._selector = create_message_selector(self._config, self._random_source)
+        self._plan.set_selector(self._selector)
+        print(f'Reminder \'{self.name}\' message selection updated: {new_selection}')
+
+    @property
+    def no_repeat_window(self) -> int:
+        return self._config.no_repeat_window
 
     @property
     def wait_time_range(self) -> Tuple[int, int]:
@@ -95,5 +312,6 @@ class Reminder(Thread):
         if not self._config.time_range == new_range:
             self._config.time_range = new_range
 
-        self._wait_time_generator = self.__random_generator(*new_range)
+        self._plan.set_time_range(self._config.time_range)
+        self.reschedule()
         print(f'Reminder \'{self.name}\' time range updated: {new_range}')
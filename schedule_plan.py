@@ -0,0 +1,153 @@
+from array import array
+from itertools import accumulate
+from threading import Lock
+from typing import Optional
+
+from message_selection import MessageSelector
+from random_source import RandomSource
+
+
+class SchedulePlan:
+    # entries are generated in batches of this size
+    BATCH_SIZE: int = 64
+
+    __slots__ = ('_random_source', '_time_range', '_selector', '_time_unit', '_fire_times', '_message_indices',
+                 '_position', '_base', '_wait_start', '_last_index', '_lock')
+
+    def __init__(self, random_source: RandomSource, time_range: tuple[int, int], selector: MessageSelector,
+                 time_unit: float):
+        self._random_source = random_source
+        self._time_range = time_range
+        self._selector = selector
+        self._time_unit = time_unit
+        # pending entries start at _position, fire times are unix timestamps
+        self._fire_times = array('d')
+        self._message_indices = array('I')
+        self._position = 0
+        # fire time the next entry is counted from, set on the first pop
+        self._base: Optional[float] = None
+        # when the wait for the last popped entry began and its message, kept so the wait can be planned again
+        self._wait_start: Optional[float] = None
+        self._last_index: Optional[int] = None
+        # the scheduler pops entries while the menu reads and redraws them
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._fire_times) - self._position
+
+    def pop(self, now: float) -> tuple[float, int]:
+        with self._lock:
+            return self.__pop(now)
+
+    # the wait in progress and pending entries up to the given time, the plan is extended as far as needed
+    def entries(self, now: float, until: float) -> list[tuple[float, int]]:
+        with self._lock:
+            return self.__entries(now, until)
+
+    # pending fire times are drawn again, message indices stay
+    def set_time_range(self, time_range: tuple[int, int]) -> None:
+        with self._lock:
+            self._time_range = time_range
+            pending = len(self)
+            if pending and self._base is not None:
+                self._fire_times[self._position:] = self.__fire_times(self._base, pending)
+
+    # pending message indices are drawn again from the new or resized selector, fire times stay
+    def set_selector(self, selector: MessageSelector) -> None:
+        with self._lock:
+            self._selector = selector
+            pending = len(self)
+            if pending:
+                self._message_indices[self._position:] = self.__message_indices(pending)
+
+    # the last popped entry is put back with its message, its fire time and the pending ones are drawn again
+    # counted from the start of its wait or from the given start, so new settings apply to the wait in progress
+    def rewind(self, now: float, start: Optional[float] = None) -> None:
+        with self._lock:
+            if self._last_index is None:
+                # the entry was already sent, e.g. by a trigger while paused: only the pending waits move
+                if start is not None and self._base is not None:
+                    self.__shift(start - self._base)
+                    self._base = start
+                return
+            self._fire_times.insert(self._position, 0.0)
+            self._message_indices.insert(self._position, self._last_index)
+            self._last_index = None
+            self._base = start if start is not None else self._wait_start
+            self._fire_times[self._position:] = self.__fire_times(self._base, len(self))
+            # a wait that is already over with the new settings ends right away
+            if self._fire_times[self._position] < now:
+                self.__shift(now - self._fire_times[self._position])
+                self._base = now
+
+    # pending waits are counted from the given time, e.g. when the entry in progress fired early
+    def move_base(self, start: float) -> None:
+        with self._lock:
+            if self._base is not None:
+                self.__shift(start - self._base)
+                self._base = start
+
+    # the last popped entry was sent outside of its wait, so there is nothing left to rewind
+    def forget_last(self) -> None:
+        with self._lock:
+            self._last_index = None
+
+    def __pop(self, now: float) -> tuple[float, int]:
+        if self._base is None:
+            self._base = now
+        if not len(self):
+            self.__extend(self.BATCH_SIZE)
+        fire_time = self._fire_times[self._position]
+        if fire_time < now:
+            # the plan fell behind, e.g. after replaying missed fires: it is moved forward as a whole
+            self.__shift(now - self._base)
+            fire_time = self._fire_times[self._position]
+        message_index = self._message_indices[self._position]
+        self._position += 1
+        self._base = fire_time
+        self._wait_start = now
+        self._last_index = message_index
+        if self._position >= self.BATCH_SIZE:
+            del self._fire_times[:self._position]
+            del self._message_indices[:self._position]
+            self._position = 0
+        return fire_time, message_index
+
+    def __entries(self, now: float, until: float) -> list[tuple[float, int]]:
+        if self._base is None:
+            self._base = now
+        while not len(self) or self._fire_times[-1] < until:
+            self.__extend(max(self.BATCH_SIZE, self.__expected_count(until - self.__last_fire_time())))
+        end = self._position
+        while end < len(self._fire_times) and self._fire_times[end] <= until:
+            end += 1
+        entries = list(zip(self._fire_times[self._position:end], self._message_indices[self._position:end]))
+        # the wait in progress comes first
+        if self._last_index is not None and now <= self._base <= until:
+            entries.insert(0, (self._base, self._last_index))
+        return entries
+
+    def __extend(self, count: int) -> None:
+        self._fire_times.extend(self.__fire_times(self.__last_fire_time(), count))
+        self._message_indices.extend(self.__message_indices(count))
+
+    # one batch draw and a running sum instead of a draw per fire
+    def __fire_times(self, start: float, count: int) -> array:
+        waits = self._random_source.randints(self._time_range[0], self._time_range[1], count)
+        fire_times = array('d', accumulate((wait * self._time_unit for wait in waits), initial=start))
+        del fire_times[0]
+        return fire_times
+
+    def __message_indices(self, count: int) -> array:
+        return array('I', self._selector.draws(count))
+
+    def __last_fire_time(self) -> float:
+        return self._fire_times[-1] if len(self) else self._base
+
+    def __expected_count(self, seconds: float) -> int:
+        average_wait = (self._time_range[0] + self._time_range[1]) / 2 * self._time_unit
+        return int(seconds / average_wait) + 1
+
+    def __shift(self, seconds: float) -> None:
+        pending = self._fire_times[self._position:]
+        self._fire_times[self._position:] = array('d', (fire_time + seconds for fire_time in pending))
@@ -0,0 +1,245 @@
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from heapq import heappop, heappush
+from itertools import count
+from threading import Thread
+from time import monotonic, time
+from typing import Callable, Optional, Protocol
+from weakref import WeakSet
+
+from metrics import metrics
+
+
+class ScheduledJob(Protocol):
+    @property
+    def name(self) -> str:
+        ...
+
+    # seconds until the job should fire next time
+    def next_timeout(self) -> float:
+        ...
+
+    def fire(self) -> None:
+        ...
+
+    # called from the event loop with the unix time the job is planned for
+    def on_scheduled(self, deadline: float) -> None:
+        ...
+
+
+class Scheduler(Thread):
+    # delay before retrying a job whose next timeout could not be computed
+    RETRY_DELAY: float = 60
+
+    _loop: asyncio.AbstractEventLoop
+    _executor: ThreadPoolExecutor
+    # single timer armed for the earliest deadline in the heap
+    _timer: Optional[asyncio.TimerHandle]
+    _timer_deadline: Optional[float]
+    # min-heap of (deadline, token, job); entries whose token is outdated are skipped
+    _heap: list[tuple[float, int, ScheduledJob]]
+    _tokens: dict[ScheduledJob, int]
+    _sequence: count
+    # removed jobs are never scheduled again, even when they are running at the moment of removal
+    _removed: WeakSet
+    # paused jobs are not scheduled until resumed
+    _paused: WeakSet
+    # fires in progress, waited for on shutdown
+    _firing: set[Future]
+    _stopping: bool
+
+    def __init__(self, max_workers: int = 8):
+        super().__init__(name='scheduler')
+        self._loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scheduler-worker')
+        self._timer = None
+        self._timer_deadline = None
+        self._heap = list()
+        self._tokens = dict()
+        self._sequence = count()
+        self._removed = WeakSet()
+        self._paused = WeakSet()
+        self._firing = set()
+        self._stopping = False
+        metrics.register_gauge('scheduler_jobs', lambda: self.size)
+
+    def run(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    # thread-safe api
+
+    # without a deadline the first timeout is asked from the job
+    def add(self, job: ScheduledJob, deadline: Optional[float] = None) -> None:
+        if deadline is None:
+            self._executor.submit(self._start, job)
+        else:
+            self._loop.call_soon_threadsafe(self._schedule_at, job, deadline)
+
+    def add_many(self, jobs: list[ScheduledJob]) -> None:
+        for job in jobs:
+            self.add(job)
+
+    def remove(self, job: ScheduledJob) -> None:
+        self._loop.call_soon_threadsafe(self._remove, job)
+
+    # the deadline of a waiting job is replaced by the timeout replan returns, e.g. after its settings changed
+    # a job that is firing right now is left alone: its next timeout is computed after the fire anyway
+    def reschedule(self, job: ScheduledJob, replan: Callable[[], float]) -> None:
+        self._loop.call_soon_threadsafe(self._reschedule, job, replan)
+
+    def pause(self, job: ScheduledJob) -> None:
+        self._loop.call_soon_threadsafe(self._pause, job)
+
+    # the first timeout after the pause comes from replan
+    def resume(self, job: ScheduledJob, replan: Callable[[], float]) -> None:
+        self._loop.call_soon_threadsafe(self._resume, job, replan)
+
+    # a waiting job fires right away, a paused one fires once and stays paused
+    # a job that is firing at the moment is left alone, prepare is called only when the trigger takes effect
+    def trigger(self, job: ScheduledJob, prepare: Callable[[], None]) -> None:
+        self._loop.call_soon_threadsafe(self._trigger, job, prepare)
+
+    # no job is fired any more, fires in progress get up to timeout seconds to finish
+    # returns False when some of them did not finish in time
+    def shutdown(self, timeout: float) -> bool:
+        deadline = monotonic() + timeout
+        stopped: Future = Future()
+        self._loop.call_soon_threadsafe(self._halt, stopped)
+        try:
+            stopped.result(timeout)
+        except TimeoutError:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            return False
+        _, not_done = wait(list(self._firing), max(0.0, deadline - monotonic()))
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        return not not_done
+
+    @property
+    def size(self) -> int:
+        return len(self._tokens)
+
+    # event loop side
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._timer_deadline = None
+        now = time()
+        while self._heap:
+            deadline, token, job = self._heap[0]
+            if self._tokens.get(job) != token:
+                heappop(self._heap)
+                continue
+            if deadline > now:
+                break
+            heappop(self._heap)
+            del self._tokens[job]
+            # how late the job fires compared to its planned time
+            metrics.observe('scheduler_lag_seconds', now - deadline)
+            self.__submit_fire(self._run_job, job)
+        self._arm()
+
+    def _arm(self) -> None:
+        while self._heap and self._tokens.get(self._heap[0][2]) != self._heap[0][1]:
+            heappop(self._heap)
+        if not self._heap:
+            return
+        deadline = self._heap[0][0]
+        if self._timer_deadline is not None and self._timer_deadline <= deadline:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer_deadline = deadline
+        self._timer = self._loop.call_later(max(0.0, deadline - time()), self._on_timer)
+
+    def _schedule(self, job: ScheduledJob, delay: float) -> None:
+        self._schedule_at(job, time() + delay)
+
+    def _schedule_at(self, job: ScheduledJob, deadline: float) -> None:
+        if self._stopping or job in self._removed or job in self._paused:
+            return
+        token = next(self._sequence)
+        self._tokens[job] = token
+        heappush(self._heap, (deadline, token, job))
+        job.on_scheduled(deadline)
+        if self._timer_deadline is None or deadline < self._timer_deadline:
+            self._arm()
+
+    # the heap entry is left behind and skipped as outdated
+    def _remove(self, job: ScheduledJob) -> None:
+        self._removed.add(job)
+        self._tokens.pop(job, None)
+
+    def _reschedule(self, job: ScheduledJob, replan: Callable[[], float]) -> None:
+        if self._tokens.pop(job, None) is not None:
+            self._executor.submit(self._replan, job, replan)
+
+    def _pause(self, job: ScheduledJob) -> None:
+        self._paused.add(job)
+        self._tokens.pop(job, None)
+
+    def _resume(self, job: ScheduledJob, replan: Callable[[], float]) -> None:
+        if job in self._paused and not self._stopping:
+            self._paused.discard(job)
+            self._executor.submit(self._replan, job, replan)
+
+    def _trigger(self, job: ScheduledJob, prepare: Callable[[], None]) -> None:
+        if self._stopping or not (job in self._paused or job in self._tokens):
+            return
+        try:
+            prepare()
+        except Exception as error:
+            print(f'{job.name}: failed to prepare the trigger: {error!r}')
+        if job in self._paused:
+            self.__submit_fire(self._fire, job)
+        else:
+            self._schedule_at(job, time())
+
+    def _halt(self, stopped: Future) -> None:
+        self._stopping = True
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = None
+        self._timer_deadline = None
+        self._heap.clear()
+        self._tokens.clear()
+        stopped.set_result(None)
+
+    def __submit_fire(self, fire: Callable[[ScheduledJob], None], job: ScheduledJob) -> None:
+        future = self._executor.submit(fire, job)
+        self._firing.add(future)
+        future.add_done_callback(self._firing.discard)
+
+    # executor side
+
+    def _start(self, job: ScheduledJob) -> None:
+        delay = Scheduler._compute_timeout(job)
+        self._loop.call_soon_threadsafe(self._schedule, job, delay)
+
+    def _run_job(self, job: ScheduledJob) -> None:
+        self._fire(job)
+        self._start(job)
+
+    def _replan(self, job: ScheduledJob, replan: Callable[[], float]) -> None:
+        try:
+            delay = replan()
+        except Exception as error:
+            print(f'{job.name}: failed to plan the next timeout again: {error!r}')
+            delay = Scheduler._compute_timeout(job)
+        self._loop.call_soon_threadsafe(self._schedule, job, delay)
+
+    @staticmethod
+    def _fire(job: ScheduledJob) -> None:
+        try:
+            job.fire()
+        except Exception as error:
+            print(f'{job.name}: failed to send message: {error!r}')
+
+    @staticmethod
+    def _compute_timeout(job: ScheduledJob) -> float:
+        try:
+            return job.next_timeout()
+        except Exception as error:
+            print(f'{job.name}: failed to get next timeout: {error!r}')
+            return Scheduler.RETRY_DELAY
@@ -0,0 +1,4 @@
+from .hash_ring import HashRing
+from .coordinator import ShardCoordinator
+from .remote_reminder import RemoteReminder
+from .shard_worker import ShardWorker
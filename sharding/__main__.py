@@ -0,0 +1,22 @@
+import argparse
+import os
+
+from .shard_worker import ShardWorker
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Shard worker running the reminders a coordinator assigns to it')
+    parser.add_argument('--connect', required=True, help='coordinator address as host:port')
+    parser.add_argument('--name', default=f'{os.uname().nodename}-{os.getpid()}',
+                        help='worker name, a worker reconnecting under the same name gets its reminders back')
+    args = parser.parse_args()
+    # the key is passed in the environment to keep it out of the process list
+    authkey = os.environ.get('SHARD_AUTHKEY')
+    if not authkey:
+        parser.error('SHARD_AUTHKEY is not set')
+    host, port = args.connect.rsplit(':', 1)
+    ShardWorker((host, int(port)), authkey.encode(), args.name).run()
+
+
+if __name__ == '__main__':
+    main()
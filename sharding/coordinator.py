@@ -0,0 +1,332 @@
+import os
+import secrets
+import sys
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from itertools import count
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Connection, Listener
+from subprocess import Popen, TimeoutExpired
+from threading import Condition, Lock, RLock, Thread, current_thread
+from time import monotonic, sleep
+from typing import TYPE_CHECKING, Callable, Iterable, Optional
+
+from config import Config
+from config.schedule_store import ScheduleKey, ScheduleState
+from reminder import Reminder, deliver_message
+from .hash_ring import HashRing
+from .protocol import (ASSIGN, CONFIGURE, ENTRIES, HELLO, RELEASE, RELEASED, SCHEDULED, SEND, STOP, UPDATE,
+                       shard_fields)
+
+if TYPE_CHECKING:
+    from .remote_reminder import RemoteReminder
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class _Worker:
+    __slots__ = ('name', 'connection', 'send_lock', 'reader')
+
+    def __init__(self, name: str, connection: Connection, reader: Thread):
+        self.name = name
+        self.connection = connection
+        self.send_lock = Lock()
+        self.reader = reader
+
+
+# spreads the reminders over worker processes with a consistent hash ring and keeps everything that must stay
+# global: the config, the saved schedule and the send queue with its rate limits
+class ShardCoordinator:
+    # seconds to wait for the local workers before the first assignment, so they do not move right after it
+    STARTUP_TIMEOUT: float = 10
+    # seconds between checks of the local worker processes
+    MONITOR_INTERVAL: float = 5
+    # seconds the menu waits for a schedule preview
+    REQUEST_TIMEOUT: float = 2
+
+    _config: Config
+    _send: Callable[..., Future]
+    _listener: Listener
+    _authkey: str
+    _lock: RLock
+    _joined: Condition
+    _ring: HashRing
+    _workers: dict[str, _Worker]
+    _reminders: dict[ScheduleKey, 'RemoteReminder']
+    # worker running each reminder, reminders missing here wait for a worker
+    _assigned: dict[ScheduleKey, str]
+    # reminders released by their worker and not yet assigned to the new one
+    _moving: set[ScheduleKey]
+    # last schedule reported for each reminder, a dead worker's reminders continue from it
+    _states: dict[ScheduleKey, ScheduleState]
+    _requests: dict[int, Future]
+    _request_ids: count
+    _processes: list[Popen]
+    _stopping: bool
+
+    def __init__(self, config: Config, send: Callable[..., Future]):
+        self._config = config
+        self._send = send
+        # without a configured key only the local workers can join
+        self._authkey = config.shard_authkey or secrets.token_hex(16)
+        host, port = (config.shard_address or '127.0.0.1:0').rsplit(':', 1)
+        self._listener = Listener((host, int(port)), authkey=self._authkey.encode())
+        self._lock = RLock()
+        self._joined = Condition(self._lock)
+        self._ring = HashRing()
+        self._workers = dict()
+        self._reminders = dict()
+        self._assigned = dict()
+        self._moving = set()
+        self._states = dict()
+        self._requests = dict()
+        self._request_ids = count()
+        self._processes = list()
+        self._stopping = False
+
+    @property
+    def address(self) -> str:
+        host, port = self._listener.address
+        return f'{host}:{port}'
+
+    def start(self) -> None:
+        Thread(target=self.__accept, name='ShardAcceptThread', daemon=True).start()
+        print(f'Shard coordinator listening on {self.address}')
+        for index in range(self._config.shard_workers):
+            self._processes.append(self.__spawn(index))
+        if self._processes:
+            Thread(target=self.__monitor, name='ShardMonitorThread', daemon=True).start()
+            with self._joined:
+                self._joined.wait_for(lambda: len(self._workers) >= len(self._processes), self.STARTUP_TIMEOUT)
+
+    # called by the reminder proxies
+
+    def add(self, reminder: 'RemoteReminder', state: Optional[ScheduleState]) -> None:
+        with self._lock:
+            self._reminders[reminder.key] = reminder
+            if state is not None:
+                self._states[reminder.key] = state
+            self.__place(reminder.key, self._config.catch_up_policy)
+
+    def remove(self, key: ScheduleKey) -> None:
+        with self._lock:
+            self._reminders.pop(key, None)
+            self._states.pop(key, None)
+            self._moving.discard(key)
+            worker = self._assigned.pop(key, None)
+            if worker is not None:
+                self.__send_to(worker, RELEASE, key)
+
+    def update(self, key: ScheduleKey, fields: Iterable[str]) -> None:
+        with self._lock:
+            reminder = self._reminders.get(key)
+            if reminder is not None:
+                self.__forward(key, UPDATE, key, shard_fields(reminder.config, fields))
+
+    # pause, resume and trigger; a reminder on its way to another worker gets the pause with the assignment
+    def control(self, key: ScheduleKey, kind: str) -> None:
+        with self._lock:
+            self.__forward(key, kind, key)
+
+    def entries(self, key: ScheduleKey, until: float) -> list[tuple[float, int]]:
+        future: Future = Future()
+        with self._lock:
+            request_id = next(self._request_ids)
+            self._requests[request_id] = future
+            if not self.__forward(key, ENTRIES, request_id, key, until):
+                self._requests.pop(request_id, None)
+                return list()
+        try:
+            return future.result(self.REQUEST_TIMEOUT)
+        except FutureTimeoutError:
+            with self._lock:
+                self._requests.pop(request_id, None)
+            return list()
+
+    # the workers send what is due within the timeout, then the send queue can be drained
+    def shutdown(self, timeout: float) -> bool:
+        deadline = monotonic() + timeout
+        with self._lock:
+            self._stopping = True
+            workers = list(self._workers.values())
+            for worker in workers:
+                self.__send_to(worker.name, STOP, timeout)
+        for worker in workers:
+            worker.reader.join(max(0.0, deadline - monotonic()))
+        self._listener.close()
+        for process in self._processes:
+            try:
+                process.wait(max(0.0, deadline - monotonic()))
+            except TimeoutExpired:
+                process.terminate()
+        return not any(worker.reader.is_alive() for worker in workers)
+
+    # placement, the lock is held
+
+    def __shard_key(self, key: ScheduleKey) -> str:
+        chat_id, name = key
+        return str(chat_id) if self._config.shard_key == 'chat' else f'{chat_id}:{name}'
+
+    def __place(self, key: ScheduleKey, catch_up_policy: str) -> None:
+        owner = self._ring.owner(self.__shard_key(key))
+        current = self._assigned.get(key)
+        if owner == current or key in self._moving:
+            return
+        if current is not None:
+            # the reminder continues on the new worker from the state the old one reports back
+            self._moving.add(key)
+            self.__send_to(current, RELEASE, key)
+        elif owner is not None:
+            reminder = self._reminders[key]
+            state = self._states.get(key)
+            self._assigned[key] = owner
+            self.__send_to(owner, ASSIGN, key, shard_fields(reminder.config),
+                           (state.due, state.message_index) if state is not None else None,
+                           catch_up_policy, reminder.paused)
+
+    def __rebalance(self) -> None:
+        for key in list(self._reminders):
+            self.__place(key, self._config.catch_up_policy)
+
+    def __forward(self, key: ScheduleKey, kind: str, *arguments) -> bool:
+        worker = self._assigned.get(key)
+        if worker is None or key in self._moving:
+            return False
+        self.__send_to(worker, kind, *arguments)
+        return True
+
+    # a failed send is noticed by the worker's reader thread, which reassigns its reminders
+    def __send_to(self, name: str, kind: str, *arguments) -> None:
+        worker = self._workers.get(name)
+        if worker is None:
+            return
+        with worker.send_lock:
+            try:
+                worker.connection.send((kind, *arguments))
+            except (OSError, ValueError) as error:
+                print(f'Failed to send {kind} to shard {name}: {error!r}')
+
+    # connections
+
+    def __accept(self) -> None:
+        while True:
+            try:
+                connection = self._listener.accept()
+            except AuthenticationError:
+                print('Shard connection with a wrong key rejected')
+                continue
+            except OSError:
+                # the listener is closed on shutdown
+                return
+            Thread(target=self.__read, args=(connection,), name='ShardReaderThread', daemon=True).start()
+
+    def __read(self, connection: Connection) -> None:
+        try:
+            kind, name = connection.recv()
+        except (EOFError, OSError, ValueError):
+            connection.close()
+            return
+        if kind != HELLO:
+            connection.close()
+            return
+        worker = self.__join(name, connection)
+        try:
+            while True:
+                kind, *arguments = connection.recv()
+                self.__handle(name, kind, arguments)
+        # TypeError comes from a connection closed by a reconnect of the same worker
+        except (EOFError, OSError, TypeError):
+            pass
+        finally:
+            connection.close()
+            self.__leave(worker)
+
+    def __join(self, name: str, connection: Connection) -> _Worker:
+        with self._joined:
+            previous = self._workers.get(name)
+            if previous is not None:
+                # a worker reconnecting under the same name replaces its old connection and starts empty,
+                # so everything it ran is assigned again from the last reported states
+                previous.connection.close()
+                self.__unassign(name)
+            worker = _Worker(name, connection, current_thread())
+            self._workers[name] = worker
+            self.__send_to(name, CONFIGURE, {
+                'random_source': self._config.random_source,
+                'catch_up_spacing': self._config.catch_up_spacing,
+                'time_unit': Reminder.TIME_UNIT
+            })
+            if previous is None:
+                self._ring.add(name)
+                print(f'Shard {name} joined, {len(self._ring)} running')
+            self.__rebalance()
+            self._joined.notify_all()
+        return worker
+
+    def __leave(self, worker: _Worker) -> None:
+        with self._lock:
+            if self._workers.get(worker.name) is not worker:
+                return
+            del self._workers[worker.name]
+            if self._stopping:
+                return
+            self._ring.remove(worker.name)
+            print(f'Shard {worker.name} left, {len(self._ring)} running')
+            self.__unassign(worker.name)
+            self.__rebalance()
+
+    def __unassign(self, name: str) -> None:
+        for key in [key for key, assigned in self._assigned.items() if assigned == name]:
+            del self._assigned[key]
+            self._moving.discard(key)
+
+    def __handle(self, name: str, kind: str, arguments: list) -> None:
+        if kind == SEND:
+            key, message_index, fire_count, timestamp = arguments
+            reminder = self._reminders.get(key)
+            # the list may have been shortened after the worker picked the message
+            if reminder is not None and message_index < reminder.message_count:
+                deliver_message(reminder.config, reminder.recipients, message_index, fire_count, timestamp,
+                                self._send, self._config.chat_variables)
+            return
+        with self._lock:
+            if kind == SCHEDULED:
+                key, due, message_index = arguments
+                # late reports of a worker the reminder was taken from are ignored
+                if self._assigned.get(key) == name and key in self._reminders:
+                    state = ScheduleState(due, message_index)
+                    self._states[key] = state
+                    self._config.schedule_store.save(key, state)
+            elif kind == RELEASED:
+                key, due, message_index = arguments
+                if due is not None:
+                    self._states[key] = ScheduleState(due, message_index)
+                if self._assigned.get(key) == name:
+                    del self._assigned[key]
+                self._moving.discard(key)
+                # a due already passed is being fired by the old worker right now
+                if key in self._reminders and not self._stopping:
+                    self.__place(key, 'skip')
+            elif kind == ENTRIES:
+                request_id, entries = arguments
+                future = self._requests.pop(request_id, None)
+                if future is not None:
+                    future.set_result(entries)
+
+    # local workers
+
+    def __spawn(self, index: int) -> Popen:
+        environment = dict(os.environ, SHARD_AUTHKEY=self._authkey)
+        environment['PYTHONPATH'] = os.pathsep.join(filter(None, (_PROJECT_ROOT, environment.get('PYTHONPATH'))))
+        return Popen([sys.executable, '-m', 'sharding', '--connect', self.address, '--name', f'local-{index}'],
+                     env=environment, cwd=_PROJECT_ROOT)
+
+    def __monitor(self) -> None:
+        while True:
+            sleep(self.MONITOR_INTERVAL)
+            with self._lock:
+                if self._stopping:
+                    return
+                for index, process in enumerate(self._processes):
+                    if process.poll() is not None:
+                        print(f'Shard local-{index} exited with code {process.returncode}, restarting')
+                        self._processes[index] = self.__spawn(index)
@@ -0,0 +1,53 @@
+import hashlib
+from bisect import bisect, insort
+from typing import Optional
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+# consistent hashing: a node joining or leaving moves only the keys next to its points on the ring
+class HashRing:
+    # points per node, more points spread the keys more evenly
+    VIRTUAL_NODES: int = 64
+
+    _points: list[int]
+    _owners: dict[int, str]
+    _nodes: set[str]
+
+    def __init__(self):
+        self._points = list()
+        self._owners = dict()
+        self._nodes = set()
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    @property
+    def nodes(self) -> set[str]:
+        return set(self._nodes)
+
+    def add(self, node: str) -> None:
+        if node in self._nodes:
+            return
+        self._nodes.add(node)
+        for replica in range(self.VIRTUAL_NODES):
+            point = _hash(f'{node}#{replica}')
+            # a collision keeps the earlier owner, the point is shared anyway
+            if point not in self._owners:
+                self._owners[point] = node
+                insort(self._points, point)
+
+    def remove(self, node: str) -> None:
+        if node not in self._nodes:
+            return
+        self._nodes.discard(node)
+        self._points = [point for point in self._points if self._owners[point] != node]
+        self._owners = {point: owner for point, owner in self._owners.items() if owner != node}
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._points:
+            return None
+        index = bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[self._points[index]]
@@ -0,0 +1,35 @@
+from typing import Any, Iterable
+
+from config import ReminderConfig
+from config.config_changes import REMINDER_FIELDS
+
+# messages are tuples sent over multiprocessing.connection, the kind comes first
+# reminders are identified by their schedule key (owner chat id, profile name)
+
+# coordinator -> worker
+CONFIGURE = 'configure'   # settings: random_source, catch_up_spacing, time_unit
+ASSIGN = 'assign'         # key, shard fields, state as (due, message_index) or None, catch up policy, paused
+UPDATE = 'update'         # key, changed shard fields
+RELEASE = 'release'       # key, the worker answers with RELEASED
+PAUSE = 'pause'           # key
+RESUME = 'resume'         # key
+TRIGGER = 'trigger'       # key
+ENTRIES = 'entries'       # request id, key, until; the answer carries the request id and the entries
+STOP = 'stop'             # timeout
+
+# worker -> coordinator
+HELLO = 'hello'           # worker name
+SEND = 'send'             # key, message index, fire count, unix time of the fire
+SCHEDULED = 'scheduled'   # key, due, message index
+RELEASED = 'released'     # key, due, message index; due is None when the reminder was never scheduled
+
+
+# workers only pick the messages, the texts stay with the coordinator which renders and sends them,
+# so instead of the list a worker gets its size
+def _shard_field(field: str) -> str:
+    return '_message_count' if field == '_messages' else field
+
+
+def shard_fields(config: ReminderConfig, fields: Iterable[str] = REMINDER_FIELDS) -> dict[str, Any]:
+    return {_shard_field(field): getattr(config, _shard_field(field).lstrip('_')) for field in fields}
+
@@ -0,0 +1,149 @@
+from typing import Iterable, Iterator, Optional, Tuple
+
+from config.reminder_config import ReminderConfig
+from config.schedule_store import ScheduleKey, ScheduleState
+from .coordinator import ShardCoordinator
+from .protocol import PAUSE, RESUME, TRIGGER
+
+
+# stands in for a Reminder run by a shard worker: the config stays here and changes are forwarded to the worker
+class RemoteReminder:
+    _config: ReminderConfig
+    _chat_id: int
+    _coordinator: ShardCoordinator
+    _paused: bool
+    # grows on pause and resume, part of the revision
+    _state_changes: int
+
+    def __init__(self, config: ReminderConfig, chat_id: int, coordinator: ShardCoordinator):
+        self._config = config
+        self._chat_id = chat_id
+        self._coordinator = coordinator
+        self._paused = False
+        self._state_changes = 0
+
+    def start(self) -> None:
+        self._coordinator.add(self, None)
+
+    def stop(self) -> None:
+        self._coordinator.remove(self.key)
+
+    # the coordinator applies the configured catch up policy to every assignment, including this first one
+    def restore(self, state: Optional[ScheduleState], catch_up_policy: str, catch_up_spacing: float) -> None:
+        self._coordinator.add(self, state)
+
+    def pause(self) -> None:
+        if self._paused:
+            return
+        self._paused = True
+        self._state_changes += 1
+        self._coordinator.control(self.key, PAUSE)
+        print(f'Reminder \'{self.name}\' paused')
+
+    def resume(self) -> None:
+        if not self._paused:
+            return
+        self._paused = False
+        self._state_changes += 1
+        self._coordinator.control(self.key, RESUME)
+        print(f'Reminder \'{self.name}\' resumed')
+
+    def trigger_now(self) -> None:
+        self._coordinator.control(self.key, TRIGGER)
+
+    # an empty preview while the reminder moves between workers or its worker does not answer
+    def schedule(self, until: float) -> list[tuple[float, int]]:
+        return self._coordinator.entries(self.key, until)
+
+    def config_changed(self, fields: set[str]) -> None:
+        self._coordinator.update(self.key, fields)
+
+    @property
+    def key(self) -> ScheduleKey:
+        return self._chat_id, self._config.name
+
+    @property
+    def config(self) -> ReminderConfig:
+        return self._config
+
+    @property
+    def name(self) -> str:
+        return self._config.name
+
+    @property
+    def revision(self) -> int:
+        return self._config.revision + self._state_changes
+
+    @property
+    def paused(self) -> bool:
+        return self._paused
+
+    @property
+    def chat_id(self) -> int:
+        return self._chat_id
+
+    @property
+    def recipients(self) -> list[int]:
+        return [self._chat_id] + [chat_id for chat_id in self._config.subscribers if chat_id != self._chat_id]
+
+    @property
+    def messages(self) -> list[str]:
+        return self._config.messages
+
+    def message_at(self, index: int) -> str:
+        return self._config.message_at(index)
+
+    @messages.setter
+    def messages(self, new_messages: list[str]) -> None:
+        if not self._config.messages == new_messages:
+            self._config.messages = new_messages
+        self._coordinator.update(self.key, ('_messages',))
+        print(f'Reminder \'{self.name}\' messages updated: {new_messages}')
+
+    @property
+    def message_count(self) -> int:
+        return self._config.message_count
+
+    def iter_messages(self) -> Iterator[str]:
+        return self._config.iter_messages()
+
+    # the worker gets the whole edited list
+    def append_messages(self, messages: Iterable[str]) -> int:
+        return self.__messages_edited(self._config.append_messages(messages))
+
+    def remove_messages(self, messages: Iterable[str]) -> int:
+        return self.__messages_edited(self._config.remove_messages(messages))
+
+    def deduplicate_messages(self) -> int:
+        return self.__messages_edited(self._config.deduplicate_messages())
+
+    def __messages_edited(self, count: int) -> int:
+        if count:
+            self._coordinator.update(self.key, ('_messages',))
+        return count
+
+    @property
+    def selection(self) -> str:
+        return self._config.selection
+
+    @selection.setter
+    def selection(self, new_selection: str) -> None:
+        if not self._config.selection == new_selection:
+            self._config.selection = new_selection
+        self._coordinator.update(self.key, ('_selection',))
+        print(f'Reminder \'{self.name}\' message selection updated: {new_selection}')
+
+    @property
+    def no_repeat_window(self) -> int:
+        return self._config.no_repeat_window
+
+    @property
+    def wait_time_range(self) -> Tuple[int, int]:
+        return self._config.time_range
+
+    @wait_time_range.setter
+    def wait_time_range(self, new_range: Tuple[int, int]) -> None:
+        if not self._config.time_range == new_range:
+            self._config.time_range = new_range
+        self._coordinator.update(self.key, ('_time_range',))
+        print(f'Reminder \'{self.name}\' time range updated: {new_range}')
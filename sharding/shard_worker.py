@@ -0,0 +1,220 @@
+from multiprocessing.connection import Client, Connection
+from threading import Lock
+from time import sleep
+from typing import Any, Callable, Optional
+
+from config import ReminderConfig
+from config.schedule_store import ScheduleKey, ScheduleState, ScheduleStore
+from random_source import RandomSource, create_random_source
+from reminder import Reminder
+from scheduler import Scheduler
+from .protocol import (ASSIGN, CONFIGURE, ENTRIES, HELLO, PAUSE, RELEASE, RELEASED, RESUME, SCHEDULED, SEND, STOP,
+                       TRIGGER, UPDATE)
+
+
+def _no_dump() -> None:
+    pass
+
+
+def _no_send(message: str, chat_id: int) -> None:
+    pass
+
+
+# the coordinator owns the config, worker copies are never saved
+# the messages themselves stay with the coordinator, a worker only knows how many there are
+class ShardReminderConfig(ReminderConfig):
+    __slots__ = ()
+
+    def __init__(self, name: str, fields: dict[str, Any]):
+        super().__init__(name,
+                         None,
+                         tuple(fields['_time_range']),
+                         _no_dump,
+                         list(fields['_subscribers']),
+                         fields['_selection'],
+                         fields['_no_repeat_window'],
+                         list(fields['_weights']))
+        self._message_count = fields['_message_count']
+
+    # returns the changed fields by their config names
+    def apply(self, fields: dict[str, Any]) -> set[str]:
+        changed: set[str] = set()
+        for field, value in fields.items():
+            if field == '_message_count':
+                # the texts are not known here, so every edit of the list counts as a change
+                self._message_count = value
+                self._messages_changed()
+                changed.add('_messages')
+            elif getattr(self, field.lstrip('_')) != value:
+                setattr(self, field.lstrip('_'), value)
+                changed.add(field)
+        return changed
+
+
+# a fire is handed to the coordinator, which renders the message for every recipient and sends it
+class ShardReminder(Reminder):
+    _report: Callable[..., None]
+
+    def __init__(self, config: ShardReminderConfig, chat_id: int, scheduler: Scheduler,
+                 random_source: RandomSource, store: ScheduleStore, report: Callable[..., None]):
+        super().__init__(config, chat_id, _no_send, scheduler, random_source, store)
+        self._report = report
+
+    def _deliver(self, message_index: int) -> None:
+        self._report(SEND, (self.chat_id, self.name), message_index, self._fire_count, self._clock())
+
+
+# schedule states are saved by the coordinator, the worker reports them and keeps the last one for handovers
+class ShardScheduleStore(ScheduleStore):
+    _report: Callable[..., None]
+
+    def __init__(self, report: Callable[..., None]):
+        super().__init__()
+        self._report = report
+
+    def load_all(self) -> dict[ScheduleKey, ScheduleState]:
+        return dict()
+
+    def save(self, key: ScheduleKey, state: ScheduleState) -> None:
+        with self._lock:
+            self._states[key] = state
+        self._report(SCHEDULED, key, state.due, state.message_index)
+
+    def remove(self, key: ScheduleKey) -> None:
+        with self._lock:
+            self._states.pop(key, None)
+
+    def state(self, key: ScheduleKey) -> Optional[ScheduleState]:
+        with self._lock:
+            return self._states.get(key)
+
+    def flush(self) -> None:
+        pass
+
+
+# runs the reminders the coordinator assigns to it, messages are handed back to the coordinator for sending
+class ShardWorker:
+    # the coordinator may still be starting
+    CONNECT_ATTEMPTS: int = 30
+    CONNECT_RETRY_DELAY: float = 2.0
+
+    _address: tuple[str, int]
+    _authkey: bytes
+    _name: str
+    _connection: Optional[Connection]
+    # the scheduler workers and the command loop send concurrently
+    _send_lock: Lock
+    _scheduler: Scheduler
+    _random_source: Optional[RandomSource]
+    _store: ShardScheduleStore
+    _reminders: dict[ScheduleKey, Reminder]
+    _configs: dict[ScheduleKey, ShardReminderConfig]
+    _catch_up_spacing: float
+
+    def __init__(self, address: tuple[str, int], authkey: bytes, name: str):
+        self._address = address
+        self._authkey = authkey
+        self._name = name
+        self._connection = None
+        self._send_lock = Lock()
+        self._scheduler = Scheduler()
+        self._random_source = None
+        self._store = ShardScheduleStore(self.report)
+        self._reminders = dict()
+        self._configs = dict()
+        self._catch_up_spacing = 60
+
+    def run(self) -> None:
+        self._connection = self.__connect()
+        self.report(HELLO, self._name)
+        self._scheduler.start()
+        handlers: dict[str, Callable[..., None]] = {
+            CONFIGURE: self.__configure,
+            ASSIGN: self.__assign,
+            UPDATE: self.__update,
+            RELEASE: self.__release,
+            PAUSE: lambda key: self.__control(key, Reminder.pause),
+            RESUME: lambda key: self.__control(key, Reminder.resume),
+            TRIGGER: lambda key: self.__control(key, Reminder.trigger_now),
+            ENTRIES: self.__entries
+        }
+        while True:
+            try:
+                kind, *arguments = self._connection.recv()
+            except (EOFError, OSError):
+                print(f'Shard {self._name}: coordinator is gone')
+                self._scheduler.shutdown(0)
+                return
+            if kind == STOP:
+                self._scheduler.shutdown(arguments[0])
+                self._connection.close()
+                print(f'Shard {self._name} stopped')
+                return
+            # a command that fails leaves the other reminders running
+            try:
+                handlers[kind](*arguments)
+            except Exception as error:
+                print(f'Shard {self._name}: failed to handle {kind}: {error!r}')
+
+    def report(self, kind: str, *arguments) -> None:
+        with self._send_lock:
+            try:
+                self._connection.send((kind, *arguments))
+            except (OSError, ValueError) as error:
+                print(f'Shard {self._name}: failed to report {kind}: {error!r}')
+
+    def __connect(self) -> Connection:
+        for attempt in range(self.CONNECT_ATTEMPTS):
+            try:
+                return Client(self._address, authkey=self._authkey)
+            except ConnectionRefusedError:
+                sleep(self.CONNECT_RETRY_DELAY)
+        raise ConnectionRefusedError(f'Coordinator {self._address[0]}:{self._address[1]} is not reachable')
+
+    def __configure(self, settings: dict[str, Any]) -> None:
+        self._random_source = create_random_source(settings['random_source'])
+        self._catch_up_spacing = settings['catch_up_spacing']
+        Reminder.TIME_UNIT = settings['time_unit']
+
+    def __assign(self, key: ScheduleKey, fields: dict[str, Any], state: Optional[tuple[float, Optional[int]]],
+                 catch_up_policy: str, paused: bool) -> None:
+        chat_id, name = key
+        self.__stop_reminder(key)
+        config = ShardReminderConfig(name, fields)
+        reminder = ShardReminder(config, chat_id, self._scheduler, self._random_source, self._store, self.report)
+        self._configs[key] = config
+        self._reminders[key] = reminder
+        reminder.restore(ScheduleState(*state) if state is not None else None, catch_up_policy,
+                         self._catch_up_spacing)
+        if paused:
+            reminder.pause()
+
+    # changes that arrive for a reminder not run here are dropped, its next assignment carries them
+    def __update(self, key: ScheduleKey, fields: dict[str, Any]) -> None:
+        config = self._configs.get(key)
+        if config is None:
+            return
+        changed = config.apply(fields)
+        if changed:
+            self._reminders[key].config_changed(changed)
+
+    def __release(self, key: ScheduleKey) -> None:
+        self.__stop_reminder(key)
+        state = self._store.state(key)
+        self._store.remove(key)
+        self.report(RELEASED, key, state.due if state else None, state.message_index if state else None)
+
+    def __control(self, key: ScheduleKey, action: Callable[[Reminder], None]) -> None:
+        reminder = self._reminders.get(key)
+        if reminder is not None:
+            action(reminder)
+
+    def __entries(self, request_id: int, key: ScheduleKey, until: float) -> None:
+        reminder = self._reminders.get(key)
+        self.report(ENTRIES, request_id, reminder.schedule(until) if reminder is not None else list())
+
+    def __stop_reminder(self, key: ScheduleKey) -> None:
+        reminder = self._reminders.pop(key, None)
+        self._configs.pop(key, None)
+        if reminder is not None:
+            reminder.stop()
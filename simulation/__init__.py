@@ -0,0 +1,2 @@
+from .virtual_scheduler import VirtualClock, VirtualScheduler
+from .capacity_report import CapacityReport
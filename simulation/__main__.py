@@ -0,0 +1,64 @@
+import argparse
+import os
+from contextlib import redirect_stdout
+from time import perf_counter, time
+
+from config.config import Config
+from config.reminder_config import ReminderConfig
+from random_source import create_random_source
+from reminder import Reminder
+from .capacity_report import CapacityReport
+from .virtual_scheduler import VirtualClock, VirtualScheduler
+
+
+# a copy that keeps edits made while simulating, e.g. history of 'no_repeat', away from the storage
+def _detached(config: ReminderConfig) -> ReminderConfig:
+    return ReminderConfig(config.name, list(config.iter_messages()), config.time_range, lambda: None,
+                          list(config.subscribers), config.selection, config.no_repeat_window, list(config.weights))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Runs the reminders of config.json on a virtual clock and predicts '
+                                                 'the send rate they produce')
+    parser.add_argument('--days', type=float, default=14, help='simulated time')
+    # random.org would spend the daily quota on the simulation
+    parser.add_argument('--random-source', default='secrets', choices=['secrets', 'numpy'])
+    parser.add_argument('--top', type=int, default=5, help='how many largest bursts and busiest chats to list')
+    parser.add_argument('--csv', help='file for the number of sends in every simulated minute')
+    args = parser.parse_args()
+
+    config = Config()
+    random_source = create_random_source(args.random_source)
+    start = time()
+    duration = args.days * 86400
+    clock = VirtualClock(start)
+    scheduler = VirtualScheduler(clock)
+    report = CapacityReport(start, duration, args.top)
+
+    def send(message: str, chat_id: int, **_) -> None:
+        report.record(clock.now, chat_id)
+
+    # the saved schedule is continued, so the first fires match the running bot
+    schedule_states = config.schedule_store.load_all()
+    started = perf_counter()
+    # reminders print every planned fire
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        for chat_id, chat_config in config.chats.items():
+            for reminder_name, reminder_config in chat_config.reminders.items():
+                reminder = Reminder(_detached(reminder_config), chat_id, send, scheduler, random_source, clock=clock,
+                                    chat_variables=config.chat_variables)
+                reminder.restore(schedule_states.get((chat_id, reminder_name)), config.catch_up_policy,
+                                 config.catch_up_spacing)
+        scheduler.run_until(start + duration)
+
+    print(f'Simulated {args.days:g} days in {perf_counter() - started:.1f}s, {scheduler.fires} fires')
+    for line in report.summary():
+        print(line)
+    if args.csv is not None:
+        with open(args.csv, 'w', newline='') as stream:
+            report.write_csv(stream)
+        print(f'Sends per minute written to {args.csv}')
+
+
+if __name__ == '__main__':
+    main()
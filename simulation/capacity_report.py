@@ -0,0 +1,136 @@
+import csv
+from array import array
+from collections import Counter
+from datetime import datetime
+from heapq import heappush, heappushpop
+from math import ceil
+from typing import TextIO
+
+from telegram.send_queue import CHAT_RATE, GROUP_CHAT_RATE, GLOBAL_RATE, TokenBucket
+
+
+# collects simulated sends in time order and predicts how they fit into the Telegram rate limits
+# the limits are checked with the token buckets of the send queue: a send that would have to wait for a token
+# is a predicted violation, the queue would hold it back for that long
+class CapacityReport:
+    HISTOGRAM_WIDTH: int = 50
+    HISTOGRAM_BINS: int = 10
+
+    _start: float
+    # sends in every simulated minute
+    _per_minute: array
+    # the largest per second bursts as (sends, second) pairs, smallest first
+    _bursts: list[tuple[int, int]]
+    _top_bursts: int
+    _second: int
+    _second_sends: int
+    _chat_buckets: dict[int, TokenBucket]
+    _global_bucket: TokenBucket
+    _chat_waits: Counter
+    _global_waits: int
+    _max_wait: float
+    _sends: int
+
+    def __init__(self, start: float, duration: float, top_bursts: int = 5):
+        self._start = start
+        self._per_minute = array('L', bytes(array('L').itemsize * ceil(duration / 60)))
+        self._bursts = list()
+        self._top_bursts = top_bursts
+        self._second = int(start)
+        self._second_sends = 0
+        self._chat_buckets = dict()
+        self._global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+        self._chat_waits = Counter()
+        self._global_waits = 0
+        self._max_wait = 0.0
+        self._sends = 0
+
+    # sends must come in time order, as the virtual scheduler fires them
+    def record(self, now: float, chat_id: int) -> None:
+        self._sends += 1
+        minute = int((now - self._start) // 60)
+        if minute < len(self._per_minute):
+            self._per_minute[minute] += 1
+
+        second = int(now)
+        if second != self._second:
+            self.__close_second()
+            self._second = second
+        self._second_sends += 1
+
+        chat_bucket = self._chat_buckets.get(chat_id)
+        if chat_bucket is None:
+            chat_bucket = TokenBucket(GROUP_CHAT_RATE if chat_id < 0 else CHAT_RATE, 1)
+            self._chat_buckets[chat_id] = chat_bucket
+        chat_wait = chat_bucket.delay(now)
+        global_wait = self._global_bucket.delay(now)
+        if chat_wait > 0:
+            self._chat_waits[chat_id] += 1
+        if global_wait > 0:
+            self._global_waits += 1
+        self._max_wait = max(self._max_wait, chat_wait, global_wait)
+        # tokens go below zero while sends wait, so the delay of the next send includes the backlog
+        chat_bucket.consume(now)
+        self._global_bucket.consume(now)
+
+    def __close_second(self) -> None:
+        if not self._second_sends:
+            return
+        burst = (self._second_sends, self._second)
+        if len(self._bursts) < self._top_bursts:
+            heappush(self._bursts, burst)
+        else:
+            heappushpop(self._bursts, burst)
+        self._second_sends = 0
+
+    def summary(self) -> list[str]:
+        self.__close_second()
+        per_minute = sorted(self._per_minute)
+        minutes = len(per_minute)
+        lines = [f'Sends: {self._sends} in {minutes} minutes ({minutes / 1440:.1f} days)']
+        if not minutes:
+            return lines
+        lines.append(f'Per minute: mean {self._sends / minutes:.2f}, '
+                     f'p50 {per_minute[minutes // 2]}, p99 {per_minute[min(minutes - 1, minutes * 99 // 100)]}, '
+                     f'max {per_minute[-1]}')
+        peak_minute = max(range(minutes), key=self._per_minute.__getitem__)
+        lines.append(f'Peak minute: {self._per_minute[peak_minute]} sends '
+                     f'at {self.__format_time(self._start + peak_minute * 60)}')
+        lines.append('Largest bursts:')
+        for sends, second in sorted(self._bursts, reverse=True):
+            lines.append(f'  {sends} sends in the second at {self.__format_time(second)}')
+
+        lines.append('Minutes by sends:')
+        lines.extend(self.__histogram(per_minute))
+
+        lines.append(f'Predicted rate limit violations: {sum(self._chat_waits.values())} sends over the per chat '
+                     f'limit in {len(self._chat_waits)} chats, {self._global_waits} over the global limit '
+                     f'of {GLOBAL_RATE:g}/s, longest wait {self._max_wait:.1f}s')
+        for chat_id, waits in self._chat_waits.most_common(self._top_bursts):
+            lines.append(f'  chat {chat_id}: {waits} sends over the limit')
+        return lines
+
+    # bins of equal width over the sends per minute, bars scaled to the fullest bin
+    def __histogram(self, per_minute: list[int]) -> list[str]:
+        bin_width = max(1, ceil((per_minute[-1] + 1) / self.HISTOGRAM_BINS))
+        bins = Counter(sends // bin_width for sends in per_minute)
+        fullest = max(bins.values())
+        lines: list[str] = list()
+        for index in range(per_minute[-1] // bin_width + 1):
+            minutes = bins.get(index, 0)
+            low = index * bin_width
+            label = f'{low}' if bin_width == 1 else f'{low}-{low + bin_width - 1}'
+            bar = '#' * ceil(minutes * self.HISTOGRAM_WIDTH / fullest)
+            lines.append(f'  {label:>9} | {bar} {minutes}')
+        return lines
+
+    # one row per simulated minute: its start and the number of sends
+    def write_csv(self, stream: TextIO) -> None:
+        writer = csv.writer(stream)
+        writer.writerow(('minute', 'sends'))
+        for minute, sends in enumerate(self._per_minute):
+            writer.writerow((self.__format_time(self._start + minute * 60), sends))
+
+    @staticmethod
+    def __format_time(timestamp: float) -> str:
+        return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
@@ -0,0 +1,62 @@
+from heapq import heappop, heappush
+from itertools import count
+from typing import Optional
+
+from scheduler import ScheduledJob, Scheduler
+
+
+# unix time that only moves when the simulation moves it
+class VirtualClock:
+    __slots__ = ('now',)
+
+    def __init__(self, start: float):
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+
+# the part of the Scheduler api reminders use to plan fires, run in one thread against a virtual clock:
+# jobs fire one after another in deadline order and the clock jumps straight to each deadline,
+# failing jobs are handled the same way as by the real scheduler
+class VirtualScheduler:
+    _clock: VirtualClock
+    # (deadline, sequence, job), the sequence keeps jobs with equal deadlines in insertion order
+    _heap: list[tuple[float, int, ScheduledJob]]
+    _sequence: count
+    _removed: set[int]
+    _fires: int
+
+    def __init__(self, clock: VirtualClock):
+        self._clock = clock
+        self._heap = list()
+        self._sequence = count()
+        self._removed = set()
+        self._fires = 0
+
+    @property
+    def fires(self) -> int:
+        return self._fires
+
+    def add(self, job: ScheduledJob, deadline: Optional[float] = None) -> None:
+        if deadline is None:
+            deadline = self._clock.now + Scheduler._compute_timeout(job)
+        heappush(self._heap, (deadline, next(self._sequence), job))
+        job.on_scheduled(deadline)
+
+    def remove(self, job: ScheduledJob) -> None:
+        self._removed.add(id(job))
+
+    # fires every job due up to the given unix time and leaves the clock there
+    def run_until(self, until: float) -> None:
+        heap = self._heap
+        while heap and heap[0][0] <= until:
+            deadline, _, job = heappop(heap)
+            if id(job) in self._removed:
+                continue
+            self._clock.now = deadline
+            Scheduler._fire(job)
+            self._fires += 1
+            self.add(job)
+        self._clock.now = until
+
@@ -1,2 +1,6 @@
 from .telegram import Telegram
+from .cached_markup import CachedMarkup
+from .delete_queue import DeleteQueue
+from .session_store import MenuSession, SessionStore
+from .webhook_server import WebhookServer
 from .bot_menu_thread import BotMenuThread
@@ -1,133 +1,278 @@
-from datetime import timedelta
-from functools import reduce
+import csv
+import tempfile
+from datetime import datetime, timedelta
 from threading import Thread
+from time import perf_counter, time
 from typing import Callable, Optional, Union
 
+import requests
+from telebot.apihelper import ApiException
 from telebot.types import ReplyKeyboardMarkup, KeyboardButton, Message, ReplyKeyboardRemove
 
+from config.message_files import MESSAGE_FORMATS, MessageReader, message_format, write_messages
+from config.message_template import BUILTIN_VARIABLES, is_variable_name
+from metrics import metrics
 from reminder import Reminder
 from . import Telegram
+from .cached_markup import CachedMarkup
+from .session_store import MenuSession, SessionStore
+from .webhook_server import WebhookServer
+
+# menu names of the message selection strategies
+SELECTION_NAMES = {
+    'uniform': 'Случайно, возможны повторы',
+    'shuffle_bag': 'По кругу в случайном порядке',
+    'no_repeat': 'Без повторов последних сообщений',
+    'weighted': 'Случайно с весами'
+}
 
 
 class BotMenuThread(Thread):
-    _reminders: dict[str, Reminder]
+    # profile buttons on one page of the reminder selector
+    SELECTOR_PAGE_SIZE: int = 10
+    # the schedule preview covers this many seconds and lists at most PREVIEW_LIMIT fires
+    PREVIEW_HORIZON: int = 24 * 60 * 60
+    PREVIEW_LIMIT: int = 20
+    # the message list pages show at most this many messages and characters of them
+    MESSAGES_PREVIEW_LIMIT: int = 20
+    MESSAGES_PREVIEW_LENGTH: int = 1000
+    # csv keeps messages with line breaks and opens in spreadsheet editors
+    EXPORT_FORMAT: str = 'csv'
+
+    # reminders of every served chat, by chat id and reminder name
+    _reminders: dict[int, dict[str, Reminder]]
     _telegram: Telegram
+    # updates come from the webhook when it is set, otherwise from long polling
+    _webhook: Optional[WebhookServer]
 
-    _keyboard_factories: dict[str, Callable[[], Union[ReplyKeyboardMarkup or ReplyKeyboardRemove]]]
-    _menu_page_message_senders: dict[str, Callable[[], None]]
-    _menu_handlers: dict[str, Callable[[Message], None]]
+    _keyboard_factories: dict[str, Callable[[MenuSession], Union[ReplyKeyboardMarkup, ReplyKeyboardRemove]]]
+    _menu_page_message_senders: dict[str, Callable[[MenuSession], None]]
+    _menu_handlers: dict[str, Callable[[MenuSession, Message], None]]
     _item_names: dict[str, str]
-
-    _active_menu_page: str
-    _chosen_reminder: Optional[Reminder]
-
-    __last_user_message: Optional[Message]
-    __last_bot_message: Optional[Message]
-    __remove_keyboard_command: ReplyKeyboardRemove
-
-    def __init__(self, bot: Telegram, reminders: dict[str, Reminder]):
-        super().__init__()
+    # pages that work on the chosen reminder
+    _reminder_pages: frozenset[str]
+
+    _sessions: SessionStore
+    # keyboards that do not depend on the session, serialized once per page
+    _keyboards: dict[str, CachedMarkup]
+    # reminder selector pages of every chat, dropped by invalidate_chat
+    _selector_keyboards: dict[int, list[CachedMarkup]]
+    # texts describing a reminder by chat, reminder name and page, with the reminder revision they were built for
+    _reminder_texts: dict[tuple[int, str, str], tuple[int, str]]
+
+    def __init__(self,
+                 bot: Telegram,
+                 reminders: dict[int, dict[str, Reminder]],
+                 webhook: Optional[WebhookServer] = None,
+                 sessions: Optional[SessionStore] = None):
+        # the thread is not waited for on exit, stop() is used for a graceful shutdown
+        super().__init__(daemon=True)
         self._telegram = bot
+        self._webhook = webhook
         self._reminders = reminders
-        self.__remove_keyboard_command = ReplyKeyboardRemove()
-
-        self.__last_user_message = None
-        self.__last_bot_message = None
+        self._sessions = sessions if sessions is not None else SessionStore()
+        self._keyboards = dict()
+        self._selector_keyboards = dict()
+        self._reminder_texts = dict()
 
         self._keyboard_factories = {
             'none': self.__no_keyboard,
             'main': self.__main_menu_keyboard,
             'text_hiding': self.__input_bool_keyboard,
-            'reminder_selector': self.__reminder_selector_keyboard,
+            'chat_variables': self.__input_string_keyboard,
             'reminder_settings': self.__reminder_settings_keyboard,
-            'reminder_messages_settings': self.__input_string_keyboard,
+            'reminder_preview': self.__back_keyboard,
+            'reminder_selection_settings': self.__selection_keyboard,
+            'reminder_messages_settings': self.__messages_settings_keyboard,
+            'reminder_messages_import': self.__input_string_keyboard,
             'reminder_time_settings': self.__input_string_keyboard
         }
         self._menu_page_message_senders = {
             'none': self.__send_menu_exit_text,
             'main': self.__send_main_menu_text,
             'text_hiding': self.__send_toggle_message_hiding_text,
+            'chat_variables': self.__send_chat_variables_text,
             'reminder_selector': self.__send_reminder_selector_text,
             'reminder_settings': self.__send_reminder_settings_text,
+            'reminder_preview': self.__send_reminder_preview_text,
+            'reminder_selection_settings': self.__send_reminder_configure_selection_text,
             'reminder_messages_settings': self.__send_reminder_configure_messages_text,
+            'reminder_messages_import': self.__send_reminder_import_messages_text,
             'reminder_time_settings': self.__send_reminder_configure_time_text
         }
         self._menu_handlers = {
             'none': self.__no_menu_input_handler,
             'main': self.__main_menu_input_handler,
             'text_hiding': self.__text_hiding_input_handler,
+            'chat_variables': self.__chat_variables_input_handler,
             'reminder_selector': self.__reminder_selector_input_handler,
             'reminder_settings': self.__reminder_settings_input_handler,
+            'reminder_preview': self.__reminder_preview_input_handler,
+            'reminder_selection_settings': self.__reminder_selection_settings_input_handler,
             'reminder_messages_settings': self.__reminder_messages_settings_input_handler,
+            'reminder_messages_import': self.__reminder_messages_import_input_handler,
             'reminder_time_settings': self.__reminder_time_settings_input_handler
         }
+        self._reminder_pages = frozenset({'reminder_settings', 'reminder_preview', 'reminder_selection_settings',
+                                           'reminder_messages_settings', 'reminder_messages_import',
+                                           'reminder_time_settings'})
         self._item_names = {
             'settings_command': '/settings',
             'text_hiding': 'Настройка скрытия текста',
+            'chat_variables': 'Переменные для сообщений',
             'reminder_selector': 'Настройка профилей',
             'reminder_configure_messages': 'Настройка списка напоминаний',
             'reminder_configure_time': 'Настройка временного интервала',
+            'reminder_preview': 'Расписание на сутки',
+            'reminder_configure_selection': 'Настройка порядка сообщений',
+            'reminder_send_now': 'Отправить сейчас',
+            'reminder_pause': 'Приостановить',
+            'reminder_resume': 'Возобновить',
+            'messages_append': 'Добавить из файла',
+            'messages_remove': 'Удалить из файла',
+            'messages_deduplicate': 'Убрать повторы',
+            'messages_export': 'Выгрузить файлом',
             'back': 'Назад',
             'cancel': 'Отмена',
             'exit': 'Закрыть настройки',
+            'previous_page': '◀️',
+            'next_page': '▶️',
             'True': 'Да',
             'False': 'Нет',
             'incorrect_input': 'Некорректный ввод. Выбери из списка:'
         }
-        self._active_menu_page = 'none'
 
     def run(self):
-        self._telegram.bot.register_message_handler(self.__generic_message_handler, content_types=['text'])
+        # documents are message lists uploaded for import
+        self._telegram.bot.register_message_handler(self.__generic_message_handler,
+                                                    content_types=['text', 'document'])
+        if self._webhook is not None:
+            self._webhook.serve_forever()
+            return
+        # a webhook left from a previous run would make getUpdates fail
+        self._telegram.bot.remove_webhook()
         self._telegram.bot.infinity_polling(skip_pending=True)
 
-    def __send(self, message) -> Message:
-        keyboard_command = self._keyboard_factories[self._active_menu_page]()
-        new_bot_message = self._telegram.send(message, hide_text=False, keyboard_markup=keyboard_command)
-        self.last_bot_message = new_bot_message
+    # no more updates are taken, the one being handled is finished
+    def stop(self) -> None:
+        if self._webhook is not None:
+            self._webhook.stop()
+        else:
+            self._telegram.bot.stop_polling()
+
+    # to be called when the set of reminders of a chat changes
+    def invalidate_chat(self, chat_id: int) -> None:
+        self._selector_keyboards.pop(chat_id, None)
+
+    def __send(self, state: MenuSession, message) -> Message:
+        keyboard_command = self.__keyboard(state)
+        new_bot_message = self._telegram.send(message, hide_text=False, keyboard_markup=keyboard_command,
+                                              chat_id=state.chat_id)
+        self.__set_last_bot_message(state, new_bot_message)
         return new_bot_message
 
-    def __delete(self, message: Message):
-        if type(message) is Message:
-            self._telegram.delete_message(message.message_id)
+    def __delete(self, state: MenuSession, message_id: Optional[int]):
+        if message_id is not None:
+            self._telegram.delete_message(message_id, chat_id=state.chat_id)
 
-    def __delete_last_user_message(self):
-        self.__delete(self.last_user_message)
+    def __delete_last_user_message(self, state: MenuSession):
+        self.__delete(state, state.last_user_message_id)
+        state.last_user_message_id = None
 
-    # menu keyboard factories
+    def __chosen_reminder(self, state: MenuSession) -> Optional[Reminder]:
+        if state.chosen_reminder is None:
+            return None
+        return self._reminders[state.chat_id].get(state.chosen_reminder)
 
-    def __no_keyboard(self) -> ReplyKeyboardRemove:
-        return self.__remove_keyboard_command
+    # menu keyboard factories
 
-    def __main_menu_keyboard(self) -> ReplyKeyboardMarkup:
+    def __keyboard(self, state: MenuSession) -> CachedMarkup:
+        if state.active_menu_page == 'reminder_selector':
+            return self.__selector_keyboards(state.chat_id)[state.selector_page]
+        keyboard = self._keyboards.get(state.active_menu_page)
+        if keyboard is None:
+            keyboard = CachedMarkup(self._keyboard_factories[state.active_menu_page](state))
+            self._keyboards[state.active_menu_page] = keyboard
+        return keyboard
+
+    def __selector_keyboards(self, chat_id: int) -> list[CachedMarkup]:
+        keyboards = self._selector_keyboards.get(chat_id)
+        if keyboards is None:
+            names = list(self._reminders[chat_id].keys())
+            pages = [names[start:start + self.SELECTOR_PAGE_SIZE]
+                     for start in range(0, len(names), self.SELECTOR_PAGE_SIZE)] or [list()]
+            keyboards = [CachedMarkup(self.__reminder_selector_keyboard(page_names, index, len(pages)))
+                         for index, page_names in enumerate(pages)]
+            self._selector_keyboards[chat_id] = keyboards
+        return keyboards
+
+    def __no_keyboard(self, __: MenuSession) -> ReplyKeyboardRemove:
+        return ReplyKeyboardRemove()
+
+    def __main_menu_keyboard(self, __: MenuSession) -> ReplyKeyboardMarkup:
         markup = ReplyKeyboardMarkup(resize_keyboard=True)
         markup.row(self._item_names.get('text_hiding'))
+        markup.row(self._item_names.get('chat_variables'))
         markup.row(self._item_names.get('reminder_selector'))
         markup.row(self._item_names.get('exit'))
         return markup
 
-    def __reminder_selector_keyboard(self) -> ReplyKeyboardMarkup:
+    def __reminder_selector_keyboard(self, names: list[str], page: int, page_count: int) -> ReplyKeyboardMarkup:
         markup = ReplyKeyboardMarkup(resize_keyboard=True)
-        for name in self._reminders.keys():
+        for name in names:
             markup.row(KeyboardButton(name))
+        navigation: list[str] = list()
+        if page > 0:
+            navigation.append(self._item_names.get('previous_page'))
+        if page < page_count - 1:
+            navigation.append(self._item_names.get('next_page'))
+        if navigation:
+            markup.row(*navigation)
         markup.row(self._item_names.get('back'))
         markup.row(self._item_names.get('exit'))
         return markup
 
-    def __reminder_settings_keyboard(self) -> ReplyKeyboardMarkup:
+    def __reminder_settings_keyboard(self, __: MenuSession) -> ReplyKeyboardMarkup:
         markup = ReplyKeyboardMarkup(resize_keyboard=True)
         markup.row(self._item_names.get('reminder_configure_messages'))
         markup.row(self._item_names.get('reminder_configure_time'))
+        markup.row(self._item_names.get('reminder_configure_selection'))
+        markup.row(self._item_names.get('reminder_preview'))
+        markup.row(self._item_names.get('reminder_send_now'))
+        markup.row(self._item_names.get('reminder_pause'), self._item_names.get('reminder_resume'))
         markup.row(self._item_names.get('back'))
         markup.row(self._item_names.get('exit'))
         return markup
 
-    def __input_string_keyboard(self) -> ReplyKeyboardMarkup:
+    def __back_keyboard(self, __: MenuSession) -> ReplyKeyboardMarkup:
         markup = ReplyKeyboardMarkup(resize_keyboard=True)
+        markup.row(self._item_names.get('back'))
+        markup.row(self._item_names.get('exit'))
+        return markup
+
+    def __selection_keyboard(self, __: MenuSession) -> ReplyKeyboardMarkup:
+        markup = ReplyKeyboardMarkup(resize_keyboard=True)
+        for name in SELECTION_NAMES.values():
+            markup.row(name)
+        markup.row(self._item_names.get('cancel'))
+        markup.row(self._item_names.get('exit'))
+        return markup
+
+    def __messages_settings_keyboard(self, __: MenuSession) -> ReplyKeyboardMarkup:
+        markup = ReplyKeyboardMarkup(resize_keyboard=True)
+        markup.row(self._item_names.get('messages_append'), self._item_names.get('messages_remove'))
+        markup.row(self._item_names.get('messages_deduplicate'), self._item_names.get('messages_export'))
         markup.row(self._item_names.get('cancel'))
         markup.row(self._item_names.get('exit'))
         return markup
 
-    def __input_bool_keyboard(self) -> ReplyKeyboardMarkup:
+    def __input_string_keyboard(self, __: MenuSession) -> ReplyKeyboardMarkup:
+        markup = ReplyKeyboardMarkup(resize_keyboard=True)
+        markup.row(self._item_names.get('cancel'))
+        markup.row(self._item_names.get('exit'))
+        return markup
+
+    def __input_bool_keyboard(self, __: MenuSession) -> ReplyKeyboardMarkup:
         markup = ReplyKeyboardMarkup(resize_keyboard=True)
         markup.row(self._item_names.get('True'), self._item_names.get('False'))
         markup.row(self._item_names.get('cancel'))
@@ -136,157 +281,389 @@ class BotMenuThread(Thread):
 
     # navigation
 
-    def _show_menu(self, menu_page_name: str):
-        self.__delete_last_user_message()
-        self._active_menu_page = menu_page_name
-        self._menu_page_message_senders[menu_page_name]()
+    def _show_menu(self, state: MenuSession, menu_page_name: str):
+        self.__delete_last_user_message(state)
+        state.active_menu_page = menu_page_name
+        self._menu_page_message_senders[menu_page_name](state)
 
     # main message handler
 
     def __generic_message_handler(self, message: Message):
-        self.last_user_message = message
-        if self.last_user_message.text == self._item_names.get('settings_command'):
-            self._show_menu('main')
-        elif self.last_user_message.text == self._item_names.get('exit'):
-            self._show_menu('none')
-        else:
-            self._menu_handlers[self._active_menu_page](self.last_user_message)
+        # only chats with their own reminder set are served
+        if message.chat.id not in self._reminders:
+            return
+        started = perf_counter()
+        user_id = message.from_user.id if message.from_user is not None else message.chat.id
+        state = self._sessions.get(message.chat.id, user_id)
+        with state.lock:
+            page = state.active_menu_page
+            self.__set_last_user_message(state, message)
+            if message.text == self._item_names.get('settings_command'):
+                self._show_menu(state, 'main')
+            elif message.text == self._item_names.get('exit'):
+                self._show_menu(state, 'none')
+            elif state.active_menu_page in self._reminder_pages and self.__chosen_reminder(state) is None:
+                # the profile was removed while the session was idle
+                self._show_menu(state, 'reminder_selector')
+            else:
+                self._menu_handlers[state.active_menu_page](state, message)
+            self._sessions.save(state)
+        metrics.observe('menu_handler_seconds', perf_counter() - started, {'page': page})
 
     # menu actions handlers
-    def __no_menu_input_handler(self, __: Message) -> None:
-        self.__send("Некорректный ввод. Для входа в настройки отправь /settings")
+    def __no_menu_input_handler(self, state: MenuSession, __: Message) -> None:
+        self.__send(state, "Некорректный ввод. Для входа в настройки отправь /settings")
 
-    def __main_menu_input_handler(self, message: Message) -> None:
+    def __main_menu_input_handler(self, state: MenuSession, message: Message) -> None:
         if message.text == self._item_names.get('text_hiding'):
-            self._show_menu('text_hiding')
+            self._show_menu(state, 'text_hiding')
+        elif message.text == self._item_names.get('chat_variables'):
+            self._show_menu(state, 'chat_variables')
         elif message.text == self._item_names.get('reminder_selector'):
-            self._show_menu('reminder_selector')
+            state.selector_page = 0
+            self._show_menu(state, 'reminder_selector')
         else:
-            self.__send(self._item_names.get('incorrect_input'))
+            self.__send(state, self._item_names.get('incorrect_input'))
 
-    def __text_hiding_input_handler(self, message: Message) -> None:
+    def __text_hiding_input_handler(self, state: MenuSession, message: Message) -> None:
         if message.text == self._item_names.get('cancel'):
-            self._show_menu('main')
+            self._show_menu(state, 'main')
         elif message.text == self._item_names.get('True'):
-            self._telegram.hide_text = True
-            self._show_menu('main')
+            self._telegram.set_text_hidden(state.chat_id, True)
+            self._show_menu(state, 'main')
         elif message.text == self._item_names.get('False'):
-            self._telegram.hide_text = False
-            self._show_menu('main')
+            self._telegram.set_text_hidden(state.chat_id, False)
+            self._show_menu(state, 'main')
         else:
-            self.__send(self._item_names.get('incorrect_input'))
+            self.__send(state, self._item_names.get('incorrect_input'))
 
-    def __reminder_selector_input_handler(self, message: Message) -> None:
+    # one variable per line as name=value, an empty value removes the variable
+    def __chat_variables_input_handler(self, state: MenuSession, message: Message) -> None:
+        if message.text == self._item_names.get('cancel'):
+            self._show_menu(state, 'main')
+            return
+        variables = dict(self._telegram.chat_variables(state.chat_id))
+        for line in (message.text or '').splitlines():
+            name, separator, value = line.partition('=')
+            name = name.strip()
+            if not separator or not is_variable_name(name):
+                self.__send(state, f'Некорректная строка: {line}\n'
+                                   f'Отправь строки вида имя=значение или нажми \'Отмена\'')
+                return
+            if value.strip():
+                variables[name] = value.strip()
+            else:
+                variables.pop(name, None)
+        self._telegram.set_chat_variables(state.chat_id, variables)
+        self._show_menu(state, 'main')
+
+    def __reminder_selector_input_handler(self, state: MenuSession, message: Message) -> None:
+        reminder = self._reminders[state.chat_id].get(message.text)
         if message.text == self._item_names.get('back'):
-            self._show_menu('main')
-        elif type(self._reminders.get(message.text)) is Reminder:
-            self._chosen_reminder = self._reminders.get(message.text)
-            self._show_menu('reminder_settings')
+            self._show_menu(state, 'main')
+        elif message.text == self._item_names.get('previous_page'):
+            state.selector_page -= 1
+            self._show_menu(state, 'reminder_selector')
+        elif message.text == self._item_names.get('next_page'):
+            state.selector_page += 1
+            self._show_menu(state, 'reminder_selector')
+        elif reminder is not None:
+            state.chosen_reminder = reminder.name
+            self._show_menu(state, 'reminder_settings')
         else:
-            self.__send(self._item_names.get('incorrect_input'))
+            self.__send(state, self._item_names.get('incorrect_input'))
 
-    def __reminder_settings_input_handler(self, message: Message) -> None:
+    def __reminder_settings_input_handler(self, state: MenuSession, message: Message) -> None:
         if message.text == self._item_names.get('reminder_configure_messages'):
-            self._show_menu('reminder_messages_settings')
+            self._show_menu(state, 'reminder_messages_settings')
         elif message.text == self._item_names.get('reminder_configure_time'):
-            self._show_menu('reminder_time_settings')
+            self._show_menu(state, 'reminder_time_settings')
+        elif message.text == self._item_names.get('reminder_configure_selection'):
+            self._show_menu(state, 'reminder_selection_settings')
+        elif message.text == self._item_names.get('reminder_preview'):
+            self._show_menu(state, 'reminder_preview')
+        elif message.text == self._item_names.get('reminder_send_now'):
+            self.__chosen_reminder(state).trigger_now()
+            self._show_menu(state, 'reminder_settings')
+        elif message.text == self._item_names.get('reminder_pause'):
+            self.__chosen_reminder(state).pause()
+            self._show_menu(state, 'reminder_settings')
+        elif message.text == self._item_names.get('reminder_resume'):
+            self.__chosen_reminder(state).resume()
+            self._show_menu(state, 'reminder_settings')
         elif message.text == self._item_names.get('back'):
-            self._show_menu('reminder_selector')
+            self._show_menu(state, 'reminder_selector')
         else:
-            self.__send(self._item_names.get('incorrect_input'))
+            self.__send(state, self._item_names.get('incorrect_input'))
+
+    def __reminder_preview_input_handler(self, state: MenuSession, message: Message) -> None:
+        if message.text == self._item_names.get('back'):
+            self._show_menu(state, 'reminder_settings')
+        else:
+            self.__send(state, self._item_names.get('incorrect_input'))
+
+    def __reminder_selection_settings_input_handler(self, state: MenuSession, message: Message) -> None:
+        if message.text == self._item_names.get('cancel'):
+            self._show_menu(state, 'reminder_settings')
+            return
+        selections = [selection for selection, name in SELECTION_NAMES.items() if name == message.text]
+        if not selections:
+            self.__send(state, self._item_names.get('incorrect_input'))
+            return
+        self.__chosen_reminder(state).selection = selections[0]
+        self._show_menu(state, 'reminder_settings')
 
-    def __reminder_messages_settings_input_handler(self, message: Message) -> None:
+    def __reminder_messages_settings_input_handler(self, state: MenuSession, message: Message) -> None:
         if message.text == self._item_names.get('cancel'):
-            self._show_menu('reminder_settings')
+            self._show_menu(state, 'reminder_settings')
+            return
+        if message.text in (self._item_names.get('messages_append'), self._item_names.get('messages_remove')):
+            state.import_mode = 'append' if message.text == self._item_names.get('messages_append') else 'remove'
+            self._show_menu(state, 'reminder_messages_import')
+            return
+        if message.text == self._item_names.get('messages_deduplicate'):
+            removed = self.__chosen_reminder(state).deduplicate_messages()
+            self.__show_messages_settings(state, f'Удалено повторов: {removed}')
+            return
+        if message.text == self._item_names.get('messages_export'):
+            self.__show_messages_settings(state, self.__export_messages(state))
+            return
+        if message.text is None:
+            self.__send(state, "Некорректный ввод. Отправь новый список напоминаний или нажми 'Отмена'")
             return
 
         messages: list[str] = message.text.split(';')
         messages = list(filter(lambda current: type(current) is str and len(current) > 0, messages))
         if len(messages) == 0:
-            self.__send("Некорректный ввод. Отправь новый список напоминаний или нажми 'Отмена'")
+            self.__send(state, "Некорректный ввод. Отправь новый список напоминаний или нажми 'Отмена'")
             return
-        self._chosen_reminder.messages = messages
-        self._show_menu('reminder_settings')
+        self.__chosen_reminder(state).messages = messages
+        self._show_menu(state, 'reminder_settings')
 
-    def __reminder_time_settings_input_handler(self, message: Message) -> None:
+    def __reminder_messages_import_input_handler(self, state: MenuSession, message: Message) -> None:
         if message.text == self._item_names.get('cancel'):
-            self._show_menu('reminder_settings')
+            self.__show_messages_settings(state)
+            return
+        document = message.document
+        if document is None:
+            self.__send(state, "Некорректный ввод. Отправь файл или нажми 'Отмена'")
+            return
+        file_format = message_format(document.file_name, document.mime_type)
+        if file_format is None:
+            self.__send(state, f'Неподдерживаемый формат файла. Поддерживаются: {", ".join(MESSAGE_FORMATS)}')
+            return
+        if document.file_size is not None and document.file_size > self._telegram.MAX_DOWNLOAD_SIZE:
+            self.__send(state, f'Файл больше {self._telegram.MAX_DOWNLOAD_SIZE // (1024 * 1024)} МБ, '
+                               f'раздели его на части')
+            return
+
+        reminder = self.__chosen_reminder(state)
+        try:
+            with self._telegram.download_document(document.file_id) as stream:
+                reader = MessageReader(stream, file_format)
+                if state.import_mode == 'remove':
+                    note = f'Удалено сообщений: {reminder.remove_messages(reader)}'
+                else:
+                    note = f'Добавлено сообщений: {reminder.append_messages(reader)}'
+        except (ApiException, requests.RequestException) as error:
+            print(f'Failed to download document {document.file_name}: {error!r}')
+            self.__send(state, "Не удалось скачать файл. Отправь его еще раз или нажми 'Отмена'")
+            return
+        except csv.Error as error:
+            # e.g. a field over the size limit of the csv module
+            print(f'Failed to read document {document.file_name}: {error!r}')
+            self.__send(state, "Не удалось прочитать файл, ничего не изменено. Отправь другой файл или нажми 'Отмена'")
+            return
+        except ValueError:
+            self.__send(state, "В профиле не осталось бы ни одного сообщения. Отправь другой файл или нажми 'Отмена'")
+            return
+        if reader.skipped:
+            note += f', пропущено пустых и некорректных строк: {reader.skipped}'
+        self.__show_messages_settings(state, note)
+
+    # returns a note when the file could not be sent
+    def __export_messages(self, state: MenuSession) -> Optional[str]:
+        reminder = self.__chosen_reminder(state)
+        with tempfile.TemporaryFile() as document:
+            write_messages(document, reminder.iter_messages(), self.EXPORT_FORMAT)
+            document.seek(0)
+            try:
+                self._telegram.send_document(document, f'{reminder.name}.{self.EXPORT_FORMAT}',
+                                             chat_id=state.chat_id)
+            except (ApiException, requests.RequestException) as error:
+                print(f'Failed to send document {reminder.name}.{self.EXPORT_FORMAT}: {error!r}')
+                return 'Не удалось отправить файл, попробуй еще раз'
+        return None
+
+    # the messages page with the outcome of the last action above it
+    def __show_messages_settings(self, state: MenuSession, note: Optional[str] = None) -> None:
+        self.__delete_last_user_message(state)
+        state.active_menu_page = 'reminder_messages_settings'
+        text = self.__reminder_text(state, self.__reminder_configure_messages_text)
+        self.__send(state, text if note is None else f'{note}\n\n{text}')
+
+    def __reminder_time_settings_input_handler(self, state: MenuSession, message: Message) -> None:
+        if message.text == self._item_names.get('cancel'):
+            self._show_menu(state, 'reminder_settings')
+            return
+        if message.text is None:
+            self.__send(state, "Некорректный ввод. Отправь новый интервал или нажми 'Отмена'")
             return
 
         numbers: list[str] = message.text.split(' ')
         numbers = list(filter(lambda current: type(current) == str and current.isnumeric(), numbers))
         if not len(numbers) == 2:
-            self.__send("Некорректный ввод. Отправь новый интервал или нажми 'Отмена'")
+            self.__send(state, "Некорректный ввод. Отправь новый интервал или нажми 'Отмена'")
             return
 
         min_time = int(numbers[0])
         max_time = int(numbers[1])
         if min_time > max_time:
-            self.__send("Некорректный ввод. min_time должно быть меньше чем max_time.\n"
-                        "Отправь новый интервал или нажми 'Отмена'")
+            self.__send(state, "Некорректный ввод. min_time должно быть меньше чем max_time.\n"
+                               "Отправь новый интервал или нажми 'Отмена'")
             return
         if min_time <= 0 or max_time <= 0:
-            self.__send("Некорректный ввод. min_time и max_time должны быть больше 0.\n"
-                        "Отправь новый интервал или нажми 'назад' для отмены")
+            self.__send(state, "Некорректный ввод. min_time и max_time должны быть больше 0.\n"
+                               "Отправь новый интервал или нажми 'назад' для отмены")
             return
 
-        self._chosen_reminder.wait_time_range = (min_time, max_time)
-        self._show_menu('reminder_settings')
+        self.__chosen_reminder(state).wait_time_range = (min_time, max_time)
+        self._show_menu(state, 'reminder_settings')
 
     # menu description text senders
 
-    def __send_menu_exit_text(self):
-        self.__send('Выход из настроек. Для того чтобы снова открыть это меню, отправь /settings')
-
-    def __send_main_menu_text(self):
-        self.__send(f'Настройки')
-
-    def __send_toggle_message_hiding_text(self):
-        current_state_string: str = self._item_names.get(str(self._telegram.hide_text)).lower()
-        self.__send(f'Скрывать текст сообщений? Текущее состояние: {current_state_string}')
-
-    def __send_reminder_selector_text(self):
-        self.__send(f'Выбери профиль напоминаний для настройки')
-
-    def __send_reminder_settings_text(self):
-        min_minutes, max_minutes = self._chosen_reminder.wait_time_range
-        self.__send(f'Настраиваем профиль {self._chosen_reminder.name}.\n'
-                    f'Список напоминаний: {self._chosen_reminder.messages}\n'
-                    f'Временной интервал между напоминаниями:\n'
-                    f'От {timedelta(minutes=min_minutes)} до {timedelta(minutes=max_minutes)}\n'
-                    f'Выбери настройку из списка:')
-
-    def __send_reminder_configure_messages_text(self):
-        current_messages_string = reduce(lambda a, b: f'{a};{b}', self._chosen_reminder.messages)
-        self.__send(f'Настраиваем список напоминаний в профиле {self._chosen_reminder.name}.\n'
-                    f'Отправь новый список сообщений, разделенных точкой с запятой, без пробелов между напоминаниями.\n'
-                    f'В списке должно быть как минимум одно напоминание.\n'
-                    f'Текущий список:\n'
-                    f'{current_messages_string}')
-
-    def __send_reminder_configure_time_text(self):
-        min_time, max_time = self._chosen_reminder.wait_time_range
-        self.__send(f'Настраиваем временной интервал между напоминаниями в профиле {self._chosen_reminder.name}.\n'
-                    f'Отправь новый интервал в минутах, два числа разделенных пробелом.\n'
-                    f'Формат: \"min_time max_time\".\n'
-                    f'Текущее значение: {min_time} {max_time}')
+    def __send_menu_exit_text(self, state: MenuSession):
+        self.__send(state, 'Выход из настроек. Для того чтобы снова открыть это меню, отправь /settings')
+
+    def __send_main_menu_text(self, state: MenuSession):
+        self.__send(state, f'Настройки')
+
+    def __send_toggle_message_hiding_text(self, state: MenuSession):
+        current_state_string: str = self._item_names.get(str(self._telegram.is_text_hidden(state.chat_id))).lower()
+        self.__send(state, f'Скрывать текст сообщений? Текущее состояние: {current_state_string}')
+
+    def __send_chat_variables_text(self, state: MenuSession):
+        variables = self._telegram.chat_variables(state.chat_id)
+        current = '\n'.join(f'{name}={value}' for name, value in variables.items()) if variables else 'нет'
+        self.__send(state, f'Переменные подставляются в сообщения этого чата вместо {{имя}}. '
+                           f'Отправь строки вида имя=значение, пустое значение удаляет переменную.\n'
+                           f'Имена из букв, цифр и _, кроме встроенных: {", ".join(BUILTIN_VARIABLES)}.\n'
+                           f'Текущие переменные:\n{current}')
+
+    def __send_reminder_selector_text(self, state: MenuSession):
+        page_count = len(self.__selector_keyboards(state.chat_id))
+        state.selector_page = min(max(state.selector_page, 0), page_count - 1)
+        if page_count > 1:
+            self.__send(state, f'Выбери профиль напоминаний для настройки '
+                               f'(страница {state.selector_page + 1} из {page_count})')
+        else:
+            self.__send(state, f'Выбери профиль напоминаний для настройки')
+
+    def __send_reminder_settings_text(self, state: MenuSession):
+        self.__send(state, self.__reminder_text(state, self.__reminder_settings_text))
+
+    def __send_reminder_configure_messages_text(self, state: MenuSession):
+        self.__send(state, self.__reminder_text(state, self.__reminder_configure_messages_text))
+
+    # depends on the session, so it is not cached with the reminder texts
+    def __send_reminder_import_messages_text(self, state: MenuSession):
+        action = 'удалить из' if state.import_mode == 'remove' else 'добавить в'
+        self.__send(state, f'Отправь файл с сообщениями, которые нужно {action} профиль '
+                           f'{self.__chosen_reminder(state).name}.\n'
+                           f'Форматы: .txt — по сообщению в строке, .csv — первая колонка, '
+                           f'.jsonl — строки JSON или объекты с полем "text".\n'
+                           f'Повторы и сообщения, которые уже есть в списке, не добавляются.')
+
+    def __send_reminder_configure_selection_text(self, state: MenuSession):
+        self.__send(state, self.__reminder_text(state, self.__reminder_configure_selection_text))
+
+    def __send_reminder_configure_time_text(self, state: MenuSession):
+        self.__send(state, self.__reminder_text(state, self.__reminder_configure_time_text))
+
+    # the preview depends on the current time, so it is never cached
+    def __send_reminder_preview_text(self, state: MenuSession):
+        chosen_reminder = self.__chosen_reminder(state)
+        entries = chosen_reminder.schedule(time() + self.PREVIEW_HORIZON)
+        lines = [f'{datetime.fromtimestamp(fire_time):%d.%m %H:%M} — {chosen_reminder.message_at(message_index)}'
+                 for fire_time, message_index in entries[:self.PREVIEW_LIMIT]]
+        if len(entries) > self.PREVIEW_LIMIT:
+            lines.append(f'... и еще {len(entries) - self.PREVIEW_LIMIT}')
+        self.__send(state, f'Расписание профиля {chosen_reminder.name} на сутки, '
+                           f'всего напоминаний: {len(entries)}\n' + '\n'.join(lines))
+
+    # reminder page texts, rebuilt only after the reminder changed
+
+    def __reminder_text(self, state: MenuSession, build: Callable[[Reminder], str]) -> str:
+        reminder = self.__chosen_reminder(state)
+        key = (state.chat_id, reminder.name, state.active_menu_page)
+        cached = self._reminder_texts.get(key)
+        if cached is None or cached[0] != reminder.revision:
+            cached = (reminder.revision, build(reminder))
+            self._reminder_texts[key] = cached
+        return cached[1]
+
+    @staticmethod
+    def __reminder_settings_text(reminder: Reminder) -> str:
+        min_minutes, max_minutes = reminder.wait_time_range
+        return (f'Настраиваем профиль {reminder.name}.\n'
+                f'Список напоминаний ({reminder.message_count}): {BotMenuThread.__messages_preview(reminder)}\n'
+                f'Временной интервал между напоминаниями:\n'
+                f'От {timedelta(minutes=min_minutes)} до {timedelta(minutes=max_minutes)}\n'
+                f'Порядок сообщений: {SELECTION_NAMES.get(reminder.selection, reminder.selection).lower()}\n'
+                f'Состояние: {"приостановлен" if reminder.paused else "работает"}\n'
+                f'Выбери настройку из списка:')
+
+    @staticmethod
+    def __reminder_configure_messages_text(reminder: Reminder) -> str:
+        return (f'Настраиваем список напоминаний в профиле {reminder.name}.\n'
+                f'Отправь новый список сообщений, разделенных точкой с запятой, '
+                f'без пробелов между напоминаниями.\n'
+                f'В списке должно быть как минимум одно напоминание.\n'
+                f'В тексте можно использовать {{profile}}, {{date}}, {{time}}, {{weekday}}, {{number}}, {{total}}, '
+                f'{{count}} и переменные чата.\n'
+                f'Большие списки можно добавить или удалить файлом и выгрузить файлом.\n'
+                f'Текущий список ({reminder.message_count}):\n'
+                f'{BotMenuThread.__messages_preview(reminder)}')
+
+    # lists can hold millions of messages, only the beginning fits into a telegram message
+    @staticmethod
+    def __messages_preview(reminder: Reminder) -> str:
+        count = reminder.message_count
+        shown: list[str] = list()
+        length = 0
+        for index in range(min(count, BotMenuThread.MESSAGES_PREVIEW_LIMIT)):
+            message = reminder.message_at(index)
+            length += len(message) + 1
+            if shown and length > BotMenuThread.MESSAGES_PREVIEW_LENGTH:
+                break
+            shown.append(message[:BotMenuThread.MESSAGES_PREVIEW_LENGTH])
+        preview = ';'.join(shown)
+        if len(shown) < count:
+            preview += f' ... и еще {count - len(shown)}'
+        return preview
+
+    @staticmethod
+    def __reminder_configure_selection_text(reminder: Reminder) -> str:
+        return (f'Настраиваем порядок сообщений в профиле {reminder.name}.\n'
+                f'По кругу — каждое сообщение один раз за круг, без повторов последних — не повторяет '
+                f'{reminder.no_repeat_window} последних, с весами — по полю _weights в config.json.\n'
+                f'Текущий порядок: {SELECTION_NAMES.get(reminder.selection, reminder.selection).lower()}')
+
+    @staticmethod
+    def __reminder_configure_time_text(reminder: Reminder) -> str:
+        min_time, max_time = reminder.wait_time_range
+        return (f'Настраиваем временной интервал между напоминаниями в профиле '
+                f'{reminder.name}.\n'
+                f'Отправь новый интервал в минутах, два числа разделенных пробелом.\n'
+                f'Формат: \"min_time max_time\".\n'
+                f'Текущее значение: {min_time} {max_time}')
 
     # accessors
 
-    @property
-    def last_bot_message(self) -> Message:
-        return self.__last_bot_message
-
-    @last_bot_message.setter
-    def last_bot_message(self, new_message: Message) -> None:
-        self.__delete(self.__last_bot_message)
-        self.__last_bot_message = new_message
-
-    @property
-    def last_user_message(self) -> Message:
-        return self.__last_user_message
+    def __set_last_bot_message(self, state: MenuSession, new_message: Message) -> None:
+        self.__delete(state, state.last_bot_message_id)
+        state.last_bot_message_id = new_message.message_id
 
-    @last_user_message.setter
-    def last_user_message(self, new_message: Message) -> None:
-        self.__delete(self.__last_user_message)
-        self.__last_user_message = new_message
+    def __set_last_user_message(self, state: MenuSession, new_message: Message) -> None:
+        self.__delete(state, state.last_user_message_id)
+        state.last_user_message_id = new_message.message_id
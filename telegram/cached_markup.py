@@ -0,0 +1,14 @@
+from typing import Union
+
+from telebot.types import JsonSerializable, ReplyKeyboardMarkup, ReplyKeyboardRemove
+
+
+# keyboard serialized once, telebot sends the stored json as is
+class CachedMarkup(JsonSerializable):
+    __slots__ = ('_json',)
+
+    def __init__(self, markup: Union[ReplyKeyboardMarkup, ReplyKeyboardRemove]):
+        self._json = markup.to_json()
+
+    def to_json(self) -> str:
+        return self._json
@@ -0,0 +1,141 @@
+from threading import Condition, Thread
+from time import monotonic, sleep
+from typing import Callable
+
+from requests import RequestException
+from telebot import TeleBot
+from telebot.apihelper import ApiException, ApiTelegramException
+
+from metrics import metrics
+
+# Telegram Bot API limit of deleteMessages
+MAX_BATCH = 100
+
+
+class DeleteQueue(Thread):
+    # deletions requested within this many seconds are sent together
+    BATCH_DELAY: float = 0.5
+    MAX_ATTEMPTS: int = 5
+
+    _bot: TeleBot
+    _condition: Condition
+    # message ids waiting for deletion by chat
+    _pending: dict[int, list[int]]
+    # batches to be sent again: not before, chat id, message ids, attempts made
+    _retries: list[tuple[float, int, list[int], int]]
+    _deleted: int
+    _errors: int
+
+    def __init__(self, bot: TeleBot):
+        super().__init__(name='telegram-delete-queue', daemon=True)
+        self._bot = bot
+        self._condition = Condition()
+        self._pending = dict()
+        self._retries = list()
+        self._deleted = 0
+        self._errors = 0
+        metrics.register_gauge('telegram_delete_queue_depth', lambda: self.depth)
+
+    def submit(self, chat_id: int, message_id: int) -> None:
+        with self._condition:
+            self._pending.setdefault(chat_id, list()).append(message_id)
+            self._condition.notify()
+
+    @property
+    def depth(self) -> int:
+        return sum(len(message_ids) for message_ids in self._pending.values()) + \
+            sum(len(message_ids) for _, _, message_ids, _ in self._retries)
+
+    def metrics(self) -> dict[str, float]:
+        return {'depth': self.depth, 'deleted': self._deleted, 'errors': self._errors}
+
+    # worker
+
+    def run(self) -> None:
+        while True:
+            for chat_id, message_ids, attempts in self._take():
+                for start in range(0, len(message_ids), MAX_BATCH):
+                    self._delete(chat_id, message_ids[start:start + MAX_BATCH], attempts)
+
+    def _take(self) -> list[tuple[int, list[int], int]]:
+        with self._condition:
+            while not self._pending and not self.__due_retries(monotonic()):
+                wait = min(due for due, _, _, _ in self._retries) - monotonic() if self._retries else None
+                self._condition.wait(wait)
+        # let the rest of the burst arrive before sending
+        sleep(self.BATCH_DELAY)
+        with self._condition:
+            now = monotonic()
+            batches = [(chat_id, message_ids, 0) for chat_id, message_ids in self._pending.items()]
+            batches.extend((chat_id, message_ids, attempts)
+                           for due, chat_id, message_ids, attempts in self._retries if due <= now)
+            self._retries = [retry for retry in self._retries if retry[0] > now]
+            self._pending = dict()
+        return batches
+
+    def _delete(self, chat_id: int, message_ids: list[int], attempts: int) -> None:
+        try:
+            self.__delete_method(len(message_ids))(chat_id, message_ids)
+        except ApiTelegramException as error:
+            if error.error_code == 429:
+                retry_after = error.result_json.get('parameters', dict()).get('retry_after', 1)
+                metrics.inc('telegram_delete_total', {'result': 'rate_limited'}, len(message_ids))
+                self.__retry(chat_id, message_ids, attempts, retry_after)
+            else:
+                # the messages are already gone or too old, there is nothing to retry
+                metrics.inc('telegram_delete_total', {'result': 'error'}, len(message_ids))
+                self._errors += len(message_ids)
+                print(f'Failed to delete messages {message_ids} in chat {chat_id}: {error.description}')
+            return
+        # network errors, 5xx pages and broken json are retried
+        except (ApiException, RequestException) as error:
+            metrics.inc('telegram_delete_total', {'result': 'error'}, len(message_ids))
+            if attempts + 1 < self.MAX_ATTEMPTS:
+                print(f'Telegram request failed ({attempts + 1}/{self.MAX_ATTEMPTS}): {error!r}')
+                self.__retry(chat_id, message_ids, attempts + 1, min(2 ** (attempts + 1), 30))
+            else:
+                self._errors += len(message_ids)
+                print(f'Failed to delete messages {message_ids} in chat {chat_id}: {error!r}')
+            return
+        # the worker serves every chat, so nothing may stop it
+        except Exception as error:
+            metrics.inc('telegram_delete_total', {'result': 'error'}, len(message_ids))
+            self._errors += len(message_ids)
+            print(f'Failed to delete messages {message_ids} in chat {chat_id}: {error!r}')
+            return
+        metrics.inc('telegram_delete_total', {'result': 'ok'}, len(message_ids))
+        self._deleted += len(message_ids)
+
+    # a single message is deleted with deleteMessage, older telebot versions have no deleteMessages at all
+    def __delete_method(self, count: int) -> Callable[[int, list[int]], None]:
+        if count > 1 and hasattr(self._bot, 'delete_messages'):
+            return self._bot.delete_messages
+        return self.__delete_one_by_one
+
+    # message_ids is left holding the deleted messages on success and the ones still to delete on failure
+    def __delete_one_by_one(self, chat_id: int, message_ids: list[int]) -> None:
+        failed: list[int] = list()
+        for index, message_id in enumerate(message_ids):
+            try:
+                self._bot.delete_message(chat_id, message_id)
+            except ApiTelegramException as error:
+                if error.error_code == 429:
+                    # only the messages not deleted yet are retried
+                    del message_ids[:index]
+                    raise
+                failed.append(message_id)
+                self._errors += 1
+                print(f'Failed to delete message {message_id} in chat {chat_id}: {error.description}')
+            except (ApiException, RequestException):
+                del message_ids[:index]
+                raise
+        for message_id in failed:
+            message_ids.remove(message_id)
+
+    def __retry(self, chat_id: int, message_ids: list[int], attempts: int, delay: float) -> None:
+        with self._condition:
+            self._retries.append((monotonic() + delay, chat_id, message_ids, attempts))
+            self._condition.notify()
+
+    def __due_retries(self, now: float) -> bool:
+        return any(due <= now for due, _, _, _ in self._retries)
@@ -0,0 +1,289 @@
+from collections import deque
+from concurrent.futures import Future
+from itertools import islice
+from threading import Condition, Thread
+from time import monotonic, perf_counter
+from typing import Optional, Union
+
+from requests import RequestException
+from telebot import TeleBot
+from telebot.apihelper import ApiException, ApiTelegramException
+from telebot.types import MessageEntity, ReplyKeyboardMarkup, ReplyKeyboardRemove
+
+from metrics import metrics
+
+# lanes are served in ascending order
+PRIORITY_MENU = 0
+PRIORITY_REMINDER = 1
+
+# Telegram Bot API limits
+MAX_MESSAGE_LENGTH = 4096
+CHAT_RATE = 1.0
+GROUP_CHAT_RATE = 20 / 60
+GLOBAL_RATE = 30.0
+
+
+def utf16_length(text: str) -> int:
+    return len(text.encode('utf-16-le')) // 2
+
+
+class TokenBucket:
+    __slots__ = ('_rate', '_capacity', '_tokens', '_updated_at', '_blocked_until')
+
+    def __init__(self, rate: float, capacity: float):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated_at = monotonic()
+        self._blocked_until = 0.0
+
+    # seconds until a token is available
+    def delay(self, now: float) -> float:
+        self._refill(now)
+        wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self._rate
+        return max(wait, self._blocked_until - now)
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self._tokens -= 1
+
+    def block(self, now: float, seconds: float) -> None:
+        self._blocked_until = max(self._blocked_until, now + seconds)
+        self._tokens = 0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate)
+        self._updated_at = now
+
+
+class OutboundMessage:
+    __slots__ = ('chat_id', 'text', 'entities', 'keyboard_markup', 'priority', 'enqueued_at', 'attempts', 'futures')
+
+    def __init__(self,
+                 chat_id: int,
+                 text: str,
+                 entities: Optional[list[MessageEntity]],
+                 keyboard_markup: Optional[Union[ReplyKeyboardMarkup, ReplyKeyboardRemove]],
+                 priority: int):
+        self.chat_id = chat_id
+        self.text = text
+        self.entities = entities
+        self.keyboard_markup = keyboard_markup
+        self.priority = priority
+        self.enqueued_at = monotonic()
+        self.attempts = 0
+        self.futures: list[Future] = [Future()]
+
+    @property
+    def coalescible(self) -> bool:
+        return self.priority == PRIORITY_REMINDER and self.keyboard_markup is None
+
+
+class SendQueue(Thread):
+    # how many queued messages are inspected when looking for a chat that is not rate limited
+    SCAN_DEPTH: int = 64
+    MAX_ATTEMPTS: int = 5
+    # longest backoff between attempts of a failed request, seconds
+    MAX_RETRY_DELAY: float = 30
+    LATENCY_WINDOW: int = 1000
+
+    _bot: TeleBot
+    _lanes: dict[int, deque[OutboundMessage]]
+    _condition: Condition
+    _global_bucket: TokenBucket
+    _chat_buckets: dict[int, TokenBucket]
+    _latencies: deque[float]
+    _sent: int
+    _coalesced: int
+    _rate_limited: int
+    _errors: int
+    # a message is taken from the lanes and being sent
+    _delivering: bool
+
+    def __init__(self, bot: TeleBot):
+        super().__init__(name='telegram-send-queue', daemon=True)
+        self._bot = bot
+        self._lanes = {PRIORITY_MENU: deque(), PRIORITY_REMINDER: deque()}
+        self._condition = Condition()
+        self._global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+        self._chat_buckets = dict()
+        self._latencies = deque(maxlen=self.LATENCY_WINDOW)
+        self._sent = 0
+        self._coalesced = 0
+        self._rate_limited = 0
+        self._errors = 0
+        self._delivering = False
+        metrics.register_gauge('telegram_send_queue_depth', lambda: self.depth)
+
+    def submit(self,
+               chat_id: int,
+               text: str,
+               entities: Optional[list[MessageEntity]] = None,
+               keyboard_markup: Optional[Union[ReplyKeyboardMarkup, ReplyKeyboardRemove]] = None,
+               priority: int = PRIORITY_REMINDER) -> Future:
+        message = OutboundMessage(chat_id, text, entities, keyboard_markup, priority)
+        with self._condition:
+            self._lanes[priority].append(message)
+            # drain waits on the same condition
+            self._condition.notify_all()
+        return message.futures[0]
+
+    # waits until every queued message is sent or has failed, returns how many are still queued after timeout
+    def drain(self, timeout: float) -> int:
+        deadline = monotonic() + timeout
+        with self._condition:
+            while self.depth or self._delivering:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return self.depth + self._delivering
+
+    # metrics
+
+    @property
+    def depth(self) -> int:
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def metrics(self) -> dict[str, float]:
+        with self._condition:
+            latencies = sorted(self._latencies)
+            lane_depths = {priority: len(lane) for priority, lane in self._lanes.items()}
+        result: dict[str, float] = {
+            'depth': sum(lane_depths.values()),
+            'depth_menu': lane_depths[PRIORITY_MENU],
+            'depth_reminder': lane_depths[PRIORITY_REMINDER],
+            'sent': self._sent,
+            'coalesced': self._coalesced,
+            'rate_limited': self._rate_limited,
+            'errors': self._errors
+        }
+        if latencies:
+            result['latency_p50'] = latencies[len(latencies) // 2]
+            result['latency_p99'] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            result['latency_max'] = latencies[-1]
+        return result
+
+    # worker
+
+    def run(self) -> None:
+        while True:
+            message = self._take()
+            try:
+                self._deliver(message)
+            finally:
+                with self._condition:
+                    self._delivering = False
+                    self._condition.notify_all()
+
+    def _take(self) -> OutboundMessage:
+        with self._condition:
+            while True:
+                now = monotonic()
+                wait: Optional[float] = None
+                global_delay = self._global_bucket.delay(now)
+                for priority in sorted(self._lanes):
+                    lane = self._lanes[priority]
+                    for index, message in enumerate(islice(lane, self.SCAN_DEPTH)):
+                        delay = max(global_delay, self._chat_bucket(message.chat_id).delay(now))
+                        if delay <= 0:
+                            del lane[index]
+                            self._delivering = True
+                            self._consume(message.chat_id, now)
+                            return self._coalesce(message, lane)
+                        wait = delay if wait is None else min(wait, delay)
+                self._condition.wait(wait)
+
+    # merges queued reminders for the same chat into the taken one
+    def _coalesce(self, message: OutboundMessage, lane: deque[OutboundMessage]) -> OutboundMessage:
+        if not message.coalescible:
+            return message
+        length = utf16_length(message.text)
+        merged = [item for item in islice(lane, self.SCAN_DEPTH)
+                  if item.chat_id == message.chat_id and item.coalescible]
+        for item in merged:
+            item_length = utf16_length(item.text)
+            if length + 2 + item_length > MAX_MESSAGE_LENGTH:
+                break
+            lane.remove(item)
+            offset = length + 2
+            if item.entities:
+                shifted = [MessageEntity(entity.type, entity.offset + offset, entity.length) for entity in item.entities]
+                message.entities = (message.entities or list()) + shifted
+            message.text = f'{message.text}\n\n{item.text}'
+            message.futures.extend(item.futures)
+            length = offset + item_length
+            self._coalesced += 1
+        return message
+
+    def _deliver(self, message: OutboundMessage) -> None:
+        message.attempts += 1
+        started = perf_counter()
+        try:
+            result = self._bot.send_message(message.chat_id,
+                                            message.text,
+                                            entities=message.entities,
+                                            reply_markup=message.keyboard_markup)
+        except ApiTelegramException as error:
+            metrics.observe('telegram_send_seconds', perf_counter() - started)
+            if error.error_code == 429:
+                metrics.inc('telegram_send_total', {'result': 'rate_limited'})
+                retry_after = error.result_json.get('parameters', dict()).get('retry_after', 1)
+                print(f'Telegram rate limit hit for chat {message.chat_id}, retry after {retry_after}s')
+                self._rate_limited += 1
+                self._retry(message, retry_after)
+            else:
+                metrics.inc('telegram_send_total', {'result': 'error'})
+                self._fail(message, error)
+            return
+        # network errors, 5xx pages and broken json are retried, the backoff only holds back the message's chat
+        except (ApiException, RequestException) as error:
+            metrics.observe('telegram_send_seconds', perf_counter() - started)
+            metrics.inc('telegram_send_total', {'result': 'error'})
+            if message.attempts < self.MAX_ATTEMPTS:
+                print(f'Telegram request failed ({message.attempts}/{self.MAX_ATTEMPTS}): {error!r}')
+                self._retry(message, min(2 ** message.attempts, self.MAX_RETRY_DELAY))
+            else:
+                self._fail(message, error)
+            return
+        # the worker serves every chat, so nothing may stop it
+        except Exception as error:
+            metrics.observe('telegram_send_seconds', perf_counter() - started)
+            metrics.inc('telegram_send_total', {'result': 'error'})
+            self._fail(message, error)
+            return
+
+        metrics.observe('telegram_send_seconds', perf_counter() - started)
+        metrics.inc('telegram_send_total', {'result': 'ok'})
+        self._sent += 1
+        now = monotonic()
+        metrics.observe('telegram_send_queue_latency_seconds', now - message.enqueued_at)
+        for future in message.futures:
+            future.set_result(result)
+        with self._condition:
+            self._latencies.append(now - message.enqueued_at)
+
+    def _retry(self, message: OutboundMessage, retry_after: float) -> None:
+        with self._condition:
+            self._chat_bucket(message.chat_id).block(monotonic(), retry_after)
+            self._lanes[message.priority].appendleft(message)
+            self._condition.notify_all()
+
+    def _fail(self, message: OutboundMessage, error: Exception) -> None:
+        self._errors += 1
+        print(f'Failed to send message to chat {message.chat_id}: {error!r}')
+        for future in message.futures:
+            future.set_exception(error)
+
+    def _consume(self, chat_id: int, now: float) -> None:
+        self._global_bucket.consume(now)
+        self._chat_bucket(chat_id).consume(now)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # negative ids belong to groups and channels, which have a stricter limit
+            rate = GROUP_CHAT_RATE if chat_id < 0 else CHAT_RATE
+            bucket = TokenBucket(rate, 1)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
@@ -0,0 +1,123 @@
+import atexit
+import json
+import os
+from collections import OrderedDict
+from threading import Lock
+from time import time
+from typing import Optional
+
+from config.persistence import ConfigWriter, serialize_value
+from metrics import metrics
+
+# a session belongs to one user in one chat
+SessionKey = tuple[int, int]
+
+
+class MenuSession:
+    # messages are kept by id only, which is all that is needed to delete them
+    __slots__ = ('chat_id', 'user_id', 'active_menu_page', 'chosen_reminder', 'last_user_message_id',
+                 'last_bot_message_id', 'touched_at', 'selector_page', 'import_mode', 'lock')
+
+    def __init__(self,
+                 chat_id: int,
+                 user_id: int,
+                 active_menu_page: str = 'none',
+                 chosen_reminder: Optional[str] = None,
+                 last_user_message_id: Optional[int] = None,
+                 last_bot_message_id: Optional[int] = None,
+                 touched_at: Optional[float] = None,
+                 selector_page: int = 0,
+                 import_mode: Optional[str] = None):
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.active_menu_page = active_menu_page
+        self.chosen_reminder = chosen_reminder
+        self.last_user_message_id = last_user_message_id
+        self.last_bot_message_id = last_bot_message_id
+        self.touched_at = time() if touched_at is None else touched_at
+        self.selector_page = selector_page
+        # what an uploaded message list does to the chosen reminder: 'append' or 'remove'
+        self.import_mode = import_mode
+        # held while an update of the session is handled
+        self.lock = Lock()
+
+    def to_list(self) -> list:
+        return [self.active_menu_page, self.chosen_reminder, self.last_user_message_id, self.last_bot_message_id,
+                self.touched_at, self.selector_page, self.import_mode]
+
+
+class SessionStore:
+    # sessions idle for longer than ttl seconds are dropped
+    _ttl: float
+    _path: Optional[str]
+    _sessions: OrderedDict[SessionKey, MenuSession]
+    _lock: Lock
+    _writer: Optional[ConfigWriter]
+
+    def __init__(self, ttl: float = 3600, path: Optional[str] = None):
+        self._ttl = ttl
+        self._path = path
+        self._sessions = OrderedDict()
+        self._lock = Lock()
+        self._writer = None
+        if path is not None:
+            self.__load(path)
+            self._writer = ConfigWriter(path, self.__serialize, delay=5.0)
+            atexit.register(self._writer.flush)
+        metrics.register_gauge('menu_sessions', lambda: len(self._sessions))
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    # the session is created on first use and moved to the most recently used end
+    def get(self, chat_id: int, user_id: int) -> MenuSession:
+        now = time()
+        key = (chat_id, user_id)
+        with self._lock:
+            self.__evict(now)
+            session = self._sessions.get(key)
+            if session is None:
+                session = MenuSession(chat_id, user_id, touched_at=now)
+                self._sessions[key] = session
+            else:
+                self._sessions.move_to_end(key)
+                session.touched_at = now
+        return session
+
+    # called after a session was changed
+    def save(self, session: MenuSession) -> None:
+        if self._writer is not None:
+            self._writer.mark_dirty()
+
+    def flush(self) -> None:
+        if self._writer is not None:
+            self._writer.flush()
+
+    # sessions are ordered by last use, so only the expired head is inspected
+    def __evict(self, now: float) -> None:
+        evicted = False
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+            if now - session.touched_at < self._ttl:
+                break
+            del self._sessions[key]
+            evicted = True
+        if evicted and self._writer is not None:
+            self._writer.mark_dirty()
+
+    def __load(self, path: str) -> None:
+        if not os.path.exists(path):
+            return
+        with open(path, 'r', encoding='utf8') as json_file:
+            loaded_data: dict[str, list] = json.load(json_file)
+        now = time()
+        sessions = [MenuSession(*map(int, key.split(':')), *values) for key, values in loaded_data.items()]
+        for session in sorted(sessions, key=lambda current: current.touched_at):
+            if now - session.touched_at < self._ttl:
+                self._sessions[(session.chat_id, session.user_id)] = session
+
+    def __serialize(self) -> list[str]:
+        with self._lock:
+            serialized = {f'{chat_id}:{user_id}': session.to_list()
+                          for (chat_id, user_id), session in self._sessions.items()}
+        return serialize_value(serialized, 0)
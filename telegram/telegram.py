@@ -1,43 +1,121 @@
-from typing import Optional
+import tempfile
+from concurrent.futures import Future
+from typing import BinaryIO, Optional
 
+import requests
 from telebot import TeleBot
-from telebot.types import MessageEntity, ReplyKeyboardMarkup, Message
+from telebot.types import InputFile, MessageEntity, ReplyKeyboardMarkup, Message
 from config import Config
+from .delete_queue import DeleteQueue
+from .send_queue import SendQueue, PRIORITY_MENU, PRIORITY_REMINDER, utf16_length
 
 
 class Telegram:
+    # bot api limit for files downloaded by bots
+    MAX_DOWNLOAD_SIZE: int = 20 * 1024 * 1024
+    DOWNLOAD_CHUNK_SIZE: int = 64 * 1024
+    DOWNLOAD_TIMEOUT: float = 60
+    # seconds the menu waits for its message, retries of failed requests included
+    SEND_TIMEOUT: float = 60
+
     bot: TeleBot
     _config: Config
+    _send_queue: SendQueue
+    _delete_queue: DeleteQueue
 
-    def __init__(self):
-        self._config = Config()
+    # the config is shared with the rest of the bot, a second instance would parse the file again and diverge
+    def __init__(self, config: Config):
+        self._config = config
         self.bot = TeleBot(self._tg_key, threaded=False)
+        self._send_queue = SendQueue(self.bot)
+        self._send_queue.start()
+        self._delete_queue = DeleteQueue(self.bot)
+        self._delete_queue.start()
 
     # messages
 
+    # blocks until the message is delivered, used by the menu which needs the sent message back
+    # raises concurrent.futures.TimeoutError when it is not delivered within SEND_TIMEOUT
     def send(self,
              message: str,
              hide_text: Optional[bool] = None,
-             keyboard_markup: Optional[ReplyKeyboardMarkup] = None) -> Message:
+             keyboard_markup: Optional[ReplyKeyboardMarkup] = None,
+             chat_id: Optional[int] = None) -> Message:
+        return self._send(message, hide_text, keyboard_markup, chat_id, PRIORITY_MENU).result(self.SEND_TIMEOUT)
+
+    # queues the message and returns immediately
+    def send_async(self,
+                   message: str,
+                   hide_text: Optional[bool] = None,
+                   keyboard_markup: Optional[ReplyKeyboardMarkup] = None,
+                   chat_id: Optional[int] = None) -> Future:
+        return self._send(message, hide_text, keyboard_markup, chat_id, PRIORITY_REMINDER)
+
+    def _send(self,
+              message: str,
+              hide_text: Optional[bool],
+              keyboard_markup: Optional[ReplyKeyboardMarkup],
+              chat_id: Optional[int],
+              priority: int) -> Future:
+        if chat_id is None:
+            chat_id = self.chat_id
         entities: Optional[list[MessageEntity]] = None
         if hide_text is None:
-            hide_text = self.hide_text
+            hide_text = self.is_text_hidden(chat_id)
+        # reminder messages arrive rendered from their templates, the offsets count utf-16 units of the text as sent
         if hide_text:
-            entities = [MessageEntity('spoiler', 0, len(message))]
-        return self._send(message, entities=entities, keyboard_markup=keyboard_markup)
+            entities = [MessageEntity('spoiler', 0, utf16_length(message))]
+        return self._send_queue.submit(chat_id, message, entities, keyboard_markup, priority)
 
-    def _send(self,
-              message: str,
-              entities: Optional[list[MessageEntity]] = None,
-              keyboard_markup: Optional[ReplyKeyboardMarkup] = None
-              ) -> Message:
-        return self.bot.send_message(self.chat_id, message, entities=entities, reply_markup=keyboard_markup)
+    # queues the deletion and returns immediately, deletions are sent in batches
+    def delete_message(self, message_id: int, chat_id: Optional[int] = None) -> None:
+        self._delete_queue.submit(self.chat_id if chat_id is None else chat_id, message_id)
+
+    # documents
+
+    # the document is streamed to a temporary file, which is removed once closed
+    def download_document(self, file_id: str) -> BinaryIO:
+        document = tempfile.TemporaryFile()
+        try:
+            with requests.get(self.bot.get_file_url(file_id), stream=True, timeout=self.DOWNLOAD_TIMEOUT) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(self.DOWNLOAD_CHUNK_SIZE):
+                    document.write(chunk)
+        except BaseException:
+            document.close()
+            raise
+        document.seek(0)
+        return document
 
-    def delete_message(self, message_id: int) -> None:
-        self.bot.delete_message(self.chat_id, message_id)
+    # sent right away, not through the send queue: documents are only sent on request from the menu
+    def send_document(self, document: BinaryIO, file_name: str, chat_id: Optional[int] = None) -> Message:
+        return self.bot.send_document(self.chat_id if chat_id is None else chat_id, InputFile(document, file_name))
+
+    # per chat settings
+
+    def is_text_hidden(self, chat_id: int) -> bool:
+        chat_config = self._config.chats.get(chat_id)
+        return chat_config is not None and chat_config.hide_text
+
+    def set_text_hidden(self, chat_id: int, value: bool) -> None:
+        self._config.add_chat(chat_id).hide_text = value
+
+    def chat_variables(self, chat_id: int) -> dict[str, str]:
+        return self._config.chat_variables(chat_id)
+
+    def set_chat_variables(self, chat_id: int, variables: dict[str, str]) -> None:
+        self._config.set_chat_variables(chat_id, variables)
 
     # getters
 
+    @property
+    def send_queue(self) -> SendQueue:
+        return self._send_queue
+
+    @property
+    def delete_queue(self) -> DeleteQueue:
+        return self._delete_queue
+
     @property
     def _tg_key(self) -> str:
         return self._config.tg_key
@@ -0,0 +1,173 @@
+import asyncio
+import hmac
+import json
+import secrets
+from queue import Full, Queue
+from threading import Thread
+from time import monotonic
+from typing import Optional
+
+from telebot import TeleBot
+from telebot.types import Update
+
+from metrics import metrics
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class ChatDispatcher:
+    # every chat is pinned to one worker, so updates of a chat are handled in the order they came in
+    _bot: TeleBot
+    _queues: list[Queue]
+    _workers: list[Thread]
+
+    def __init__(self, bot: TeleBot, workers: int, queue_size: int):
+        self._bot = bot
+        self._queues = [Queue(maxsize=queue_size) for _ in range(workers)]
+        self._workers = [Thread(target=self.__work, args=(queue,), name=f'webhook-worker-{index}', daemon=True)
+                         for index, queue in enumerate(self._queues)]
+        for worker in self._workers:
+            worker.start()
+        metrics.register_gauge('webhook_queue_depth', lambda: self.depth)
+
+    @property
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    # returns False when the worker of the chat is full, Telegram redelivers the update later
+    def dispatch(self, update: Update) -> bool:
+        queue = self._queues[self.__chat_id(update) % len(self._queues)]
+        try:
+            queue.put_nowait((monotonic(), update))
+        except Full:
+            return False
+        return True
+
+    def __work(self, queue: Queue) -> None:
+        while True:
+            received_at, update = queue.get()
+            metrics.observe('webhook_queue_wait_seconds', monotonic() - received_at)
+            try:
+                self._bot.process_new_updates([update])
+            except Exception as error:
+                print(f'Failed to handle update {update.update_id}: {error!r}')
+
+    @staticmethod
+    def __chat_id(update: Update) -> int:
+        for message in (update.message, update.edited_message, update.channel_post, update.edited_channel_post):
+            if message is not None:
+                return message.chat.id
+        if update.callback_query is not None and update.callback_query.message is not None:
+            return update.callback_query.message.chat.id
+        return 0
+
+
+class WebhookServer:
+    _bot: TeleBot
+    _url: str
+    _host: str
+    _port: int
+    _path: str
+    _secret_token: str
+    _dispatcher: ChatDispatcher
+    # set while serving
+    _loop: Optional[asyncio.AbstractEventLoop]
+    _server: Optional[asyncio.Server]
+
+    def __init__(self,
+                 bot: TeleBot,
+                 url: str,
+                 host: str = '0.0.0.0',
+                 port: int = 8443,
+                 secret_token: Optional[str] = None,
+                 workers: int = 4,
+                 queue_size: int = 100):
+        self._bot = bot
+        self._url = url
+        self._host = host
+        self._port = port
+        # the path of the public url is the one Telegram posts to, a reverse proxy may sit in front
+        self._path = '/' + url.split('://', 1)[-1].partition('/')[2]
+        # without a configured token a random one is registered for this run
+        self._secret_token = secret_token if secret_token else secrets.token_urlsafe(32)
+        self._dispatcher = ChatDispatcher(bot, workers, queue_size)
+        self._loop = None
+        self._server = None
+
+    @property
+    def dispatcher(self) -> ChatDispatcher:
+        return self._dispatcher
+
+    def serve_forever(self) -> None:
+        # updates queued while the bot was down are kept and delivered to the new server
+        self._bot.set_webhook(self._url, secret_token=self._secret_token)
+        print(f'Webhook {self._url} is served on {self._host}:{self._port}')
+        asyncio.run(self.__serve())
+
+    # stops accepting updates, Telegram keeps the undelivered ones and sends them again after a restart
+    def stop(self) -> None:
+        if self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+
+    async def __serve(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self.__handle_connection, self._host, self._port)
+        async with self._server:
+            try:
+                await self._server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    async def __handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            # connections are kept alive, Telegram reuses them for the next updates
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers: dict[str, str] = dict()
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY_SIZE:
+                    await self.__respond(writer, 413, 'Payload Too Large')
+                    break
+                body = await reader.readexactly(length) if length else b''
+                status, reason = self.__handle_request(method, path, headers, body)
+                await self.__respond(writer, status, reason)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def __handle_request(self, method: str, path: str, headers: dict[str, str], body: bytes) -> tuple[int, str]:
+        if path.split('?', 1)[0] != self._path:
+            return 404, 'Not Found'
+        if method != 'POST':
+            return 405, 'Method Not Allowed'
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, ''), self._secret_token):
+            metrics.inc('webhook_updates_total', {'result': 'forbidden'})
+            return 403, 'Forbidden'
+        try:
+            update = Update.de_json(json.loads(body))
+        except (ValueError, KeyError, TypeError):
+            metrics.inc('webhook_updates_total', {'result': 'malformed'})
+            return 400, 'Bad Request'
+        if not self._dispatcher.dispatch(update):
+            metrics.inc('webhook_updates_total', {'result': 'overloaded'})
+            return 503, 'Service Unavailable'
+        metrics.inc('webhook_updates_total', {'result': 'accepted'})
+        return 200, 'OK'
+
+    @staticmethod
+    async def __respond(writer: asyncio.StreamWriter, status: int, reason: str) -> None:
+        writer.write(f'HTTP/1.1 {status} {reason}\r\nContent-Length: 0\r\n\r\n'.encode('latin-1'))
+        await writer.drain()